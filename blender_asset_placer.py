@@ -1,5 +1,5 @@
 ### blender_asset_placer.py
-### imports recipe dict and exports scene
+### imports recipe dict and exports the interior scene (the boundary geometry is written by geometry.py)
 ###   H. Erwich
 ###  23-05-2023
 import sys # get recipe and mockup scene dir
@@ -7,19 +7,24 @@ argv = sys.argv
 argv = argv[argv.index("--") + 1:] # get all the args after " -- "
 recipe_dir = argv[0]    # recipe folder
 geometry_dir = argv[1]  # blender export folder
+shard_file = argv[2] if len(argv) > 2 else None # optional file with the environments of this worker, all recipes when omitted
 
 import bpy
 import os
-import glob
-import json
-import random
+import traceback
 import numpy as np
+from mathutils import Euler, Matrix, Vector
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__))) # recipe_io is located next to this script
+from recipe_io import load_recipes, read_shard
 
 class Utils:
     # Useful utilities and shortcuts
+    # the scene is built with the data API (bpy.data), operators are only used to import mockups and export files
     def __init__(self):
         self.blend_file_path = bpy.data.filepath
         self.directory = os.path.dirname(self.blend_file_path)
+        self.collection = bpy.context.scene.collection
+        self.mockups = {} # {mockup file: [(mesh, matrix_world)]}, every mockup is imported once
 
     def get_asset_name(self, path_str):
         asset_name = path_str.rsplit('/', 1)[-1][:-4] #returns object name, [:-4] to remove .usd/.obj
@@ -29,21 +34,23 @@ class Utils:
         bpy.ops.wm.usd_import(filepath=filepath, scale=scale) #import .usd file, scale set for correct import
 
     def set_active_ob(self, asset_str):
-        ob = bpy.context.scene.objects[asset_str]    # Get the object
-        bpy.ops.object.select_all(action='DESELECT') # Deselect all objects
-        bpy.context.view_layer.objects.active = ob   # Make the object the active object 
+        ob = bpy.data.objects[asset_str]             # Get the object
+        self.deselect_all()                          # Deselect all objects
+        bpy.context.view_layer.objects.active = ob   # Make the object the active object
         ob.select_set(True)                          # Select the object
-  
+
+    def deselect_all(self):
+        for ob in bpy.context.view_layer.objects:
+            ob.select_set(False)
+
+    # removes all objects and the meshes without users, the cached mockup meshes are kept
     def delete_all(self):
-        bpy.ops.object.select_all(action='SELECT')
-        bpy.ops.object.delete(use_global=False)
-   
-    def get_ob_dimensions(self):
-        return bpy.context.object.dimensions
-
-    def obj_import(self, filepath):
-        bpy.ops.wm.obj_import(filepath=filepath)
-   
+        for ob in list(bpy.data.objects):
+            bpy.data.objects.remove(ob, do_unlink=True)
+        for mesh in list(bpy.data.meshes):
+            if mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+
     def obj_export(self, filename):
         target_file = os.path.join(self.directory, str(filename))
         bpy.ops.export_scene.obj(filepath=target_file,
@@ -57,78 +64,50 @@ class Utils:
                                 use_selection=selection,
                                 ascii=text, # required to combine them with the cat command
                                 axis_forward='Y', axis_up='Z')
-                             
-    def place_boundary_cube(self, scale):
-        bpy.ops.mesh.primitive_cube_add(enter_editmode=False, align='WORLD', 
-                                        location=(0.5*scale[0], 0.5*scale[1], 0.5*scale[2]), 
-                                        scale=(0.5*scale[0], 0.5*scale[1], 0.5*scale[2]))
-
-    def translate(self, position):
-        bpy.ops.transform.translate(value=(position[0], position[1], position[2]), 
-                                    orient_axis_ortho='X', 
-                                    orient_type='GLOBAL', 
-                                    orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), 
-                                    orient_matrix_type='GLOBAL', 
-                                    constraint_axis=(True, True, False), 
-                                    mirror=False, use_proportional_edit=False, 
-                                    proportional_edit_falloff='SMOOTH', 
-                                    proportional_size=1, 
-                                    use_proportional_connected=False, 
-                                    use_proportional_projected=False, 
-                                    snap=False, 
-                                    snap_elements={'INCREMENT'}, 
-                                    use_snap_project=False, 
-                                    snap_target='CLOSEST', 
-                                    use_snap_self=True, 
-                                    use_snap_edit=True, 
-                                    use_snap_nonedit=True, 
-                                    use_snap_selectable=False, 
-                                    release_confirm=True)
-    
-    def rotate(self, degrees):
-        bpy.context.active_object.rotation_euler[0] = np.radians(degrees[0])
-        bpy.context.active_object.rotation_euler[1] = np.radians(degrees[1])
-        bpy.context.active_object.rotation_euler[2] = np.radians(degrees[2])
-
-    def rotate2(self, degrees):
-        bpy.ops.transform.rotate(value=np.radians(degrees[0]), orient_axis='X') # TODO: check if other axis also need sign change
-        bpy.ops.transform.rotate(value=np.radians(degrees[1]), orient_axis='Y')
-        bpy.ops.transform.rotate(value=np.radians(-degrees[2]), orient_axis='Z') # minus to match transform function function in isaac sim
-
-    def scale(self, scale):
-        bpy.context.active_object.scale[0] = 0.5*scale[0]
-        bpy.context.active_object.scale[1] = 0.5*scale[1]
-        bpy.context.active_object.scale[2] = 0.5*scale[2]
-    
-    # def apply_modifiers(obj):
-    #     ctx = bpy.context.copy()
-    #     ctx['object'] = obj
-    #     for _, m in enumerate(obj.modifiers):
-    #         try:
-    #             ctx['modifier'] = m
-    #             bpy.ops.object.modifier_apply(ctx, modifier=m.name)
-    #         except RuntimeError:
-    #             print(f"Error applying {m.name} to {obj.name}, removing it instead.")
-    #             obj.modifiers.remove(m)
-
-    #     for m in obj.modifiers:
-    #         obj.modifiers.remove(m)
-
-                     
-##################################################################                                     
+
+    # new object in the scene, objects sharing a mesh are linked duplicates (the mesh is stored once)
+    def add_object(self, name, mesh, matrix):
+        ob = bpy.data.objects.new(name, mesh)
+        ob.matrix_world = matrix
+        self.collection.objects.link(ob)
+        return ob
+
+    def rotation(self, degrees):
+        return Euler([float(np.radians(d)) for d in degrees]) # XYZ euler angles
+
+    # same rotation as bpy.ops.transform.rotate by X, Y and minus Z (which rotate opposite to the euler angles),
+    # minus Z to match the transform function in isaac sim
+    def rotation2(self, degrees):
+        return self.rotation([-degrees[0], -degrees[1], degrees[2]]) # TODO: check if other axis also need sign change
+
+    # meshes (and their transforms) of a mockup, imported on first use and kept for all following recipes
+    def mockup(self, filepath):
+        if filepath not in self.mockups:
+            self.deselect_all()
+            bpy.ops.wm.obj_import(filepath=filepath)
+            parts = []
+            for ob in list(bpy.context.selected_objects):
+                ob.data.use_fake_user = True # keep the mesh when its last object is removed
+                parts.append((ob.data, ob.matrix_world.copy()))
+                bpy.data.objects.remove(ob, do_unlink=True)
+            self.mockups[filepath] = parts
+        return self.mockups[filepath]
+
+    # linked duplicate of the mockup of an interior asset
+    def place_mockup(self, asset):
+        matrix = Matrix.LocRotScale(Vector(asset["location"]), self.rotation2(asset["orientation"]), None)
+        for mesh, part_matrix in self.mockup(asset["mockup_file"]):
+            self.add_object(asset["asset_id"], mesh, matrix @ part_matrix)
+
+
+##################################################################
 ############################# MAIN ###############################
 ##################################################################
 u = Utils()
 u.delete_all() # deletes default objects in the scene
-recipes = glob.glob(f"{recipe_dir}*.txt") # gather all recipes
 
-# build each recipe
-for rec_loc in recipes:
+def build_recipe(recipe):
     u.delete_all()
-    # reading the recipe from the file
-    with open(rec_loc) as f:
-        data = f.read()
-    recipe = json.loads(data) # reconstructing the data as a dictionary
 
     # create mesh geometry and gaden geometry directory if it does not exist already
     mesh_dir = f"{geometry_dir}{recipe['env_type']}_{recipe['env_id']}/mesh/"
@@ -136,81 +115,32 @@ for rec_loc in recipes:
     os.makedirs(mesh_dir, exist_ok=True)
     os.makedirs(gaden_dir, exist_ok=True)
 
-    # place boundaries and export
-    for plane in recipe["sides"]:
-        bpy.ops.mesh.primitive_plane_add(enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-        for obj in bpy.context.selected_objects: # rename object with asset id
-            obj.name = plane["asset_id"]        
-        u.scale(plane["dimensions"])
-        u.rotate(plane["orientation"])
-        u.translate(plane["location"])
-
-    u.stl_export(f"{mesh_dir}/sides.stl")
-
-    # place inlet and export
-    u.delete_all()
-    for plane in recipe["inlets"]:
-        bpy.ops.mesh.primitive_plane_add(enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-        for obj in bpy.context.selected_objects: # rename object with asset id
-            obj.name = plane["asset_id"]        
-        u.scale(plane["dimensions"])
-        u.rotate(plane["orientation"])
-        u.translate(plane["location"])
-
-    u.stl_export(f"{mesh_dir}/inlet.stl")
-
-    # place outlet and export
-    u.delete_all()
-    for plane in recipe["outlets"]:
-        bpy.ops.mesh.primitive_plane_add(enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-        for obj in bpy.context.selected_objects: # rename object with asset id
-            obj.name = plane["asset_id"]        
-        u.scale(plane["dimensions"])
-        u.rotate(plane["orientation"])
-        u.translate(plane["location"])
-
-    u.stl_export(f"{mesh_dir}/outlet.stl")
-
     # place interior and export
-    u.delete_all()
     for asset in recipe["interior"]:
-        u.obj_import(asset["mockup_file"])
-        for obj in bpy.context.selected_objects: # rename object with asset id
-            obj.name = asset["asset_id"]
-        u.rotate2(asset["orientation"])
-        u.translate(asset["location"]) # translate object to specified location#
+        u.place_mockup(asset)
 
     u.stl_export(f"{mesh_dir}/interior.stl")
     u.stl_export(f"{gaden_dir}/interior_ascii.stl")
     u.stl_export(f"{gaden_dir}/interior_binary.stl",text=False)
 
-    # gaden only geometry
-    u.delete_all()
-    for cube in recipe["gaden_geom"]:
-        bpy.ops.mesh.primitive_cube_add(enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-        for obj in bpy.context.selected_objects: # rename object with asset id
-            obj.name = cube["asset_id"]      
-        u.scale(cube["dimensions"])
-        u.rotate(cube["orientation"])
-        u.translate(cube["location"])
-        if 'wall' not in cube["asset_id"]:
-            u.stl_export(f"{gaden_dir}/{cube['asset_id']}_ascii.stl",selection=True)
-            u.stl_export(f"{gaden_dir}/{cube['asset_id']}_binary.stl",selection=True, text=False)
-        elif 'inside' not in cube["asset_id"]: #TODO inside is still being exported?
-            u.stl_export(f"{gaden_dir}/{cube['asset_id']}_ascii.stl",selection=True)
-            u.stl_export(f"{gaden_dir}/{cube['asset_id']}_binary.stl",selection=True, text=False)
-
-    # gaden boolean operations
-    objects = bpy.data.objects
-
-    for i,booldict in enumerate(recipe["gaden_bools"]):
-        #bool_op = objects['walls'].modifiers.new(type="BOOLEAN", name=f"bool_{i}")
-        bool_op = objects[booldict[0]["asset_id"]].modifiers.new(type="BOOLEAN", name=f"bool_{i}")
-        bool_op.object = objects[str(booldict[1]["asset_id"])]
-        bool_op.operation = booldict[2]
-
-    u.set_active_ob('walls')
-    u.stl_export(f"{gaden_dir}/walls_ascii.stl",selection=True)
-    u.stl_export(f"{gaden_dir}/walls_binary.stl",selection=True, text=False)
+
+# build the interior of each recipe (bundles, binary and json recipes), a failing recipe does not stop the others
+failed = []
+for recipe in load_recipes(recipe_dir, read_shard(shard_file)):
+    env = f"{recipe['env_type']}_{recipe['env_id']}"
+    try:
+        build_recipe(recipe)
+        print(f"[blender_asset_placer] Exported {env}.")
+    except Exception:
+        print(f"[blender_asset_placer] Failed to export {env}:")
+        traceback.print_exc()
+        failed.append(env)
 
 u.delete_all()
+
+if failed and shard_file is not None: # lets the pipeline record the other environments of this worker
+    with open(f"{shard_file}.failed", 'w') as f:
+        f.write("\n".join(failed))
+
+if failed: # nonzero exit code (blender is started with --python-exit-code)
+    raise RuntimeError(f"[blender_asset_placer] {len(failed)} recipe(s) failed: {', '.join(failed)}")
@@ -0,0 +1,99 @@
+# content-addressed stage cache, every (environment, stage) records a manifest with the hash of its inputs
+import os
+import glob
+import json
+import hashlib
+from datetime import datetime
+
+
+class StageCache:
+    def __init__(self, manifest_dir:str) -> None:
+        self.manifest_dir = manifest_dir
+
+
+    def manifest_path(self, stage:str, env:str) -> str:
+        return f"{self.manifest_dir}{env}/{stage}.json"
+
+
+    def read_manifest(self, stage:str, env:str) -> dict:
+        try:
+            with open(self.manifest_path(stage, env), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+
+    # hash of a file or of all files in a directory (sorted, relative paths included)
+    def hash_path(self, path:str, h=None):
+        h = hashlib.sha256() if h is None else h
+        if os.path.isdir(path):
+            for root, dirs, files in sorted(os.walk(path)):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    h.update(os.path.relpath(file_path, path).encode())
+                    self.hash_path(file_path, h)
+        elif os.path.isfile(path):
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+        else:
+            h.update(b'<missing>')
+        return h
+
+
+    # inputs: {"settings": dict, "files": [paths], "upstream": [stage names of the same env]}
+    # upstream stages contribute their recorded digest, so a change propagates down the pipeline
+    def digest(self, stage:str, env:str, inputs:dict) -> str:
+        h = hashlib.sha256()
+        h.update(stage.encode())
+        h.update(json.dumps(inputs.get("settings", {}), sort_keys=True, default=str).encode())
+        for path in inputs.get("files", []):
+            h.update(path.encode())
+            self.hash_path(path, h)
+        for upstream in inputs.get("upstream", []):
+            h.update(str(self.read_manifest(upstream, env).get("digest")).encode())
+        return h.hexdigest()
+
+
+    # fresh when the recorded digest matches and all outputs (paths or glob patterns) exist
+    def is_fresh(self, stage:str, env:str, digest:str, outputs:list) -> bool:
+        if self.read_manifest(stage, env).get("digest") != digest:
+            return False
+        return all(glob.glob(output) for output in outputs)
+
+
+    def record(self, stage:str, env:str, digest:str) -> None:
+        os.makedirs(f"{self.manifest_dir}{env}", exist_ok=True)
+        manifest = {"stage": stage, "env": env, "digest": digest, "time": datetime.now().isoformat()}
+        tmp_path = f"{self.manifest_path(stage, env)}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path(stage, env)) # never leave a half-written manifest
+
+
+    # master seed of the layouts, recorded so a resumed run with a random seed regenerates the same environments
+    def seed_path(self) -> str:
+        return f"{self.manifest_dir}seed.json"
+
+
+    def read_seed(self) -> int:
+        try:
+            with open(self.seed_path(), 'r') as f:
+                return json.load(f)["seed"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+
+    def record_seed(self, seed:int) -> None:
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        tmp_path = f"{self.seed_path()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"seed": seed, "time": datetime.now().isoformat()}, f)
+        os.replace(tmp_path, self.seed_path())
+
+
+    # remove the manifest before a stage (re)runs, a crash halfway then never looks up-to-date
+    def invalidate(self, stage:str, env:str) -> None:
+        if os.path.isfile(self.manifest_path(stage, env)):
+            os.remove(self.manifest_path(stage, env))
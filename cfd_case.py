@@ -0,0 +1,64 @@
+# OpenFOAM case templates: the default case is rendered once per set of CFD settings and every case is a clone of it
+# files that OpenFOAM never rewrites (constant/, system/) are hardlinked, so N cases with identical settings share one copy on disk
+import os
+import re
+import glob
+import json
+import shutil
+import hashlib
+import tempfile
+from foam_io import set_foam_entries
+from provision import clone_tree
+
+CASE_COPY_DIRS = ["0"] # rewritten by OpenFOAM (e.g. reconstructPar), always copied
+CASE_RESULTS = ["processor*", "postProcessing", "log.*"] # written by a run, next to the time directories
+
+
+# hash of the default case files and the edits, identical settings give the same template
+def template_digest(default_case:str, edits:dict) -> str:
+    h = hashlib.sha256(json.dumps(edits, sort_keys=True, default=str).encode())
+    for root, dirs, files in sorted(os.walk(default_case)):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            h.update(os.path.relpath(file_path, default_case).encode())
+            with open(file_path, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+# renders default_case with the edits ({file relative to the case: {key path: value}}) into templates_dir
+# returns the template directory, an existing template with the same digest is reused
+def case_template(default_case:str, templates_dir:str, edits:dict) -> str:
+    template_dir = f"{templates_dir}{template_digest(default_case, edits)[:16]}/"
+    if os.path.isdir(template_dir):
+        return template_dir
+
+    os.makedirs(templates_dir, exist_ok=True)
+    tmp_dir = f"{tempfile.mkdtemp(dir=templates_dir, suffix='.tmp')}/"
+    shutil.copytree(default_case, tmp_dir, dirs_exist_ok=True)
+    for file, values in edits.items():
+        set_foam_entries(f"{tmp_dir}{file}", values) # one read and one write per file
+    try:
+        os.rename(tmp_dir, template_dir) # a finished template appears at once
+    except OSError: # rendered by another process in the meantime
+        shutil.rmtree(tmp_dir)
+    return template_dir
+
+
+# (re)creates the template files in case_dir, other files in the case (mesh, results) are kept, run_case cleans the results
+def clone_case(template_dir:str, case_dir:str) -> None:
+    clone_tree(template_dir, case_dir, modified=lambda rel_path: rel_path.split(os.sep)[0] in CASE_COPY_DIRS)
+
+
+# removes the results of an earlier run (time directories after 0, processor directories, postProcessing and logs)
+# so a new run never mixes with them, the mesh and the case files are kept
+def clean_case_results(case_dir:str) -> None:
+    results = [os.path.join(case_dir, name) for name in os.listdir(case_dir) if re.fullmatch(r"[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?", name) and float(name) > 0.0]
+    for pattern in CASE_RESULTS:
+        results += glob.glob(os.path.join(case_dir, pattern))
+    for path in results:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
@@ -0,0 +1,178 @@
+# runs the OpenFOAM steps of a case one by one, every step with its own log file (log.<application>) and exit code
+# the amount of MPI ranks follows from the mesh size, the ranks are bound to the CPUs handed to the case
+import os
+import re
+import math
+import subprocess
+import numpy as np
+from foam_io import get_foam_entry, set_foam_entries
+from cfd_case import clean_case_results
+
+PROBES_NAME = "convergenceProbes" # probes function object written into the controlDict of the case template
+RESIDUAL_PATTERN = re.compile(r"Solving for (\w+), Initial residual = ([^,\s]+)")
+TIME_PATTERN = re.compile(r"^Time = ([^\s]+)")
+
+
+# MPI ranks of a case: one rank per cells_per_rank cells, at most max_ranks (cells_per_rank 0: always max_ranks)
+def case_ranks(cells:int, cells_per_rank:int, max_ranks:int) -> int:
+    max_ranks = max(1, max_ranks)
+    if cells_per_rank <= 0:
+        return max_ranks
+    return max(1, min(max_ranks, math.ceil(cells / cells_per_rank)))
+
+
+# probes function object sampling U at locations, added to the controlDict by key path (see foam_io.set_foam_entries)
+def probes_entries(locations:list, interval:float) -> dict:
+    return {f"functions/{PROBES_NAME}/type":            "probes",
+            f"functions/{PROBES_NAME}/libs":            '("libsampling.so")',
+            f"functions/{PROBES_NAME}/fields":          ["U"],
+            f"functions/{PROBES_NAME}/probeLocations":  [list(location) for location in locations],
+            f"functions/{PROBES_NAME}/writeControl":    "runTime",
+            f"functions/{PROBES_NAME}/writeInterval":   interval}
+
+
+class ConvergenceMonitor:
+    # follows a running solver and stops it once the flow is steady:
+    # - the initial residuals of all equations in the last time step are below residual_tol
+    # - the velocity at every probe changed less than velocity_tol [m/s] over the last window [s] of simulated time
+    # the solver is stopped through 'stopAt writeNow' in the controlDict (runTimeModifiable), so the final time is written
+    def __init__(self, case_dir:str, solver:str, residual_tol:float, velocity_tol:float, window:float, interval:float=10.0) -> None:
+        self.case_dir = case_dir
+        self.log_path = os.path.join(case_dir, f"log.{solver}")
+        self.residual_tol = residual_tol
+        self.velocity_tol = velocity_tol
+        self.window = window
+        self.interval = interval  # [s] wall time between checks
+        self.reset()
+
+    def reset(self) -> None:
+        self.offsets = {}         # {file: bytes read so far}, the log and probe files are read incrementally
+        self.time = None          # simulated time of the step being solved
+        self.step_residuals = {}  # {field: first initial residual} of the step being solved
+        self.residuals = None     # residuals of the last completed step
+        self.probe_times, self.probe_values = [], []
+        self.converged_time = None
+
+    # complete lines appended to file_path since the last call
+    def _new_lines(self, file_path:str) -> list:
+        if not os.path.isfile(file_path):
+            return []
+        with open(file_path, 'rb') as f:
+            f.seek(self.offsets.get(file_path, 0))
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        self.offsets[file_path] = self.offsets.get(file_path, 0) + end
+        return data[:end].decode('latin-1').splitlines()
+
+    def _read_log(self) -> None:
+        for line in self._new_lines(self.log_path):
+            match = TIME_PATTERN.match(line)
+            if match:
+                if self.step_residuals:
+                    self.residuals = self.step_residuals
+                self.time, self.step_residuals = match.group(1).rstrip('s'), {}
+                continue
+            match = RESIDUAL_PATTERN.search(line)
+            if match and match.group(1) not in self.step_residuals: # first solve of a field in a step (outer/pressure correctors follow)
+                self.step_residuals[match.group(1)] = float(match.group(2))
+
+    # postProcessing/<probes>/<start time>/U, the latest start time is the current run
+    def _probes_file(self) -> str:
+        probes_dir = os.path.join(self.case_dir, "postProcessing", PROBES_NAME)
+        if not os.path.isdir(probes_dir):
+            return None
+        start_times = []
+        for name in os.listdir(probes_dir):
+            try:
+                start_times.append((float(name), name))
+            except ValueError:
+                continue
+        return os.path.join(probes_dir, max(start_times)[1], "U") if start_times else None
+
+    def _read_probes(self) -> None:
+        probes_file = self._probes_file()
+        if probes_file is None:
+            return
+        for line in self._new_lines(probes_file):
+            if line.startswith('#'):
+                continue
+            values = np.array(line.replace('(', ' ').replace(')', ' ').split(), dtype=np.float64)
+            if len(values) > 1 and (len(values) - 1) % 3 == 0:
+                self.probe_times.append(values[0])
+                self.probe_values.append(values[1:].reshape(-1, 3))
+
+    # largest velocity change [m/s] at the probes over the last window, None while less than a window has been sampled
+    def velocity_change(self) -> float:
+        if not self.probe_times:
+            return None
+        earlier = [i for i, t in enumerate(self.probe_times) if t <= self.probe_times[-1] - self.window]
+        if not earlier or self.probe_values[earlier[-1]].shape != self.probe_values[-1].shape:
+            return None
+        return float(np.linalg.norm(self.probe_values[-1] - self.probe_values[earlier[-1]], axis=-1).max())
+
+    def converged(self) -> bool:
+        change = self.velocity_change()
+        return (self.residuals is not None and max(self.residuals.values()) < self.residual_tol
+                and change is not None and change < self.velocity_tol)
+
+    # called while the solver runs, returns True once the solver has been asked to stop
+    def check(self) -> bool:
+        if self.converged_time is None:
+            self._read_log()
+            self._read_probes()
+            if self.converged():
+                self.converged_time = self.time
+                set_foam_entries(os.path.join(self.case_dir, "system", "controlDict"), {"stopAt": "writeNow"})
+        return self.converged_time is not None
+
+
+# runs command in case_dir with stdout/stderr in case_dir/log.<name>, returns the exit code
+# monitor: checked every monitor.interval seconds while the command runs (see ConvergenceMonitor)
+def run_logged(command:list, case_dir:str, name:str, monitor:ConvergenceMonitor=None) -> int:
+    with open(os.path.join(case_dir, f"log.{name}"), 'w') as log:
+        try:
+            process = subprocess.Popen(command, cwd=case_dir, stdout=log, stderr=subprocess.STDOUT)
+        except OSError as e: # application not found
+            log.write(f"{e}\n")
+            return 127
+        while True:
+            try:
+                return process.wait(timeout=monitor.interval if monitor else None)
+            except subprocess.TimeoutExpired:
+                monitor.check()
+
+
+# steps of a case as (log name, command), the solver runs on len(cpus) ranks, every rank bound to one of the (logical) cpus
+# reconstruct: False leaves the results in processor*/ (read directly with foam_io.read_case_field)
+def case_steps(ranks:int, cpus:list, solver:str="pimpleFoam", post_processing:list=[], reconstruct:bool=True) -> list:
+    if ranks == 1:
+        steps = [(solver, [solver])]
+    else:
+        cpu_set = ','.join(str(cpu) for cpu in cpus)
+        steps = [("decomposePar", ["decomposePar", "-force"]),
+                 (solver, ["mpirun", "--use-hwthread-cpus", "-np", str(ranks), "--cpu-set", cpu_set, "--bind-to", "hwthread", solver, "-parallel"])]
+        if reconstruct:
+            steps.append(("reconstructPar", ["reconstructPar"]))
+    return steps + post_processing
+
+
+# decomposes the case over the ranks and runs all steps, returns (success, message)
+# dictionaries are replaced (not modified) so files hardlinked to the case template stay untouched
+# monitor: stops the solver once the flow converged, otherwise it runs until endTime
+def run_case(case_dir:str, cpus:list, post_processing:list=[], solver:str="pimpleFoam", monitor:ConvergenceMonitor=None, reconstruct:bool=True) -> tuple:
+    ranks = len(cpus)
+    clean_case_results(case_dir) # a rerun (e.g. --resume) starts from 0, results of the earlier run would be picked up as the latest
+    if ranks > 1:
+        set_foam_entries(os.path.join(case_dir, "system", "decomposeParDict"), {"numberOfSubdomains": ranks})
+    control_dict = os.path.join(case_dir, "system", "controlDict")
+    if get_foam_entry(control_dict, "stopAt") != "endTime": # left at writeNow by an earlier, converged run
+        set_foam_entries(control_dict, {"stopAt": "endTime"})
+    if monitor:
+        monitor.reset()
+
+    for name, command in case_steps(ranks, cpus, solver, post_processing, reconstruct):
+        code = run_logged(command, case_dir, name, monitor if name == solver else None)
+        if code != 0:
+            return False, f"{name} exited with code {code}, see {os.path.join(case_dir, f'log.{name}')}"
+    converged = f", converged at t = {monitor.converged_time} s" if monitor and monitor.converged_time else ""
+    return True, f"completed on {ranks} rank(s) (CPUs {','.join(str(cpu) for cpu in cpus)}){converged}"
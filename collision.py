@@ -0,0 +1,123 @@
+# overlap checking of placed assets on their footprints: axis-aligned boxes, hashed on the floor (XY) grid
+# the Z range is part of the box, so racks stacked on top of each other do not overlap
+import sys
+import numpy as np
+from typing import Tuple
+
+OVERLAP_TOL = 1e-4 # [m] touching footprints (e.g. racks placed back to back) do not overlap, also covers float32 recipes
+
+
+# (n,6) footprints [xmin, ymin, zmin, xmax, ymax, zmax] of assets centered at loc (XY) standing on loc (Z),
+# rotated around Z by ori[:,2] degrees, clearance: free space kept around every asset in XY [m]
+def footprints(dims:np.ndarray, loc:np.ndarray, ori:np.ndarray, clearance:float=0.0) -> np.ndarray:
+    dims, loc, ori = np.atleast_2d(dims), np.atleast_2d(loc), np.atleast_2d(ori)
+    rot = np.radians(ori[:,2])
+    c, s = np.abs(np.cos(rot)), np.abs(np.sin(rot))
+    half_x = 0.5 * (c * dims[:,0] + s * dims[:,1]) + clearance
+    half_y = 0.5 * (s * dims[:,0] + c * dims[:,1]) + clearance
+    return np.stack([loc[:,0] - half_x, loc[:,1] - half_y, loc[:,2], loc[:,0] + half_x, loc[:,1] + half_y, loc[:,2] + dims[:,2]], -1)
+
+
+# footprint lies within the floor bounds [xmin, ymin, xmax, ymax]
+def inside(boxes:np.ndarray, bounds:np.ndarray) -> np.ndarray:
+    boxes = np.atleast_2d(boxes)
+    return ((boxes[:,0] >= bounds[0] - OVERLAP_TOL) & (boxes[:,1] >= bounds[1] - OVERLAP_TOL) &
+            (boxes[:,3] <= bounds[2] + OVERLAP_TOL) & (boxes[:,4] <= bounds[3] + OVERLAP_TOL))
+
+
+class FootprintGrid:
+    # uniform grid over the floor, every cell lists the footprints that touch it
+    # a query only tests the footprints in the cells it covers, placing an asset takes microseconds
+    def __init__(self, bounds:np.ndarray, cell_size:float=2.0) -> None:
+        self.bounds = tuple(float(v) for v in bounds) # floor [xmin, ymin, xmax, ymax]
+        self.cell_size = cell_size
+        self.boxes = []  # (xmin, ymin, zmin, xmax, ymax, zmax) footprints
+        self.ids = []    # asset ids
+        self.cells = {}  # {(i,j): [indices in boxes]}
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def cell_range(self, box) -> Tuple[range,range]:
+        x0, y0 = self.bounds[0], self.bounds[1]
+        return (range(int((box[0] - x0) // self.cell_size), int((box[3] - x0) // self.cell_size) + 1),
+                range(int((box[1] - y0) // self.cell_size), int((box[4] - y0) // self.cell_size) + 1))
+
+    # ids of the placed assets that overlap box, plain float comparisons as only a handful of candidates are tested
+    def query(self, box) -> list:
+        xmin, ymin, zmin, xmax, ymax, zmax = (float(v) for v in box)
+        candidates = set()
+        irange, jrange = self.cell_range(box)
+        for i in irange:
+            for j in jrange:
+                candidates.update(self.cells.get((i, j), ()))
+
+        hits = []
+        for k in sorted(candidates):
+            bx0, by0, bz0, bx1, by1, bz1 = self.boxes[k]
+            if (min(xmax, bx1) - max(xmin, bx0) > OVERLAP_TOL and min(ymax, by1) - max(ymin, by0) > OVERLAP_TOL and
+                min(zmax, bz1) - max(zmin, bz0) > OVERLAP_TOL):
+                hits.append(self.ids[k])
+        return hits
+
+    # free: inside the bounds and not overlapping any placed asset
+    def is_free(self, box) -> bool:
+        x0, y0, x1, y1 = self.bounds
+        if box[0] < x0 - OVERLAP_TOL or box[1] < y0 - OVERLAP_TOL or box[3] > x1 + OVERLAP_TOL or box[4] > y1 + OVERLAP_TOL:
+            return False
+        return not self.query(box)
+
+    def insert(self, box, asset_id:str) -> None:
+        k = len(self.boxes)
+        self.boxes.append(tuple(float(v) for v in box))
+        self.ids.append(asset_id)
+        irange, jrange = self.cell_range(box)
+        for i in irange:
+            for j in jrange:
+                self.cells.setdefault((i, j), []).append(k)
+
+    # inserts box when it is free, returns whether it was placed
+    def place(self, box, asset_id:str) -> bool:
+        if not self.is_free(box):
+            return False
+        self.insert(box, asset_id)
+        return True
+
+
+# checks the interior of a recipe, returns a list of problems (empty when the recipe is valid):
+# assets outside the warehouse and pairs of overlapping assets
+def validate_recipe(recipe:dict) -> list:
+    interior = recipe.get("interior") or []
+    if not interior:
+        return []
+
+    bounds = np.array([0.0, 0.0, recipe["env_size"][0], recipe["env_size"][1]])
+    grid = FootprintGrid(bounds)
+    boxes = footprints(np.array([a["dimensions"] for a in interior]),
+                       np.array([a["location"] for a in interior]),
+                       np.array([a["orientation"] for a in interior]))
+
+    problems = []
+    for asset, box, is_inside in zip(interior, boxes, inside(boxes, bounds)):
+        if not is_inside:
+            problems.append(f"{asset['asset_id']} is outside the warehouse")
+        for other in grid.query(box):
+            problems.append(f"{asset['asset_id']} overlaps {other}")
+        grid.insert(box, asset["asset_id"])
+    return problems
+
+
+# validates every recipe in a recipe folder: python3 collision.py <recipe_dir>
+if __name__ == "__main__":
+    from recipe_io import load_recipes
+
+    invalid = 0
+    for recipe in load_recipes(sys.argv[1]):
+        problems = validate_recipe(recipe)
+        if problems:
+            invalid += 1
+            print(f"{recipe['env_type']}_{recipe['env_id']}:")
+            for problem in problems:
+                print(f"    {problem}")
+    print(f"{invalid} invalid recipe(s) found.")
+    sys.exit(1 if invalid else 0)
@@ -0,0 +1,460 @@
+# reading OpenFOAM case output (ascii/binary, optionally .gz compressed) into numpy arrays
+import os
+import re
+import gzip
+import shutil
+import numpy as np
+from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+# number of components for each OpenFOAM field/list type
+FOAM_COMPONENTS = {
+    "scalar": 1, "label": 1, "vector": 3, "sphericalTensor": 1, "symmTensor": 6, "tensor": 9,
+}
+
+PARENTHESES_TO_SPACES = bytes.maketrans(b"()", b"  ")
+
+FIELD_CLASS_TYPES = {
+    "volScalarField": "scalar", "volVectorField": "vector", "volSphericalTensorField": "sphericalTensor",
+    "volSymmTensorField": "symmTensor", "volTensorField": "tensor",
+}
+
+
+# reads the raw bytes of a field file, falls back to the compressed version (<name>.gz)
+def read_foam_bytes(file_path:str) -> bytes:
+    if os.path.isfile(file_path):
+        if file_path.endswith(".gz"):
+            with gzip.open(file_path, 'rb') as f:
+                return f.read()
+        with open(file_path, 'rb') as f:
+            return f.read()
+
+    if os.path.isfile(f"{file_path}.gz"):
+        with gzip.open(f"{file_path}.gz", 'rb') as f:
+            return f.read()
+
+    raise FileNotFoundError(f"No such OpenFOAM file: '{file_path}' (or '{file_path}.gz')")
+
+
+# parses the FoamFile {...} header into a dict, e.g. {'format': 'ascii', 'class': 'volVectorField', ...}
+def parse_foam_header(data:bytes) -> dict:
+    match = re.search(rb"FoamFile\s*\{(.*?)\}", data, re.DOTALL)
+    if match is None:
+        return {}
+
+    header = {}
+    for key, value in re.findall(rb"(\w+)\s+([^;]*);", match.group(1)):
+        header[key.decode()] = value.decode().strip().strip('"')
+    return header
+
+
+# endianness and scalar/label sizes from the header arch entry, e.g. "LSB;label=32;scalar=64"
+def foam_arch(header:dict) -> Tuple[str,int,int]:
+    arch = header.get("arch", "LSB;label=32;scalar=64")
+    byteorder = '>' if "MSB" in arch else '<'
+    label = re.search(r"label=(\d+)", arch)
+    scalar = re.search(r"scalar=(\d+)", arch)
+    label_bytes = int(label.group(1)) // 8 if label else 4
+    scalar_bytes = int(scalar.group(1)) // 8 if scalar else 8
+    return byteorder, label_bytes, scalar_bytes
+
+
+# parses a (non)uniform list entry (e.g. internalField or a boundary value) starting at 'start'
+# returns an (N,) array for scalars and an (N, components) array otherwise
+def parse_foam_list(data:bytes, start:int, header:dict, value_type:str=None) -> np.ndarray:
+    match = re.compile(rb"\s*(uniform|nonuniform)\s*").match(data, start)
+    if match is None:
+        raise ValueError(f"Could not find a uniform/nonuniform entry at byte {start}")
+
+    # uniform value, e.g. 'uniform (1 0 0);' or 'uniform 0.1;'
+    if match.group(1) == b"uniform":
+        end = data.index(b";", match.end())
+        values = np.array(data[match.end():end].translate(PARENTHESES_TO_SPACES).split(), dtype=np.float64)
+        return values.reshape(1, -1) if values.size > 1 else values
+
+    # nonuniform list, e.g. 'nonuniform List<vector> 1234 ( ... )'
+    list_match = re.compile(rb"List<(\w+)>\s*(\d+)\s*").match(data, match.end())
+    if list_match is None:
+        raise ValueError(f"Could not parse the nonuniform List at byte {match.end()}")
+
+    list_type = list_match.group(1).decode()
+    count = int(list_match.group(2))
+    components = FOAM_COMPONENTS[value_type or list_type]
+    shape = (count,) if components == 1 else (count, components)
+    pos = list_match.end()
+
+    if data[pos:pos+1] == b"{": # compact form 'N{value}', all values identical
+        end = data.index(b"}", pos)
+        value = np.array(data[pos+1:end].translate(PARENTHESES_TO_SPACES).split(), dtype=np.float64)
+        return np.broadcast_to(value, shape).copy()
+
+    if data[pos:pos+1] != b"(":
+        raise ValueError(f"Expected '(' at byte {pos}, found {data[pos:pos+1]!r}")
+    pos += 1
+
+    if header.get("format", "ascii") == "binary":
+        byteorder, label_bytes, scalar_bytes = foam_arch(header)
+        if list_type == "label":
+            dtype = np.dtype(f"{byteorder}i{label_bytes}")
+        else:
+            dtype = np.dtype(f"{byteorder}f{scalar_bytes}")
+        values = np.frombuffer(data, dtype=dtype, count=count*components, offset=pos)
+        return values.astype(np.float64).reshape(shape)
+
+    # ascii: the list is closed by the first ')' followed by ';', inner '(x y z)' are always followed by whitespace or ')'
+    end = re.compile(rb"\)\s*;").search(data, pos).start()
+    text = data[pos:end].translate(PARENTHESES_TO_SPACES).decode('latin-1')
+    values = np.fromstring(text, dtype=np.float64, sep=' ')
+    if values.size != count * components:
+        raise ValueError(f"Expected {count * components} values, parsed {values.size}")
+    return values.reshape(shape)
+
+
+# reads the internalField of a volScalarField/volVectorField/... file (ascii or binary, optionally .gz)
+# vector fields return an (N,3) array, scalar fields an (N,) array
+def read_foam_field(file_path:str) -> np.ndarray:
+    data = read_foam_bytes(file_path)
+    header = parse_foam_header(data)
+
+    match = re.search(rb"^\s*internalField\b", data, re.MULTILINE)
+    if match is None:
+        raise ValueError(f"No internalField found in '{file_path}'")
+
+    return parse_foam_list(data, match.end(), header, FIELD_CLASS_TYPES.get(header.get("class")))
+
+
+# sets the patch types in the patch list at the start of a cfMesh .fms file, e.g. {"inlet": "patch", "sides": "wall"}
+# a patch line is replaced when it contains the patch name, only the head of the file is rewritten, the rest is copied
+def set_fms_patch_types(file_path:str, patch_types:dict, head_lines:int=20) -> None:
+    tmp_path = f"{file_path}.tmp"
+    with open(file_path, 'rb') as f, open(tmp_path, 'wb') as out:
+        for _ in range(head_lines):
+            line = f.readline()
+            for patch, patch_type in patch_types.items():
+                if patch.encode() in line:
+                    line = f"{patch} {patch_type}\n".encode()
+                    break
+            out.write(line)
+        shutil.copyfileobj(f, out, 1 << 24)
+    os.replace(tmp_path, file_path)
+
+
+#### dictionary editing ####
+# entries are found by key path (e.g. "boundaryField/inlet/value") on the tokenized text,
+# only the values are replaced so comments and formatting of the templates are kept
+
+FOAM_KEY_END = re.compile(r"[\s{};]")
+
+
+# skips whitespace and // or /* */ comments
+def _skip_space(text:str, pos:int) -> int:
+    while pos < len(text):
+        if text[pos].isspace():
+            pos += 1
+        elif text.startswith("//", pos):
+            end = text.find("\n", pos)
+            pos = len(text) if end < 0 else end + 1
+        elif text.startswith("/*", pos):
+            end = text.find("*/", pos + 2)
+            pos = len(text) if end < 0 else end + 2
+        else:
+            break
+    return pos
+
+
+# end of a value: the ';' at bracket depth 0, strings and comments are skipped
+def _value_end(text:str, pos:int) -> int:
+    depth = 0
+    while pos < len(text):
+        c = text[pos]
+        if c == '"':
+            pos = text.index('"', pos + 1) + 1
+            continue
+        if text.startswith("//", pos) or text.startswith("/*", pos):
+            pos = _skip_space(text, pos)
+            continue
+        if c in "([":
+            depth += 1
+        elif c in ")]":
+            depth -= 1
+        elif c == ';' and depth == 0:
+            return pos
+        pos += 1
+    raise ValueError("Unterminated OpenFOAM entry, missing ';'")
+
+
+# {key path: (kind, start, end)} of every entry in an OpenFOAM dictionary
+# kind 'value': text[start:end] is the value (without ';'), kind 'dict': text[start:end] is the body between the braces
+def foam_entries(text:str) -> dict:
+    entries = {}
+    stack = [("", None)] # (path, body start)
+    pos = _skip_space(text, 0)
+    while pos < len(text):
+        path, body_start = stack[-1]
+        if text[pos] == '}':
+            entries[path] = ('dict', body_start, pos)
+            stack.pop()
+            pos = _skip_space(text, pos + 1)
+            continue
+        if text[pos] == ';': # stray ';' (e.g. after a closing brace)
+            pos = _skip_space(text, pos + 1)
+            continue
+
+        if text[pos] == '"':
+            key_end = text.index('"', pos + 1) + 1
+        else:
+            match = FOAM_KEY_END.search(text, pos)
+            key_end = len(text) if match is None else match.start()
+        key = text[pos:key_end].strip('"')
+        key_path = f"{path}/{key}" if path else key
+
+        if key.startswith('#'): # directive (e.g. #include "file"), runs to the end of the line
+            end = text.find("\n", key_end)
+            pos = _skip_space(text, len(text) if end < 0 else end)
+            continue
+
+        pos = _skip_space(text, key_end)
+        if pos < len(text) and text[pos] == '{':
+            stack.append((key_path, pos + 1))
+            pos = _skip_space(text, pos + 1)
+        else:
+            end = _value_end(text, pos)
+            entries[key_path] = ('value', pos, len(text[pos:end].rstrip()) + pos)
+            pos = _skip_space(text, end + 1)
+    return entries
+
+
+# python value -> OpenFOAM value, e.g. [2.5, 0, 0] -> '(2.5 0 0)', True -> 'true'
+def foam_value(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return f"({' '.join(foam_value(v) for v in value)})"
+    return str(value)
+
+
+# entry (and the dictionaries leading to it) appended to the body of an existing dictionary
+def _new_entry(keys:list, value:str, depth:int) -> str:
+    indent = "    " * depth
+    if len(keys) == 1:
+        return f"{indent}{keys[0]:<15} {value};\n"
+    return f"{indent}{keys[0]}\n{indent}{{\n{_new_entry(keys[1:], value, depth + 1)}{indent}}}\n"
+
+
+# sets entries by key path in the text of an OpenFOAM dictionary, missing entries are added to their parent dictionary
+# quoted keys (e.g. '"interior"') match with or without quotes, new keys are written as given
+def set_foam_text(text:str, values:dict) -> str:
+    for key_path, value in values.items():
+        entries = foam_entries(text)
+        keys = key_path.split('/')
+        lookup = '/'.join(k.strip('"') for k in keys)
+        value = foam_value(value)
+
+        if lookup in entries:
+            kind, start, end = entries[lookup]
+            if kind != 'value':
+                raise ValueError(f"'{key_path}' is a dictionary, not a value")
+            text = text[:start] + value + text[end:]
+            continue
+
+        # deepest existing parent dictionary
+        depth = len(keys) - 1
+        while depth > 0 and '/'.join(k.strip('"') for k in keys[:depth]) not in entries:
+            depth -= 1
+        if depth > 0:
+            kind, start, end = entries['/'.join(k.strip('"') for k in keys[:depth])]
+            if kind != 'dict':
+                raise ValueError(f"'{'/'.join(keys[:depth])}' is a value, not a dictionary")
+            insert = end
+            while insert > start and text[insert-1] in " \t": # keep the indentation of the closing brace
+                insert -= 1
+            text = text[:insert] + _new_entry(keys[depth:], value, depth) + text[insert:]
+        else: # top level: before the closing '// ****' line of the template when present
+            insert = text.rfind("\n// *")
+            insert = len(text) if insert < 0 else insert + 1
+            text = text[:insert] + _new_entry(keys, value, 0) + "\n" + text[insert:]
+    return text
+
+
+# sets entries of a dictionary file in one read and one write, e.g. {"boundaryField/inlet/value": "uniform (1 0 0)"}
+def set_foam_entries(file_path:str, values:dict) -> None:
+    with open(file_path, 'r') as f:
+        text = f.read()
+    text = set_foam_text(text, values)
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, file_path) # replaces the directory entry, files hardlinked to the old version are not modified
+
+
+# value of an entry as text, None when it does not exist
+def get_foam_entry(file_path:str, key_path:str) -> str:
+    with open(file_path, 'r') as f:
+        text = f.read()
+    entry = foam_entries(text).get('/'.join(k.strip('"') for k in key_path.split('/')))
+    if entry is None or entry[0] != 'value':
+        return None
+    return text[entry[1]:entry[2]]
+
+
+#### mesh and decomposed cases ####
+# the fields and cell centres of a decomposed case are read from processor*/<time>/ directly, without reconstructPar
+
+LIST_START = re.compile(rb"^\s*(\d+)\s*\(", re.MULTILINE)
+FACE_START = re.compile(rb"(\d+)\(") # ascii face size, the labels themselves are always followed by whitespace or ')'
+
+
+# the first list after byte start in a mesh file: (values, end of the list), labels as int64, scalars as (N, components) float64
+# ascii mesh files hold a single list, it runs up to the last ')' of the file
+def read_foam_list(data:bytes, start:int, header:dict, components:int=1, label:bool=True) -> Tuple[np.ndarray,int]:
+    match = LIST_START.search(data, start)
+    if match is None:
+        raise ValueError(f"No list found after byte {start}")
+
+    count = int(match.group(1))
+    shape = (count,) if components == 1 else (count, components)
+    if header.get("format", "ascii") == "binary":
+        byteorder, label_bytes, scalar_bytes = foam_arch(header)
+        dtype = np.dtype(f"{byteorder}i{label_bytes}" if label else f"{byteorder}f{scalar_bytes}")
+        values = np.frombuffer(data, dtype=dtype, count=count*components, offset=match.end())
+        return values.astype(np.int64 if label else np.float64).reshape(shape), match.end() + values.nbytes + 1
+
+    end = data.rindex(b")")
+    values = np.fromstring(data[match.end():end].translate(PARENTHESES_TO_SPACES).decode('latin-1'), dtype=np.int64 if label else np.float64, sep=' ')
+    if values.size != count * components:
+        raise ValueError(f"Expected {count * components} values, parsed {values.size}")
+    return values.reshape(shape), end + 1
+
+
+def _mesh_file(file_path:str) -> Tuple[bytes,dict,int]:
+    data = read_foam_bytes(file_path)
+    start = data.index(b"}", data.index(b"FoamFile")) + 1 if b"FoamFile" in data else 0
+    return data, parse_foam_header(data), start
+
+
+# reads a labelList file (e.g. constant/polyMesh/owner), ascii or binary
+def read_foam_labels(file_path:str) -> np.ndarray:
+    data, header, start = _mesh_file(file_path)
+    return read_foam_list(data, start, header)[0]
+
+
+# reads constant/polyMesh/points as an (N,3) array
+def read_foam_points(file_path:str) -> np.ndarray:
+    data, header, start = _mesh_file(file_path)
+    return read_foam_list(data, start, header, components=3, label=False)[0]
+
+
+# reads constant/polyMesh/faces as (offsets (F+1,), point labels), face f is labels[offsets[f]:offsets[f+1]]
+# binary files are a faceCompactList (the offsets and labels lists), ascii files a faceList ('4(0 1 2 3)' per face)
+def read_foam_faces(file_path:str) -> Tuple[np.ndarray,np.ndarray]:
+    data, header, start = _mesh_file(file_path)
+    if header.get("format", "ascii") == "binary":
+        offsets, end = read_foam_list(data, start, header)
+        return offsets, read_foam_list(data, end, header)[0]
+
+    body = data[LIST_START.search(data, start).end():data.rindex(b")")]
+    sizes = np.array(FACE_START.findall(body), dtype=np.int64)
+    values = np.fromstring(body.translate(PARENTHESES_TO_SPACES).decode('latin-1'), dtype=np.int64, sep=' ')
+    is_label = np.ones(len(values), dtype=bool)
+    is_label[np.cumsum(sizes + 1) - sizes - 1] = False # every face starts with its size
+    return np.concatenate([[0], np.cumsum(sizes)]), values[is_label]
+
+
+# number of cells of a case mesh, from the note in the owner header ("nPoints:... nCells:...") or from the owner list
+def mesh_cells(case_dir:str) -> int:
+    owner = os.path.join(case_dir, "constant", "polyMesh", "owner")
+    match = re.search(r"nCells:\s*(\d+)", parse_foam_header(read_foam_bytes(owner)).get("note", ""))
+    if match:
+        return int(match.group(1))
+    return int(read_foam_labels(owner).max()) + 1
+
+
+# cell centres of a polyMesh, computed like OpenFOAM (primitiveMesh) from the face centres/areas and the cell pyramids
+def mesh_cell_centres(mesh_dir:str) -> np.ndarray:
+    points = read_foam_points(os.path.join(mesh_dir, "points"))
+    offsets, labels = read_foam_faces(os.path.join(mesh_dir, "faces"))
+    owner = read_foam_labels(os.path.join(mesh_dir, "owner"))
+    neighbour = read_foam_labels(os.path.join(mesh_dir, "neighbour"))
+    n_cells = int(max(owner.max(), neighbour.max(initial=-1))) + 1
+    sizes = np.diff(offsets)
+
+    # face centres and area vectors from the triangles between every edge and the average face point
+    p = points[labels]
+    next_point = np.arange(1, len(p) + 1)
+    next_point[offsets[1:] - 1] = offsets[:-1] # the last point of a face connects to its first
+    p_next = p[next_point]
+    average = np.add.reduceat(p, offsets[:-1]) / sizes[:,None]
+    average_e = np.repeat(average, sizes, axis=0)
+    n = np.cross(p_next - p, average_e - p)
+    a = np.linalg.norm(n, axis=1)
+    sum_a = np.add.reduceat(a, offsets[:-1])
+    face_area = 0.5 * np.add.reduceat(n, offsets[:-1])
+    face_centre = np.add.reduceat(a[:,None] * (p + p_next + average_e), offsets[:-1])
+    face_centre = np.divide(face_centre, 3.0 * sum_a[:,None], out=average.copy(), where=sum_a[:,None] > 1e-300)
+
+    # estimated centre (average face centre), then the volume weighted centroids of the face pyramids
+    n_int = len(neighbour)
+    faces_per_cell = np.bincount(owner, minlength=n_cells) + np.bincount(neighbour, minlength=n_cells)
+    estimate = np.stack([np.bincount(owner, face_centre[:,k], n_cells) + np.bincount(neighbour, face_centre[:n_int,k], n_cells) for k in range(3)], -1)
+    estimate /= np.maximum(faces_per_cell, 1)[:,None]
+
+    volume_own = np.einsum('ij,ij->i', face_area, face_centre - estimate[owner])
+    volume_nei = np.einsum('ij,ij->i', face_area[:n_int], estimate[neighbour] - face_centre[:n_int])
+    centre_own = 0.75 * face_centre + 0.25 * estimate[owner]
+    centre_nei = 0.75 * face_centre[:n_int] + 0.25 * estimate[neighbour]
+
+    volume = np.bincount(owner, volume_own, n_cells) + np.bincount(neighbour, volume_nei, n_cells)
+    centre = np.stack([np.bincount(owner, volume_own * centre_own[:,k], n_cells) + np.bincount(neighbour, volume_nei * centre_nei[:,k], n_cells) for k in range(3)], -1)
+    return np.divide(centre, volume[:,None], out=estimate, where=np.abs(volume[:,None]) > 1e-300)
+
+
+# processor directories of a decomposed case, in processor order
+def processor_dirs(case_dir:str) -> list:
+    names = [name for name in os.listdir(case_dir) if re.fullmatch(r"processor\d+", name)]
+    return [os.path.join(case_dir, name) for name in sorted(names, key=lambda name: int(name[9:]))]
+
+
+# time directories (names) of a case, reconstructed or only decomposed, sorted by time
+def case_times(case_dir:str) -> list:
+    times = set()
+    for directory in [case_dir] + processor_dirs(case_dir)[:1]:
+        times.update(name for name in os.listdir(directory) if re.fullmatch(r"[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?", name))
+    return sorted(times, key=float)
+
+
+# reads read(part directory) for every part of the case: the case itself when time is reconstructed (or the run was serial),
+# otherwise the processor directories, read in parallel and put in the order of the reconstructed case (cellProcAddressing)
+def read_case_cells(case_dir:str, time:str, read, workers:int=0) -> np.ndarray:
+    processors = processor_dirs(case_dir)
+    if os.path.isdir(os.path.join(case_dir, time)) or not processors:
+        return read(case_dir)
+
+    def read_part(processor_dir:str) -> tuple:
+        addressing = os.path.join(processor_dir, "constant", "polyMesh", "cellProcAddressing")
+        return read(processor_dir), read_foam_labels(addressing) if os.path.exists(addressing) or os.path.exists(f"{addressing}.gz") else None
+
+    workers = workers if workers > 0 else min(len(processors), len(os.sched_getaffinity(0)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(read_part, processors))
+
+    if any(addressing is None for _, addressing in parts):
+        return np.concatenate([values for values, _ in parts])
+    cells = np.empty((sum(len(values) for values, _ in parts),) + parts[0][0].shape[1:])
+    for values, addressing in parts:
+        cells[addressing] = values
+    return cells
+
+
+# internalField of a field at a time, reconstructed or read from the processor directories
+def read_case_field(case_dir:str, time:str, field:str, workers:int=0) -> np.ndarray:
+    return read_case_cells(case_dir, time, lambda part_dir: read_foam_field(os.path.join(part_dir, time, field)), workers)
+
+
+# cell centres at a time, the C field (postProcess -func writeCellCentres) or computed from the mesh when it is absent
+def read_cell_centres(case_dir:str, time:str, workers:int=0) -> np.ndarray:
+    def read(part_dir:str) -> np.ndarray:
+        try:
+            return read_foam_field(os.path.join(part_dir, time, "C"))
+        except FileNotFoundError:
+            return mesh_cell_centres(os.path.join(part_dir, "constant", "polyMesh"))
+    return read_case_cells(case_dir, time, read, workers)
@@ -629,6 +629,54 @@ void openFoam_to_gaden(std::string filename)
     printWind(U,V,W,filename);
 }
 
+//reads a binary wind file written by AutoGDM2: int32 count followed by count*3 float32 values (x,y,z interleaved)
+std::vector<float> readBinaryVectors(std::string filename)
+{
+    std::ifstream infile(filename.c_str(), std::ios::binary);
+    int32_t count = 0;
+    infile.read((char*) &count, sizeof(int32_t));
+    std::vector<float> values(3*count);
+    infile.read((char*) values.data(), sizeof(float) * values.size());
+    infile.close();
+    return values;
+}
+
+//index of the cell every cell centre belongs to, computed once since the cell centres are the same for every timestep
+std::vector<int> pointsToCells(const std::vector<float> &points)
+{
+    std::vector<int> cells(points.size()/3);
+    for (size_t i = 0; i < cells.size(); i++)
+    {
+        int x_idx = (int)roundf((points[3*i] - env_min_x) / cell_size*roundFactor)/roundFactor;
+        int y_idx = (int)roundf((points[3*i+1] - env_min_y) / cell_size*roundFactor)/roundFactor;
+        int z_idx = (int)roundf((points[3*i+2] - env_min_z) / cell_size*roundFactor)/roundFactor;
+        cells[i] = indexFrom3D(x_idx, y_idx, z_idx);
+    }
+    return cells;
+}
+
+//binary counterpart of openFoam_to_gaden, the output is written to outputName (_U, _V and _W are appended)
+void binary_to_gaden(const std::vector<int> &cells, std::string filename, std::string outputName)
+{
+    std::vector<float> wind = readBinaryVectors(filename);
+    if (wind.size() != 3*cells.size())
+    {
+        ROS_ERROR("Wind file %s has %lu vectors, expected %lu", filename.c_str(), wind.size()/3, cells.size());
+        return;
+    }
+
+    std::vector<double> U(env[0].size()*env.size()*env[0][0].size());
+    std::vector<double> V(env[0].size()*env.size()*env[0][0].size());
+    std::vector<double> W(env[0].size()*env.size()*env[0][0].size());
+    for (size_t i = 0; i < cells.size(); i++)
+    {
+        U[ cells[i] ] = wind[3*i];
+        V[ cells[i] ] = wind[3*i+1];
+        W[ cells[i] ] = wind[3*i+2];
+    }
+    printWind(U,V,W,outputName);
+}
+
 void fill(int x, int y, int z, cell_state new_value, cell_state value_to_overwrite){
     std::queue<Eigen::Vector3i> q;
     q.push(Eigen::Vector3i(x, y, z));
@@ -854,6 +902,18 @@ int main(int argc, char **argv){
             printWind(U,V,W, boost::str(boost::format("%s_%i.csv") % windFileName % idx).c_str());
             idx++;
         }
+    }else if(FILE *pointsFile = fopen(boost::str(boost::format("%s_points.bin") % windFileName).c_str(), "r")){
+        //binary wind files: cell centres once, one file with the wind vectors per timestep
+        fclose(pointsFile);
+        std::vector<int> cells = pointsToCells(readBinaryVectors(boost::str(boost::format("%s_points.bin") % windFileName)));
+        while (FILE *file = fopen(boost::str(boost::format("%s_%i.bin") % windFileName % idx).c_str(), "r"))
+        {
+            fclose(file);
+            //output names are kept identical to the csv path, the filament simulator reads <wind_files>_<i>.csv_U
+            binary_to_gaden(cells, boost::str(boost::format("%s_%i.bin") % windFileName % idx),
+                            boost::str(boost::format("%s_%i.csv") % windFileName % idx));
+            idx++;
+        }
     }else{
         while (FILE *file = fopen(boost::str(boost::format("%s_%i.csv") % windFileName % idx).c_str(), "r"))
         {
@@ -0,0 +1,176 @@
+# triangle meshes of the recipe primitives (planes and boxes) and the .stl files created from them
+# the boundary geometry is axis-aligned, so the GADEN boolean operations are done on a rectilinear grid instead of in Blender
+import os
+import numpy as np
+from functools import lru_cache
+from stl_io import STLWriter, write_stl
+
+# unit primitives, same geometry as bpy.ops.mesh.primitive_plane_add/primitive_cube_add (size 2, normals pointing outwards)
+PLANE_VERTS = np.array([(-1, -1, 0), (1, -1, 0), (1, 1, 0), (-1, 1, 0)], dtype=np.float64)
+PLANE_FACES = np.array([(0, 1, 2, 3)])
+CUBE_VERTS  = np.array([(-1, -1, -1), (-1, -1, 1), (-1, 1, -1), (-1, 1, 1), (1, -1, -1), (1, -1, 1), (1, 1, -1), (1, 1, 1)], dtype=np.float64)
+CUBE_FACES  = np.array([(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)])
+
+
+# rotation matrices of XYZ euler angles [deg] (X applied first, as in Blender), (n,3) -> (n,3,3)
+def rotation_matrices(degrees:np.ndarray) -> np.ndarray:
+    rx, ry, rz = np.radians(np.atleast_2d(degrees)).T
+    cx, sx, cy, sy, cz, sz = np.cos(rx), np.sin(rx), np.cos(ry), np.sin(ry), np.cos(rz), np.sin(rz)
+    R = np.stack([
+        np.stack([cy*cz, sx*sy*cz - cx*sz, cx*sy*cz + sx*sz], -1),
+        np.stack([cy*sz, sx*sy*sz + cx*cz, cx*sy*sz - sx*cz], -1),
+        np.stack([-sy,   sx*cy,            cx*cy           ], -1)], -2)
+    R[np.abs(R) < 1e-12] = 0.0 # exact axis-aligned planes for multiples of 90 degrees
+    return R
+
+
+# quads (n,4,3) -> triangles (2n,3,3)
+def quads_to_triangles(quads:np.ndarray) -> np.ndarray:
+    return quads[:,[[0,1,2],[0,2,3]]].reshape(-1, 3, 3)
+
+
+# triangles of primitives (unit verts/faces) scaled to the full asset dimensions, rotated and translated
+def primitive_triangles(assets:list, verts:np.ndarray, faces:np.ndarray) -> np.ndarray:
+    if not assets:
+        return np.zeros((0, 3, 3))
+    dims = np.array([a["dimensions"] for a in assets], dtype=np.float64)
+    loc = np.array([a["location"] for a in assets], dtype=np.float64)
+    ori = np.array([a["orientation"] for a in assets], dtype=np.float64)
+
+    points = np.einsum('nij,nvj->nvi', rotation_matrices(ori), 0.5 * dims[:,None,:] * verts[None]) + loc[:,None,:]
+    return quads_to_triangles(points[:,faces].reshape(-1, 4, 3))
+
+
+# axis-aligned [min, max] corners of a box asset
+def box_bounds(asset:dict) -> np.ndarray:
+    if np.any(np.mod(asset["orientation"], 180.0)):
+        raise ValueError(f"{asset['asset_id']} is not axis-aligned, boolean operations need axis-aligned boxes")
+    loc, half = np.array(asset["location"], dtype=np.float64), 0.5 * np.array(asset["dimensions"], dtype=np.float64)
+    return np.stack([loc - half, loc + half])
+
+
+# surface of an axis-aligned box minus axis-aligned holes (Blender DIFFERENCE boolean)
+# all boxes split space into a rectilinear grid, the surface consists of the cell faces between solid and empty cells
+def box_difference(box:np.ndarray, holes:list) -> np.ndarray:
+    holes = np.array(holes, dtype=np.float64).reshape(-1, 2, 3)
+    edges = [np.unique(np.clip(np.concatenate([box[:,a], holes[:,:,a].ravel()]), box[0,a], box[1,a])) for a in range(3)]
+    centers = np.stack(np.meshgrid(*[0.5*(e[1:] + e[:-1]) for e in edges], indexing='ij'), -1)
+
+    solid = np.ones(centers.shape[:-1], dtype=bool)
+    for lo, hi in holes:
+        solid &= ~np.all((centers > lo) & (centers < hi), axis=-1)
+
+    quads = []
+    padded = np.pad(solid, 1).astype(np.int8)
+    for axis in range(3):
+        u, v = (axis + 1) % 3, (axis + 2) % 3 # (u, v, axis) is right-handed, counter-clockwise (u,v) quads face +axis
+        change = np.diff(padded, axis=axis)
+        change = change[tuple(slice(None) if a == axis else slice(1, -1) for a in range(3))]
+        for sign in [-1, 1]: # solid -> empty: face points to +axis, empty -> solid: face points to -axis
+            idx = np.argwhere(change == sign)
+            if not len(idx):
+                continue
+            quad = np.zeros((len(idx), 4, 3))
+            quad[:,:,axis] = edges[axis][idx[:,axis]][:,None]
+            u0, u1 = edges[u][idx[:,u]], edges[u][idx[:,u] + 1]
+            v0, v1 = edges[v][idx[:,v]], edges[v][idx[:,v] + 1]
+            quad[:,:,u] = np.stack([u0, u1, u1, u0], -1)
+            quad[:,:,v] = np.stack([v0, v0, v1, v1], -1)
+            quads.append(quad if sign == -1 else quad[:,::-1])
+
+    if not quads:
+        return np.zeros((0, 3, 3))
+    return quads_to_triangles(np.concatenate(quads))
+
+
+# writes an ascii and a binary .stl, as required by GADEN
+def write_gaden_stls(gaden_dir:str, name:str, triangles:np.ndarray) -> None:
+    with STLWriter(name, [f"{gaden_dir}{name}_ascii.stl"], [f"{gaden_dir}{name}_binary.stl"]) as writer:
+        writer.write(triangles)
+
+
+# writes the boundary .stl files of a recipe (sides, inlet and outlet for cfMesh, the GADEN walls, inlet and outlet)
+def write_boundary_stls(recipe:dict, geometry_dir:str) -> None:
+    mesh_dir = f"{geometry_dir}{recipe['env_type']}_{recipe['env_id']}/mesh/"
+    gaden_dir = f"{geometry_dir}{recipe['env_type']}_{recipe['env_id']}/gaden/"
+    os.makedirs(mesh_dir, exist_ok=True)
+    os.makedirs(gaden_dir, exist_ok=True)
+
+    for group, name in [("sides", "sides"), ("inlets", "inlet"), ("outlets", "outlet")]:
+        write_stl(f"{mesh_dir}{name}.stl", primitive_triangles(recipe[group], PLANE_VERTS, PLANE_FACES), name)
+
+    # boolean targets are exported after their operations, all other boxes as they are
+    geom = {asset["asset_id"]: asset for asset in recipe["gaden_geom"]}
+    holes = {}
+    for target, tool, operation in recipe["gaden_bools"]:
+        if operation != 'DIFFERENCE':
+            raise ValueError(f"Unsupported boolean operation {operation} on {target['asset_id']}")
+        holes.setdefault(target["asset_id"], []).append(box_bounds(geom[tool["asset_id"]]))
+
+    for asset_id, asset in geom.items():
+        if asset_id in holes:
+            triangles = box_difference(box_bounds(asset), holes[asset_id])
+        else:
+            triangles = primitive_triangles([asset], CUBE_VERTS, CUBE_FACES)
+        write_gaden_stls(gaden_dir, asset_id, triangles)
+
+
+# triangles (n,3,3) of a mockup .obj, every mockup is read once per process
+# converted from Y-up to Z-up like the Blender .obj importer (forward -Z, up Y): (x, y, z) -> (x, -z, y)
+@lru_cache(maxsize=None)
+def mockup_mesh(obj_file:str) -> np.ndarray:
+    vertices, triangles = [], []
+    with open(obj_file, 'r') as f:
+        for line in f:
+            if line.startswith('v '):
+                vertices.append(line.split()[1:4])
+            elif line.startswith('f '):
+                # 'v', 'v/vt', 'v//vn' or 'v/vt/vn', 1-based or negative (relative) indices, polygons as triangle fans
+                face = [int(v.split('/')[0]) for v in line.split()[1:]]
+                face = [i - 1 if i > 0 else len(vertices) + i for i in face]
+                triangles.extend([face[0], face[k], face[k+1]] for k in range(1, len(face) - 1))
+
+    vertices = np.array(vertices, dtype=np.float64).reshape(-1, 3)[:,[0,2,1]] * np.array([1.0, -1.0, 1.0])
+    mesh = vertices[np.array(triangles, dtype=np.int64).reshape(-1, 3)]
+    mesh.flags.writeable = False # shared by all instances
+    return mesh
+
+
+# triangles of all instances of one mockup, rotated (rotate2 semantics: X and Y opposite to the euler angles) and translated
+def mockup_instances(mesh:np.ndarray, loc:np.ndarray, ori:np.ndarray) -> np.ndarray:
+    ori = np.atleast_2d(ori) * np.array([-1.0, -1.0, 1.0])
+    return (np.einsum('nij,tvj->ntvi', rotation_matrices(ori), mesh) + np.atleast_2d(loc)[:,None,None,:]).reshape(-1, 3, 3)
+
+
+# interior assets can be written without Blender when all mockups are .obj files
+def numpy_interior(recipe:dict) -> bool:
+    return all((asset["mockup_file"] or "").lower().endswith(".obj") for asset in recipe["interior"])
+
+
+# writes the interior of a recipe to interior.stl (cfMesh) and interior_ascii/binary.stl (GADEN) in one pass
+# the instances are generated per mockup, only the triangles of one mockup are held in memory
+def write_interior_stls(recipe:dict, geometry_dir:str) -> None:
+    mesh_dir = f"{geometry_dir}{recipe['env_type']}_{recipe['env_id']}/mesh/"
+    gaden_dir = f"{geometry_dir}{recipe['env_type']}_{recipe['env_id']}/gaden/"
+    os.makedirs(mesh_dir, exist_ok=True)
+    os.makedirs(gaden_dir, exist_ok=True)
+
+    instances = {}
+    for asset in recipe["interior"]:
+        instances.setdefault(asset["mockup_file"], []).append(asset)
+
+    # mesh/interior.stl is binary (5x smaller), cfd_mesh converts it while combining the .stls
+    with STLWriter("interior", [f"{gaden_dir}interior_ascii.stl"], [f"{gaden_dir}interior_binary.stl", f"{mesh_dir}interior.stl"]) as writer:
+        for mockup_file, assets in instances.items():
+            writer.write(mockup_instances(mockup_mesh(mockup_file),
+                                          np.array([a["location"] for a in assets], dtype=np.float64),
+                                          np.array([a["orientation"] for a in assets], dtype=np.float64)))
+
+
+# writes all .stl files of a recipe, returns False when the interior still has to be placed by Blender
+def write_recipe_stls(recipe:dict, geometry_dir:str) -> bool:
+    write_boundary_stls(recipe, geometry_dir)
+    if not numpy_interior(recipe):
+        return False
+    write_interior_stls(recipe, geometry_dir)
+    return True
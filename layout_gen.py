@@ -1,8 +1,29 @@
 # Top level layout generator following the Isaac Sim Warehouse generator format
+import os
 import json
-import random
 import numpy as np
 from typing import Tuple
+from functools import partial, lru_cache
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from collision import FootprintGrid, footprints, validate_recipe
+from recipe_io import encode_recipe, iter_bundle, recipe_name, recipe_path, write_bundle
+
+# bounding box dimensions [X Y Z] of a mockup .obj (Y-up, imported into Blender as Z-up), default when not available
+@lru_cache(maxsize=None)
+def _obj_dims(obj_file:str) -> tuple:
+    with open(obj_file, 'r') as f:
+        vertices = np.array([line.split()[1:4] for line in f if line.startswith('v ')], dtype=np.float64)
+    size = vertices.max(axis=0) - vertices.min(axis=0)
+    return (float(size[0]), float(size[2]), float(size[1]))
+
+
+def mockup_dims(obj_file:str, default:np.ndarray) -> np.ndarray:
+    try:
+        return np.array(_obj_dims(obj_file))
+    except (OSError, ValueError):
+        return default
+
 
 # TODO: remove member functions such as dx(), dy(), etc. and change them to attributes
 class Asset:
@@ -106,13 +127,95 @@ class Asset:
         return assetdict
 
 
+# structure-of-arrays of placed assets, generators add whole groups of assets at once
+# and the recipe dicts are only built when the recipe is serialized
+class AssetTable:
+    def __init__(self) -> None:
+        self.fnames = []      # string table of [isaac_sim_asset, mockup_file] pairs
+        self.fname_ids = {}   # {(isaac_sim_asset, mockup_file): index in fnames}
+        self.ids = []         # chunks of asset ids
+        self.file_idx = []    # chunks of indices in fnames
+        self.dims = []        # chunks of (n,3) arrays, idem for loc, ori and scale
+        self.loc = []
+        self.ori = []
+        self.scale = []
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self.ids)
+
+    # indices of [isaac_sim_asset, mockup_file] pairs in the string table, new pairs are appended
+    def fname_index(self, fnames:list) -> np.ndarray:
+        idx = np.zeros(len(fnames), dtype=np.int32)
+        for i, fname in enumerate(fnames):
+            key = tuple(fname)
+            if key not in self.fname_ids:
+                self.fname_ids[key] = len(self.fnames)
+                self.fnames.append(list(fname))
+            idx[i] = self.fname_ids[key]
+        return idx
+
+    # add n assets, file_idx/dims/loc/ori/scale are broadcast to n rows
+    def add(self,
+            ids:list,
+            file_idx            = 0,
+            dims:np.ndarray     = np.zeros(3),
+            loc:np.ndarray      = np.zeros(3),
+            ori:np.ndarray      = np.zeros(3),
+            scale:np.ndarray    = np.ones(3)
+            ) -> None:
+        n = len(ids)
+        if n == 0:
+            return
+        self.ids.append(list(ids))
+        self.file_idx.append(self.rows(file_idx, n, (), np.int32))
+        self.dims.append(self.rows(dims, n))
+        self.loc.append(self.rows(loc, n))
+        self.ori.append(self.rows(ori, n))
+        self.scale.append(self.rows(scale, n))
+
+    # repeats a single value to n rows, arrays that already have n rows are kept
+    @staticmethod
+    def rows(value, n:int, shape:tuple=(3,), dtype=np.float64) -> np.ndarray:
+        value = np.asarray(value, dtype=dtype)
+        if value.shape == shape:
+            return np.repeat(value[None], n, axis=0)
+        return value.reshape((n,) + shape)
+
+    # add n copies of an Asset (its fname, dims and scale) under new ids, locations and orientations
+    def add_asset(self, asset:Asset, ids:list, loc:np.ndarray, ori:np.ndarray=None) -> None:
+        ori = asset.ori if ori is None else ori
+        self.add(ids, self.fname_index([asset.fname])[0], asset.dims, loc, ori, asset.scale)
+
+    # concatenated arrays: ids, file_idx, dims, loc, ori, scale
+    def arrays(self) -> Tuple[list,np.ndarray,np.ndarray,np.ndarray,np.ndarray,np.ndarray]:
+        if not self.ids:
+            return [], np.zeros(0, dtype=np.int32), np.zeros((0,3)), np.zeros((0,3)), np.zeros((0,3)), np.zeros((0,3))
+        return ([asset_id for ids in self.ids for asset_id in ids],
+                np.concatenate(self.file_idx), np.concatenate(self.dims), np.concatenate(self.loc),
+                np.concatenate(self.ori), np.concatenate(self.scale))
+
+    # recipe dicts, same format as Asset.get_dict()
+    def to_dicts(self) -> list:
+        ids, file_idx, dims, loc, ori, scale = self.arrays()
+        fnames = [self.fnames[i] for i in file_idx.tolist()]
+        return [{"asset_id": asset_id,
+                 "filename": fname[0],
+                 "mockup_file": fname[1],
+                 "dimensions": d,
+                 "location": l,
+                 "orientation": o,
+                 "scale": sc} for asset_id, fname, d, l, o, sc in zip(ids, fnames, dims.tolist(), loc.tolist(), ori.tolist(), scale.tolist())]
+
+
 class Warehouse:
     def __init__(self,
                  settings:dict,
                  wh_dims:np.ndarray     = np.array([10.0, 15.0, 9.0]),
                  inlet_dims:np.ndarray  = np.array([0.0,4.0,4.0]),
-                 outlet_dims:np.ndarray = np.array([0.0,4.0,4.0])):
+                 outlet_dims:np.ndarray = np.array([0.0,4.0,4.0]),
+                 rng:np.random.Generator= None):
         self.settings = settings
+        self.rng = np.random.default_rng() if rng is None else rng # all random choices of this warehouse
         self.warehouse  = Asset("warehouse_shell", dims=wh_dims)
         self.floor      = Asset("floor", fname=self.settings['file_loc_paired']["floors"][0], dims=np.array([6.0, 6.0, 0.0]))
         self.cornerwall = Asset("cornerwall", dims=np.array([3.0,3.0,3.0]))
@@ -120,7 +223,7 @@ class Warehouse:
         self.prop_light = Asset("prop_light", dims=np.array([2.0, 0.3, 3.0]))
         self.rect_light = Asset("rect_light", dims=np.array([self.warehouse.dx(), self.warehouse.dy(), 0.0]))
         self.rack       = Asset("rack", dims=np.array([1.0, 4.0, 3.0])) # default size of rack models
-        self.rack_aisle = Asset("rack_aisle", dims=np.array([3.0, 0.0, 0.0]))
+        self.rack_aisle = Asset("rack_aisle", dims=np.array([self.settings["aisle_width"], 0.0, 0.0]))
         self.end_aisle  = Asset("end_aisle", dims=np.array([0.0, (max(inlet_dims[1], outlet_dims[1]) + 2), 0.0]))
         self.forklift   = Asset("forklift", fname=self.settings['file_loc_paired']['forklift'][0], dims=np.array([0.8,1.0,2.0]))
         self.pile       = Asset("pile")
@@ -128,109 +231,153 @@ class Warehouse:
         self.outlet     = Asset("outlet", dims=outlet_dims)
 
 
-    # returns arrays of rack positions (centered for each rack)
+    # returns arrays of rack positions (centered for each rack), rows of racks between the end aisles at the inlet and outlet walls
     def rack_positions(self) -> np.ndarray:
-        rack_orig = np.array([self.rack.cx(), self.rack.cy() + self.end_aisle.dy(), 0.0]) # origin of rack array
-        rack_rows = int(1 + (self.warehouse.dx()-self.rack.dx()) // (self.rack.dx() + self.rack_aisle.dx()))
-        rack_segs = int((self.warehouse.dy() - (2 * self.end_aisle.dy())) // self.rack.dy())
-        rack_stack= int((self.warehouse.dz()) // self.rack.dz()) # height
-
-        nx, ny, nz = rack_rows, rack_segs, rack_stack
-        x = np.linspace(rack_orig[0], self.warehouse.dx() - 0.5 * self.rack.dx(), nx)
-        y = np.linspace(rack_orig[1], rack_orig[1] + (self.rack.dy() * (ny-1)), ny)
-        z = np.arange(rack_orig[2], self.rack.dz() * nz, self.rack.dz())
-        xv, yv, zv = np.meshgrid(x,y,z) # generate grid and reshape array for ease of use
-        stack = np.stack([xv, yv, zv], -1)
-        positions = stack.reshape(np.prod(stack.shape[0:-1]),3)
-
-        return positions
+        block = np.array([0.0, self.end_aisle.dy(), self.warehouse.dx(), self.warehouse.dy() - self.end_aisle.dy()])
+        return self.rack_block(block, rack_ori=0.0)
 
 
     # divides positions, affects empty/filled rack ratio
     def position_division(self, divisor:float ,positions:np.ndarray=np.zeros(3)) -> np.ndarray:
         totalSample = positions.shape[0]
+        if totalSample == 0:
+            return positions, positions
         minSample = int((totalSample//(divisor**-1)))
-        sampleSize = np.random.randint(minSample,totalSample)
-        idx = random.sample(range(totalSample),sampleSize)
+        sampleSize = self.rng.integers(minSample,totalSample)
+        idx = self.rng.choice(totalSample, sampleSize, replace=False)
         filledRackPos, emptyRackPos = positions[idx,:], np.delete(positions, idx, 0)
         return filledRackPos, emptyRackPos
 
 
-    # TODO - hardcoded for now, make scalable
-    def complex_positions(self) -> np.ndarray:
-        edge_dist = 2.0
-        x = np.linspace(edge_dist, (15-edge_dist), 4)
-        y = np.linspace(1.5, (15-1.5), 4)
-        
-        positions = np.array([[x[0], y[0], 0.0],
-                              [x[0], y[1], 0.0],
-                              [x[0], y[2], 0.0],
-                              [x[0], y[3], 0.0],
-                              [x[1], y[3], 0.0],
-                              [x[2], y[3], 0.0],
-                              [x[3], y[3], 0.0],
-                              [x[3], y[2], 0.0],
-                              [x[3], y[1], 0.0],
-                              [x[3], y[0], 0.0],
-                              [x[2], y[0], 0.0],
-                              [x[1], y[0], 0.0]])
-        
-        return positions
-
-
-    # interior dict generation
-    def interior_gen(self, filled:np.ndarray, empty:np.ndarray, comp_loc:np.ndarray=None) -> list:
-        interior_dicts = []
+    # rule based complex layout for any warehouse size:
+    #   a free zone of perimeter_width along the walls holds the props (forklifts and piles),
+    #   the remaining block is filled with rows of racks turned along X, separated by aisles
+    # returns the rack positions and the prop slots
+    def complex_layout(self) -> Tuple[np.ndarray,np.ndarray]:
+        width = self.settings["perimeter_width"]
+        block = np.array([width, width, self.warehouse.dx() - width, self.warehouse.dy() - width])
+        return self.rack_block(block, rack_ori=90.0), self.prop_slots(width)
+
+
+    # rack positions filling a block [xmin, ymin, xmax, ymax] with rows of racks separated by aisles
+    # rack_ori = 0.0: racks along Y (rows spread over X), 90.0: racks along X (rows spread over Y)
+    def rack_block(self, block:np.ndarray, rack_ori:float=0.0) -> np.ndarray:
+        across, along = (0, 1) if rack_ori == 0.0 else (1, 0)
+        size = block[2:] - block[:2]
+        rack_w, rack_l = self.rack.dx(), self.rack.dy() # rack footprint across and along its row
+
+        n_rows = int(1 + (size[across] - rack_w) // (rack_w + self.rack_aisle.dx())) if size[across] >= rack_w else 0
+        n_segs = int(size[along] // rack_l) if size[along] > 0 else 0
+        n_stack = int(self.warehouse.dz() // self.rack.dz()) # height
+        if n_rows == 0 or n_segs == 0 or n_stack == 0:
+            return np.zeros((0,3))
+
+        # rows are spread over the block (wider aisles when there is space left), segments are centered
+        if n_rows > 1:
+            rows = np.linspace(block[across] + 0.5*rack_w, block[across+2] - 0.5*rack_w, n_rows)
+        else:
+            rows = np.array([0.5*(block[across] + block[across+2])])
+        segs = block[along] + 0.5*(size[along] - n_segs*rack_l) + rack_l*(np.arange(n_segs) + 0.5)
+        z = self.rack.dz() * np.arange(n_stack)
+
+        positions = np.zeros((n_rows, n_segs, n_stack, 3))
+        positions[..., across] = rows[:,None,None]
+        positions[..., along] = segs[None,:,None]
+        positions[..., 2] = z[None,None,:]
+        return positions.reshape(-1,3)
+
+
+    # prop slots on the centre line of the perimeter zone, prop_spacing apart, going around the warehouse
+    def prop_slots(self, width:float) -> np.ndarray:
+        inset = min(0.5*width, 0.5*self.warehouse.dx(), 0.5*self.warehouse.dy())
+        x0, y0 = inset, inset
+        lx, ly = self.warehouse.dx() - 2*inset, self.warehouse.dy() - 2*inset
+        perimeter = 2*(lx + ly)
+        if perimeter <= 0.0:
+            return np.array([[x0, y0, 0.0]])
+
+        n = max(int(perimeter // self.settings["prop_spacing"]), 1)
+        t = np.arange(n) * (perimeter / n) # distance along the centre line, counter clockwise from (x0, y0)
+        x = np.select([t < lx, t < lx + ly, t < 2*lx + ly], [x0 + t, x0 + lx, x0 + lx - (t - lx - ly)], x0)
+        y = np.select([t < lx, t < lx + ly, t < 2*lx + ly], [y0, y0 + (t - lx), y0 + ly], y0 + ly - (t - 2*lx - ly))
+        return np.stack([x, y, np.zeros(n)], -1)
+
+
+    # random subset of the rack positions, density: fraction of the positions that get a rack
+    def rack_selection(self, positions:np.ndarray, density:float) -> np.ndarray:
+        if density >= 1.0:
+            return positions
+        idx = np.sort(self.rng.choice(len(positions), int(round(density * len(positions))), replace=False))
+        return positions[idx]
+
+
+    # interior generation, every asset is checked against the warehouse bounds and the already placed assets:
+    # racks that do not fit are left out, forklifts and piles are moved to another free slot
+    # prop_slots: candidate locations of the forklifts and piles (complex layout only), rack_ori: Z rotation of all racks
+    def interior_gen(self, filled:np.ndarray, empty:np.ndarray, prop_slots:np.ndarray=None, rack_ori:float=0.0) -> AssetTable:
+        interior = AssetTable()
         scale_factor = np.array([0.01, 0.01, 0.01]) # custom scaling factor
-
-        # filled racks
-        for i,loc in enumerate(filled):
-            self.rack.set_assetname(f"filled_rack_{str(i).zfill(3)}")
-            self.rack.set_fname(random.choice(self.settings['file_loc_paired']["filled_racks"])) # choose random type of rack and corresponding mockup
-            self.rack.set_orientation(np.zeros(3,))
-            self.rack.set_location(loc)
-            self.rack.set_scale(scale_factor)
-
-            if comp_loc is not None and loc[0] > 1.0 and loc[0] < 14.0: # TODO : remove hardcoded orientation
-                self.rack.set_orientation(np.array([0,0,90]))
-
-            interior_dicts.append(self.rack.get_dict())
-
-        # empty racks
-        for i,loc in enumerate(empty):
-            self.rack.set_assetname(f"empty_rack_{str(i).zfill(3)}")
-            self.rack.set_fname(random.choice(self.settings['file_loc_paired']["empty_racks"])) # choose random type of rack and corresponding mockup
-            self.rack.set_orientation(np.zeros(3,))
-            self.rack.set_location(loc)
-            self.rack.set_scale(scale_factor)
-
-            if comp_loc is not None and loc[0] > 1.0 and loc[0] < 14.0: # TODO : remove hardcoded orientation
-                self.rack.set_orientation(np.array([0,0,90]))
-
-            interior_dicts.append(self.rack.get_dict())
-
-        if comp_loc is not None:
-            # get 4 random indices
-            idx = np.random.choice(11, 6, replace=False)
-            forklift_idx = idx[0]
-            piles_idx = idx[1:]
+        grid = self.footprint_grid()
+
+        # filled and empty racks
+        for name, rack_type, locs in [("filled_rack", "filled_racks", filled), ("empty_rack", "empty_racks", empty)]:
+            n = len(locs)
+            type_idx = interior.fname_index(self.settings['file_loc_paired'][rack_type])
+            file_idx = type_idx[self.rng.integers(len(type_idx), size=n)] # choose random type of rack and corresponding mockup
+            ori = np.zeros((n,3))
+            ori[:,2] = rack_ori
+
+            ids = [f"{name}_{str(i).zfill(3)}" for i in range(n)]
+            boxes = footprints(self.rack.dims, locs, ori)
+            placed = np.array([grid.place(box, asset_id) for box, asset_id in zip(boxes, ids)], dtype=bool)
+            interior.add([asset_id for asset_id, p in zip(ids, placed) if p], file_idx[placed], self.rack.dims, locs[placed], ori[placed], scale_factor)
+
+        if prop_slots is not None and len(prop_slots) > 0:
+            slots = list(prop_slots[self.rng.permutation(len(prop_slots))]) # candidate locations in random order
+            n_props = int(round(self.settings["prop_density"] * len(slots)))
+            n_forklifts = min(self.settings["forklifts"], n_props)
             
-            # add forklift to dict
-            self.forklift.set_location(comp_loc[forklift_idx])
-            self.forklift.set_orientation(np.array([0.0,0.0,np.random.randint(0,359)]))
+            # add forklifts
             self.forklift.set_scale(scale_factor)
-            interior_dicts.append(self.forklift.get_dict())
-
-            # add piles to dict
-            for i,loc in enumerate(comp_loc[piles_idx]):
-                self.pile.set_assetname(f"pile_{str(i).zfill(3)}")
-                self.pile.set_fname(random.choice(self.settings['file_loc_paired']["piles"])) # choose random type of pile and corresponding mockup
-                self.pile.set_location(loc)
-                self.pile.set_orientation(np.array([0.0,0.0,np.random.randint(0,359)]))
-                self.pile.set_scale(scale_factor)
-                interior_dicts.append(self.pile.get_dict())
-
-        return interior_dicts
+            for i in range(n_forklifts):
+                forklift_id = f"{self.forklift.id}_{str(i).zfill(3)}"
+                placement = self.place_prop(grid, slots, self.forklift.dims, forklift_id)
+                if placement is not None:
+                    interior.add_asset(self.forklift, [forklift_id], placement[0], placement[1])
+
+            # add piles
+            type_idx = interior.fname_index(self.settings['file_loc_paired']["piles"])
+            pile_dims = [mockup_dims(fname[1], self.pile.dims) for fname in self.settings['file_loc_paired']["piles"]]
+            for i in range(n_props - n_forklifts):
+                pile_type = self.rng.integers(len(type_idx)) # choose random type of pile and corresponding mockup
+                pile_id = f"pile_{str(i).zfill(3)}"
+                placement = self.place_prop(grid, slots, pile_dims[pile_type], pile_id)
+                if placement is not None:
+                    interior.add([pile_id], type_idx[pile_type], pile_dims[pile_type], placement[0], placement[1], scale_factor)
+
+        return interior
+
+
+    # collision grid over the floor, the areas in front of the inlet and outlet are kept free
+    def footprint_grid(self) -> FootprintGrid:
+        grid = FootprintGrid(np.array([0.0, 0.0, self.warehouse.dx(), self.warehouse.dy()]))
+        depth = self.settings["prop_clearance"] + 1.0
+        grid.insert(np.array([0.0, 0.0, 0.0, depth, self.inlet.dy(), self.inlet.dz()]), "inlet")
+        grid.insert(np.array([self.warehouse.dx() - depth, self.warehouse.dy() - self.outlet.dy(), 0.0,
+                              self.warehouse.dx(), self.warehouse.dy(), self.outlet.dz()]), "outlet")
+        return grid
+
+
+    # places a prop in the first free slot (with a random orientation, a few tries per slot), the used slot is removed
+    # returns (location, orientation), None when no slot is free
+    def place_prop(self, grid:FootprintGrid, slots:list, dims:np.ndarray, asset_id:str, tries:int=4) -> Tuple[np.ndarray,np.ndarray]:
+        for k, loc in enumerate(slots):
+            for _ in range(tries):
+                ori = np.array([0.0, 0.0, self.rng.integers(0, 359)])
+                if grid.place(footprints(dims, loc, ori, self.settings["prop_clearance"])[0], asset_id):
+                    slots.pop(k)
+                    return loc, ori
+        return None
 
 
     ################
@@ -336,7 +483,7 @@ class Warehouse:
     ################
     ###  ISAAC   ###
     ################
-    def isaac_floor_dicts(self) -> list:
+    def isaac_floor_dicts(self) -> AssetTable:
         floor_orig = np.array([self.floor.cx(), self.floor.cy(), 0.0]) # origin of floor array
         floor_rows = int(np.ceil(self.warehouse.dx()/self.floor.dx())) # floor tile rows (round up)
         floor_cols = int(np.ceil(self.warehouse.dy()/self.floor.dy())) # floor tile columns (round up)
@@ -350,17 +497,15 @@ class Warehouse:
         stack = np.stack([xv, yv, zv], -1)
         positions = stack.reshape(np.prod(stack.shape[0:-1]),3)
         
-        floor_tile_dicts = []
-        for i,loc in enumerate(positions):
-            self.floor.set_assetname(f"floor_tile_{str(i).zfill(3)}")
-            self.floor.set_location(loc)
-            floor_tile_dicts.append(self.floor.get_dict())
+        floor_tiles = AssetTable()
+        floor_tiles.add_asset(self.floor, [f"floor_tile_{str(i).zfill(3)}" for i in range(len(positions))], positions)
         
-        return floor_tile_dicts
+        return floor_tiles
     
 
-    def isaac_walls_dicts(self) -> list:
-        walls_dicts = []
+    def isaac_walls_dicts(self) -> AssetTable:
+        walls = AssetTable()
+        wall_types = walls.fname_index(self.settings['file_loc_paired']["walls"])
         
         # walls are made higher than env size to accomodate the lighting
         ceiling_height = self.warehouse.dz() + self.prop_light.dz()
@@ -384,14 +529,14 @@ class Warehouse:
         stack = np.stack([xv, yv], -1)
         positions = stack.reshape((4,2))
         transforms = np.hstack((positions, ori.T)) # [X Y Z-rotation]      
-        
-        for i, (z_pos, walltype) in enumerate(zip(z, walltypes)):
-            for j,transform in enumerate(transforms):
-                self.cornerwall.set_assetname(f"wall_corner_{i}_{j}")
-                self.cornerwall.set_fname(self.settings['file_loc_paired']["walls"][walltype])
-                self.cornerwall.set_location(np.array([transform[0], transform[1], z_pos]))
-                self.cornerwall.set_orientation(np.array([0.0,0.0,transform[2]]))
-                walls_dicts.append(self.cornerwall.get_dict())
+
+        i, j = [idx.ravel() for idx in np.meshgrid(np.arange(nz), np.arange(len(transforms)), indexing='ij')]
+        walls.add([f"wall_corner_{a}_{b}" for a, b in zip(i, j)],
+                  wall_types[walltypes[i]],
+                  self.cornerwall.dims,
+                  np.stack([transforms[j,0], transforms[j,1], z[i]], -1),
+                  np.stack([np.zeros(len(i)), np.zeros(len(i)), transforms[j,2]], -1),
+                  self.cornerwall.scale)
 
         # flat walls
         nz = int(np.ceil(ceiling_height/self.wall.dz()))
@@ -413,14 +558,13 @@ class Warehouse:
             y = np.linspace(0.0, self.warehouse.dy(), 2)
             ori = np.linspace(90.0, -90.0, 2)
 
-            for i, (z_pos, walltype) in enumerate(zip(z, walltypes)):
-                for j, (y_pos, orientation) in enumerate(zip(y, ori)):
-                    for k, x_pos in enumerate(x):
-                        self.wall.set_assetname(f"wallX_{i}_{k}_{j}")
-                        self.wall.set_fname(self.settings['file_loc_paired']["walls"][2+walltype])
-                        self.wall.set_location(np.array([x_pos, y_pos, z_pos]))
-                        self.wall.set_orientation(np.array([0.0, 0.0, orientation]))
-                        walls_dicts.append(self.wall.get_dict())
+            i, j, k = [idx.ravel() for idx in np.meshgrid(np.arange(nz), np.arange(len(y)), np.arange(nx), indexing='ij')]
+            walls.add([f"wallX_{a}_{c}_{b}" for a, b, c in zip(i, j, k)],
+                      wall_types[2+walltypes[i]],
+                      self.wall.dims,
+                      np.stack([x[k], y[j], z[i]], -1),
+                      np.stack([np.zeros(len(i)), np.zeros(len(i)), ori[j]], -1),
+                      self.wall.scale)
 
         # check if additional walls are needed for y direction
         if self.warehouse.dy() > (2 * self.cornerwall.dy()):  
@@ -431,20 +575,18 @@ class Warehouse:
             x = np.linspace(0.0, self.warehouse.dx(), 2)
             ori = np.linspace(0.0, 180, 2)
 
-            for i, (z_pos, walltype) in enumerate(zip(z, walltypes)):
-                for j, (x_pos, orientation) in enumerate(zip(x, ori)):
-                    for k, y_pos in enumerate(y):
-                        self.wall.set_assetname(f"wallY_{i}_{k}_{j}")
-                        self.wall.set_fname(self.settings['file_loc_paired']["walls"][2+walltype])
-                        self.wall.set_location(np.array([x_pos, y_pos, z_pos]))
-                        self.wall.set_orientation(np.array([0.0, 0.0, orientation]))
-                        walls_dicts.append(self.wall.get_dict())
+            i, j, k = [idx.ravel() for idx in np.meshgrid(np.arange(nz), np.arange(len(x)), np.arange(ny), indexing='ij')]
+            walls.add([f"wallY_{a}_{c}_{b}" for a, b, c in zip(i, j, k)],
+                      wall_types[2+walltypes[i]],
+                      self.wall.dims,
+                      np.stack([x[j], y[k], z[i]], -1),
+                      np.stack([np.zeros(len(i)), np.zeros(len(i)), ori[j]], -1),
+                      self.wall.scale)
     
-        return walls_dicts
+        return walls
 
 
-    def isaac_lights_dicts(self) -> list:
-        prop_lights_dicts = []
+    def isaac_lights_dicts(self) -> AssetTable:
         # rect_lights_dicts = []
 
         z_rect_light = self.warehouse.dz()
@@ -463,67 +605,148 @@ class Warehouse:
         stack = np.stack([xv, yv, zv], -1)
         positions = stack.reshape(np.prod(stack.shape[0:-1]),3)
         
-        for i, pos in enumerate(positions):
-            self.prop_light.set_assetname(f"light_{str(i).zfill(3)}")
-            self.prop_light.set_fname(self.settings['file_loc_paired']["lights"][1])
-            self.prop_light.set_location(np.array([pos[0], pos[1], pos[2]]))
-            self.prop_light.set_orientation(np.array([0.0,0.0,90.0]))
-            prop_lights_dicts.append(self.prop_light.get_dict())
+        prop_lights = AssetTable()
+        self.prop_light.set_fname(self.settings['file_loc_paired']["lights"][1])
+        prop_lights.add_asset(self.prop_light, [f"light_{str(i).zfill(3)}" for i in range(len(positions))], positions, np.array([0.0,0.0,90.0]))
 
         # rectangular light over the whole scene TODO: Add temperature and intensity?
         # self.rect_light.set_location(np.array([self.warehouse.cx(), self.warehouse.cy(), z_rect_light]))
         # self.rect_light.set_scale(self.rect_light.dimensions())
         # rect_lights_dicts.append(self.rect_light.get_dict())
 
-        return prop_lights_dicts #, rect_lights_dicts
+        return prop_lights #, rect_lights_dicts
 
 
-def generate_recipes(settings:dict) -> None:
+# geometry that is identical for every environment of a batch (boundaries, GADEN geometry, floor, walls, lights),
+# generated and serialized once instead of once per environment
+def static_recipe(settings:dict) -> dict:
     recipe_dict = {}
-    
+    recipe_dict["env_type"]   = settings["env_type"]
+    recipe_dict["env_size"]   = settings["env_size"]
+    recipe_dict["inlet_size"] = settings["inlet_size"]
+    recipe_dict["oulet_size"] = settings["outlet_size"]
+
+    wh = warehouse_from_settings(settings)
+
+    # CFD mesh geometry 
+    recipe_dict["sides"]    = wh.sides_blender()
+    recipe_dict["inlets"]   = wh.inlets_blender()
+    recipe_dict["outlets"]  = wh.outlets_blender()
+
+    # GADEN geometry
+    recipe_dict["gaden_geom"], recipe_dict["gaden_bools"] = wh.gaden_geom()
+
+    # Isaac Sim geometry
+    recipe_dict["isaac_floor"] = wh.isaac_floor_dicts().to_dicts()
+    recipe_dict["isaac_walls"] = wh.isaac_walls_dicts().to_dicts()
+    recipe_dict["isaac_lights"] = wh.isaac_lights_dicts().to_dicts()
+
+    return recipe_dict
+
+
+def warehouse_from_settings(settings:dict, rng:np.random.Generator=None) -> Warehouse:
+    return Warehouse(settings,
+                     wh_dims=np.array([settings["env_size"][0], settings["env_size"][1], settings["env_size"][2]]),
+                     inlet_dims=np.array([0.0,settings["inlet_size"][0],settings["inlet_size"][1]]),
+                     outlet_dims=np.array([0.0,settings["inlet_size"][0],settings["inlet_size"][1]]),
+                     rng=rng)
+
+
+# seed of a single environment, derived from the master seed and the environment index only,
+# so any environment can be regenerated on its own (in any process) with an independent random stream
+def env_seed(master_seed:int, env_idx:int) -> int:
+    return int(np.random.SeedSequence((master_seed, env_idx)).generate_state(1, np.uint64)[0])
+
+
+# builds the recipe of a single environment, only the interior differs between environments
+def generate_recipe(settings:dict, env_idx:int, static:dict=None) -> dict:
+    static = static_recipe(settings) if static is None else static
+    seed = env_seed(settings["seed"], env_idx)
+    wh = warehouse_from_settings(settings, np.random.default_rng(seed))
+
+    recipe_dict = {k: static[k] for k in ["env_type", "env_size", "inlet_size", "oulet_size"]}
+    recipe_dict["env_id"] = str(env_idx).zfill(4)
+    recipe_dict["seed"]   = seed # np.random.default_rng(seed) reproduces the random choices of this environment
+
+    # CFD mesh geometry 
+    recipe_dict["sides"]    = static["sides"]
+    recipe_dict["inlets"]   = static["inlets"]
+    recipe_dict["outlets"]  = static["outlets"]
+
+    # CFD mesh and Isaac Sim interior geometry
+    if 'empty' in settings["env_type"]:
+        recipe_dict["interior"] = {}
+    else:
+        if 'complex' in settings["env_type"]: 
+            positions, prop_slots = wh.complex_layout()
+            rack_ori = 90.0
+        else:
+            positions, prop_slots = wh.rack_positions(), None
+            rack_ori = 0.0
+
+        positions = wh.rack_selection(positions, settings["rack_density"])
+        filled_locs, empty_locs = wh.position_division(settings["emptyfullrackdiv"],positions)
+        recipe_dict["interior"] = wh.interior_gen(filled_locs, empty_locs, prop_slots, rack_ori).to_dicts()
+
+        problems = validate_recipe(recipe_dict)
+        if problems:
+            raise ValueError(f"Invalid layout for {recipe_name(recipe_dict)}: {'; '.join(problems)}")
+
+    # GADEN geometry
+    recipe_dict["gaden_geom"], recipe_dict["gaden_bools"] = static["gaden_geom"], static["gaden_bools"]
+
+    # Isaac Sim geometry
+    recipe_dict["isaac_floor"] = static["isaac_floor"]
+    recipe_dict["isaac_walls"] = static["isaac_walls"]
+    recipe_dict["isaac_lights"] = static["isaac_lights"]
+
+    return recipe_dict
+
+
+# encoded recipe of one environment in settings["recipe_format"], returns (name, data)
+# static_json: the static entries already json encoded, spliced in instead of encoding them for every environment
+def encode_env_recipe(settings:dict, static:dict, static_json:dict, env_idx:int) -> Tuple[str,bytes]:
+    recipe_dict = generate_recipe(settings, env_idx, static)
+    if settings["recipe_format"] == "json":
+        entries = [f"{json.dumps(k)}: {static_json[k] if k in static_json else json.dumps(v)}" for k, v in recipe_dict.items()]
+        return recipe_name(recipe_dict), ("{" + ", ".join(entries) + "}").encode() # identical to json.dumps(recipe_dict)
+    return recipe_name(recipe_dict), encode_recipe(recipe_dict)
+
+
+# writes the encoded recipes, one file per environment or a single bundle
+# names: environments that are being (re)generated, the other recipes of an existing bundle are kept
+def write_recipes(settings:dict, recipes, names:set, incremental:bool) -> None:
+    if settings["recipe_format"] == "bundle":
+        bundle_path = recipe_path(settings["recipe_dir"], settings["env_type"], None, "bundle")
+        kept = []
+        if incremental and os.path.isfile(bundle_path):
+            kept = ((name, data) for name, data in iter_bundle(bundle_path) if name not in names)
+        write_bundle(bundle_path, chain(kept, recipes))
+        return
+
+    for name, data in recipes:
+        with open(recipe_path(settings["recipe_dir"], settings["env_type"], name, settings["recipe_format"]), 'wb') as convert_file:
+            convert_file.write(data)
+
+
+# env_ids: indices of the environments to (re)generate, all environments when None
+# workers: processes generating recipes, 0 = all available cores, 1 = in this process
+def generate_recipes(settings:dict, env_ids:list=None, workers:int=1) -> None:
     if 'wh' in settings["env_type"]:
-        recipe_dict["env_type"]   = settings["env_type"]
-        recipe_dict["env_size"]   = settings["env_size"]
-        recipe_dict["inlet_size"] = settings["inlet_size"]
-        recipe_dict["oulet_size"] = settings["outlet_size"]
-        
-        for i in range(settings["env_amount"]):
-            env_id = str(i).zfill(4)
-            recipe_dict["env_id"] =  env_id
-            wh = Warehouse(settings,
-                           wh_dims=np.array([recipe_dict["env_size"][0], recipe_dict["env_size"][1], recipe_dict["env_size"][2]]),
-                           inlet_dims=np.array([0.0,recipe_dict["inlet_size"][0],recipe_dict["inlet_size"][1]]),
-                           outlet_dims=np.array([0.0,recipe_dict["inlet_size"][0],recipe_dict["inlet_size"][1]]))
-            
-            # CFD mesh geometry 
-            recipe_dict["sides"]    = wh.sides_blender()
-            recipe_dict["inlets"]   = wh.inlets_blender()
-            recipe_dict["outlets"]  = wh.outlets_blender()
-
-            # CFD mesh and Isaac Sim interior geometry
-            if 'empty' in settings["env_type"]:
-                recipe_dict["interior"] = {}
-            else:
-                positions = wh.rack_positions()
-                filled_locs, empty_locs = wh.position_division(settings["emptyfullrackdiv"],positions)
-                
-                if 'complex' in settings["env_type"]: 
-                    complex_pos = wh.complex_positions()
-                else:
-                    complex_pos = None
-
-                recipe_dict["interior"] = wh.interior_gen(filled_locs, empty_locs, comp_loc=complex_pos)
-
-            # GADEN geometry
-            recipe_dict["gaden_geom"], recipe_dict["gaden_bools"] = wh.gaden_geom()
-
-            # Isaac Sim geometry
-            recipe_dict["isaac_floor"] = wh.isaac_floor_dicts()
-            recipe_dict["isaac_walls"] = wh.isaac_walls_dicts()
-            recipe_dict["isaac_lights"] = wh.isaac_lights_dicts()
-
-            # write dictionary
-            with open(f'{settings["recipe_dir"]}{settings["env_type"]}_{env_id}.txt', 'w') as convert_file:
-                convert_file.write(json.dumps(recipe_dict))
+        incremental = env_ids is not None
+        env_ids = None if env_ids is None else set(env_ids)
+        env_idxs = [i for i in range(settings["env_amount"]) if env_ids is None or i in env_ids]
+        names = {f"{settings['env_type']}_{str(i).zfill(4)}" for i in env_idxs}
+        workers = min(workers if workers > 0 else len(os.sched_getaffinity(0)), len(env_idxs))
+        static = static_recipe(settings)
+        static_json = {k: json.dumps(v) for k, v in static.items()}
+        encode = partial(encode_env_recipe, settings, static, static_json)
+
+        if workers <= 1:
+            write_recipes(settings, map(encode, env_idxs), names, incremental)
+        else:
+            chunksize = max(1, len(env_idxs) // (4 * workers))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                write_recipes(settings, pool.map(encode, env_idxs, chunksize=chunksize), names, incremental)
     
     # TODO: create more environments
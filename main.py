@@ -1,27 +1,72 @@
 import os
 import re
+import argparse
+import shutil
+import subprocess
 import json
 import glob
 import numpy as np
 import pandas as pd
 from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 from colorama import Fore, Back, Style
 from layout_gen import generate_recipes
-from utils import GDMConfig, flow_field, is_float, read_gas_data, read_wind_data, read_occ_csv
+from scheduler import CPUSet, Scheduler
+from cache import StageCache
+from recipe_io import load_recipes, recipe_digest, recipe_name, recipe_path
+from geometry import write_recipe_stls
+from foam_io import case_times, foam_value, mesh_cells, read_case_field, read_cell_centres, set_fms_patch_types
+from cfd_case import case_template, clone_case
+from cfd_runner import ConvergenceMonitor, case_ranks, probes_entries, run_case
+from provision import clone_tree, place_file, provision_all
+from stl_io import combine_stls
+from utils import GDMConfig, read_gas_iterations, read_wind_data, read_occ_csv, write_gaden_wind, write_gas_dataset, sort_numeric
 
 HOME_DIR = Path.home()
 main_path = os.path.abspath(__file__)
 AutoGDM2_dir = os.path.dirname(main_path)
 
+
+# converts the wind of one CFD timestep to a GADEN wind file, runs in a worker process of prep_ros
+# points_file: .npy with the cell centres for the csv format, None for the binary format (cell centres are written once)
+def prep_windfield(cfd_case_dir:str, time:str, output_file:str, points_file:str=None) -> str:
+    U = read_case_field(cfd_case_dir, time, "U") # wind vectors at the cell centres, (N,3), reconstructed or from the processor directories
+
+    if points_file is None:
+        write_gaden_wind(output_file, U)
+    else:
+        points = np.load(points_file, mmap_mode='r')
+        data = {'U:0': U[:,0], 'U:1': U[:,1], 'U:2': U[:,2], 'Points:0': points[:,0], 'Points:1': points[:,1], 'Points:2': points[:,2]}
+        df = pd.DataFrame(data, columns= ['U:0','U:1','U:2','Points:0','Points:1','Points:2'])
+        df.to_csv(output_file,index=False,header=True)
+
+    return output_file
+
+
+# files of the empty ROS dir that are written per environment, they get their own copy, all other files are hardlinked
+# the launch files are edited by prep_ros, stage.world is rewritten in place by GADEN preprocessing (worldFile),
+# everything else GADEN writes (OccupancyGrid3D.csv, occupancy.pgm/.yaml, wind and gas files) are new files
+ROS_MODIFIED_FILES = ["launch/GADEN_preprocessing.launch", "launch/GADEN.launch", "launch/GADEN_player.launch", "launch/ros/stage.world"]
+
+
 class AutoGDM2:
-    def __init__(self, settings:dict):
+    def __init__(self, settings:dict, resume:bool=False):
         self.settings = settings
         self.isaac_dir = self.settings["isaac_dir"]
         self.wh_gen_dir = self.settings["wh_gen_dir"]
         self.blender_dir = self.settings["blender_dir"]
         self.env_lst = self.settings["env_list"]
         self.env_lst_failed = []
+        self.resume = resume # skip stages whose manifest is up-to-date instead of redoing everything
+        self.cache = StageCache(self.settings["manifest_dir"])
+        self.case_templates = {} # {edits: template dir}, rendered once per batch
+        self.cpu_set = CPUSet()  # CPUs handed out to the MPI ranks of the CFD cases
+
+        # a random master seed is only drawn for a new run, a resumed run continues with the seed of the run it resumes
+        if self.resume and self.settings["random_seed"] and self.cache.read_seed() is not None:
+            self.settings["seed"] = self.cache.read_seed()
 
 
     # different color and formatting to display the terminal
@@ -94,32 +139,223 @@ class AutoGDM2:
         else:
             self.printGDMStyle("[AutoGDM2] No occupancy data to clean.")
 
+        # remove everything in ./environments/manifests
+        if os.path.isdir(self.settings["manifest_dir"]) and os.listdir(self.settings["manifest_dir"]):
+            os.system(f"cd {self.settings['manifest_dir']} && rm -rv *")
+        else:
+            self.printGDMStyle("[AutoGDM2] No stage manifests to clean.")
+
         self.printGDMStyle("[AutoGDM2] Cleanup completed.")
 
 
-    # layout generator, results in recipes.txt 
+    # inputs of a stage for one environment, hashed into the stage manifest
+    def stage_inputs(self, stage:str, env:str) -> dict:
+        s = self.settings
+        cfd_settings = {k: v for k, v in s['cfd_settings'].items() if k not in ['threads', 'cells_per_rank']} # the amount of threads/ranks does not change the results
+        recipe = recipe_digest(s['recipe_dir'], s['env_type'], env, s['recipe_format']) # own recipe only, also inside a shared bundle
+        default_cfd_case = f"{s['cfd_dir']}default_cfd_case"
+
+        inputs = {
+            "layout_gen":            {"settings": {k: s[k] for k in ["env_type", "env_size", "inlet_size", "outlet_size", "emptyfullrackdiv", "white_walls", "prop_clearance",
+                                                                     "aisle_width", "perimeter_width", "rack_density", "prop_spacing", "prop_density", "forklifts", "file_loc_paired", "recipe_format", "seed"]}},
+            "blender_asset_placer":  {"settings": {"BLENDER_VERSION": s["BLENDER_VERSION"], "recipe": recipe},
+                                      "files": [f"{AutoGDM2_dir}/{f}" for f in ["blender_asset_placer.py", "recipe_io.py", "geometry.py", "stl_io.py"]]},
+            "isaac_asset_placer":    {"settings": {"ISAAC_VERSION": s["ISAAC_VERSION"], "recipe": recipe},
+                                      "files": [os.path.join(self.wh_gen_dir, 'isaac_asset_placer.py')]},
+            "cfd_mesh":              {"settings": {"cfd_mesh_settings": s["cfd_mesh_settings"], "OPENFOAM_VERSION": s["OPENFOAM_VERSION"]},
+                                      "files": [default_cfd_case],
+                                      "upstream": ["blender_asset_placer"]},
+            "cfd_set_params":        {"settings": {"cfd_settings": cfd_settings, "inlet_vel": s["inlet_vel"]},
+                                      "files": [default_cfd_case],
+                                      "upstream": ["cfd_mesh"]},
+            "cfd_run":               {"settings": {"cfd_settings": cfd_settings, "OPENFOAM_VERSION": s["OPENFOAM_VERSION"]},
+                                      "upstream": ["cfd_set_params"]},
+            "make_ros_folder":       {"files": [s["empty_ros_dir"]]},
+            "prep_ros":              {"settings": {k: s[k] for k in ["env_type", "inlet_vel", "cfd_mesh_settings", "src_placement", "gas_type", "sim_time",
+                                                                     "time_step", "wind_looping", "wind_start_step", "wind_stop_step", "wind_file_format"]},
+                                      "upstream": ["cfd_run", "make_ros_folder"]},
+            "run_preprocessing":     {"upstream": ["prep_ros"]},
+            "run_ros":               {"upstream": ["run_preprocessing"]},
+            "gasdata_binary2npy":    {"settings": {"gas_data_format": s["gas_data_format"]},
+                                      "upstream": ["run_ros"]},
+            "windfields_binary2npy": {"settings": {"wind_data_dtype": s["wind_data_dtype"]},
+                                      "upstream": ["run_ros"]},
+            "occupancy_csv2npy":     {"upstream": ["run_preprocessing"]},
+        }
+        return inputs[stage]
+
+
+    # outputs (paths or glob patterns) that have to exist for a stage to count as completed
+    def stage_outputs(self, stage:str, env:str) -> list:
+        s = self.settings
+        ros_loc = f"{s['gaden_env_dir']}{env}/"
+
+        outputs = {
+            "layout_gen":            [recipe_path(s['recipe_dir'], s['env_type'], env, s['recipe_format'])],
+            "blender_asset_placer":  [f"{s['geometry_dir']}{env}/mesh/sides.stl", f"{s['geometry_dir']}{env}/mesh/interior.stl", f"{s['geometry_dir']}{env}/gaden/walls_ascii.stl"],
+            "isaac_asset_placer":    [f"{s['usd_scene_dir']}{env}.usd"],
+            "cfd_mesh":              [f"{s['cfd_dir']}{env}/constant/polyMesh/owner"],
+            "cfd_set_params":        [f"{s['cfd_dir']}{env}/system/controlDict"],
+            "cfd_run":               [f"{s['cfd_dir']}{env}/*/C" if s['cfd_settings']['reconstruct'] else f"{s['cfd_dir']}{env}/log.pimpleFoam"],
+            "make_ros_folder":       [f"{ros_loc}launch/GADEN.launch"],
+            "prep_ros":              [f"{ros_loc}wind_simulations/*/wind_at_cell_centers_0*"],
+            "run_preprocessing":     [f"{ros_loc}OccupancyGrid3D.csv"],
+            "run_ros":               [f"{ros_loc}gas_simulations/*/*/iteration_*"],
+            "gasdata_binary2npy":    [f"{s['gas_data_dir']}{env}"],
+            "windfields_binary2npy": [f"{s['wind_data_dir']}{env}.npy"],
+            "occupancy_csv2npy":     [f"{s['occ_data_dir']}{env}_grid.npy"],
+        }
+        return outputs[stage]
+
+
+    def stage_digest(self, stage:str, env:str) -> str:
+        return self.cache.digest(stage, env, self.stage_inputs(stage, env))
+
+
+    def stage_is_fresh(self, stage:str, env:str) -> bool:
+        return self.resume and self.cache.is_fresh(stage, env, self.stage_digest(stage, env), self.stage_outputs(stage, env))
+
+
+    # run a per-environment stage through the stage cache, the manifest is only written on success
+    def cached_stage(self, stage:str, func, env:str, *args) -> bool:
+        digest = self.stage_digest(stage, env)
+        if self.resume and self.cache.is_fresh(stage, env, digest, self.stage_outputs(stage, env)):
+            self.printGDMStyle(f"[AutoGDM2] {stage} for {env} is up-to-date, skipping.")
+            return True
+
+        self.cache.invalidate(stage, env)
+        success = func(env, *args) is not False
+        if success:
+            self.cache.record(stage, env, digest)
+        return success
+
+
+    # layout generator, results in the recipes (one bundle or a .rec/.txt per environment)
     def layout_gen(self): 
-        self.printGDMStyle(f"[AutoGDM2] Generating {self.settings['env_amount']} recipes for type {self.settings['env_type']}...")
-        generate_recipes(self.settings)
+        self.cache.record_seed(self.settings["seed"])
+        env_ids = [i for i, env in enumerate(self.settings["env_list"]) if not self.stage_is_fresh("layout_gen", env)]
+        if not env_ids:
+            self.printGDMStyle("[AutoGDM2] All recipes are up-to-date, skipping recipe generation.")
+            return
+
+        self.printGDMStyle(f"[AutoGDM2] Generating {len(env_ids)} recipes for type {self.settings['env_type']} with master seed {self.settings['seed']}...")
+        for env_id in env_ids:
+            self.cache.invalidate("layout_gen", self.settings["env_list"][env_id])
+        generate_recipes(self.settings, env_ids, self.settings["pipeline_settings"]["layout_workers"])
+        for env_id in env_ids:
+            env = self.settings["env_list"][env_id]
+            self.cache.record("layout_gen", env, self.stage_digest("layout_gen", env))
         self.printGDMStyle("[AutoGDM2] Completed environment recipe generation. ")
 
 
-    # blender .stl generator, results in stls in environments/mockup_scenes
+    # batch stages run once for all recipes, skipped when every environment is up-to-date
+    def stale_envs(self, stage:str) -> list:
+        return [env for env in self.env_lst if not self.stage_is_fresh(stage, env)]
+
+
+    def record_envs(self, stage:str) -> None:
+        for env in self.env_lst:
+            if all(glob.glob(output) for output in self.stage_outputs(stage, env)):
+                self.cache.record(stage, env, self.stage_digest(stage, env))
+
+
+    # .stl generator, results in stls in environments/mockup_scenes
+    # the .stl files are written with numpy (geometry.py) by stl_workers processes, every mockup mesh is read once per process
+    # Blender only places interiors with mockups other than .obj files, split over stl_workers background Blender processes
+    # a failing recipe (or worker) only leaves its own environments unrecorded
     def blender_asset_placer(self): 
-        self.printGDMStyle("[AutoGDM2] Creating .stl files...")
-        blender_exe = os.path.join(self.blender_dir, 'blender')
-        command = f"{blender_exe} --background --python blender_asset_placer.py -- {self.settings['recipe_dir']} {self.settings['geometry_dir']}" # run blender in the background
-        os.system(command)
+        envs = self.stale_envs("blender_asset_placer")
+        if not envs:
+            self.printGDMStyle("[AutoGDM2] All .stl files are up-to-date, skipping.")
+            return
+
+        self.printGDMStyle(f"[AutoGDM2] Creating .stl files of {len(envs)} environments...")
+        for env in envs:
+            self.cache.invalidate("blender_asset_placer", env)
+
+        failed = set()
+        blender_envs = []
+        with ProcessPoolExecutor(max_workers=min(self.stl_workers(), len(envs))) as pool:
+            futures = {pool.submit(write_recipe_stls, recipe, self.settings['geometry_dir']): recipe_name(recipe)
+                       for recipe in load_recipes(self.settings['recipe_dir'], set(envs))}
+            for future in as_completed(futures):
+                env = futures[future]
+                try:
+                    if not future.result():
+                        blender_envs.append(env)
+                except Exception as e:
+                    self.printGDMStyle(f"[AutoGDM2] Could not create the .stl files of {env}: {e!r}")
+                    failed.add(env)
+
+        if blender_envs:
+            failed.update(self.blender_interiors(sorted(blender_envs)))
+
+        for env in envs:
+            if env not in failed and all(glob.glob(output) for output in self.stage_outputs("blender_asset_placer", env)):
+                self.cache.record("blender_asset_placer", env, self.stage_digest("blender_asset_placer", env))
+            else:
+                failed.add(env)
+        if failed:
+            self.printGDMStyle(f"[AutoGDM2] No .stl files created for: {', '.join(sorted(failed))}")
         self.printGDMStyle("[AutoGDM2] Completed .stl file creation.")        
 
 
+    # processes writing the .stl files (and Blender processes for the remaining interiors)
+    def stl_workers(self) -> int:
+        workers = self.settings['pipeline_settings']['stl_workers']
+        return workers if workers > 0 else len(os.sched_getaffinity(0))
+
+
+    # runs the Blender workers on the interiors of envs, returns the failed environments
+    def blender_interiors(self, envs:list) -> set:
+        workers = min(self.stl_workers(), len(envs))
+        self.printGDMStyle(f"[AutoGDM2] Placing the interiors of {len(envs)} environments with {workers} Blender workers...")
+
+        log_dir = f"{self.settings['geometry_dir']}logs/"
+        os.makedirs(log_dir, exist_ok=True)
+        blender_exe = os.path.join(self.blender_dir, 'blender')
+        procs = []
+        failed = set()
+        for k in range(workers):
+            shard_file = f"{log_dir}blender_shard_{k}.txt"
+            with open(shard_file, 'w') as f:
+                f.write("\n".join(envs[k::workers]))
+            if os.path.isfile(f"{shard_file}.failed"):
+                os.remove(f"{shard_file}.failed")
+            log_file = f"{log_dir}blender_worker_{k}.log"
+            # --python-exit-code: a failed recipe results in a nonzero exit code instead of 0
+            command = [blender_exe, "--background", "--python-exit-code", "1", "--python", f"{AutoGDM2_dir}/blender_asset_placer.py",
+                       "--", self.settings['recipe_dir'], self.settings['geometry_dir'], shard_file]
+            with open(log_file, 'w') as log:
+                try:
+                    procs.append((k, shard_file, log_file, subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)))
+                except OSError as e:
+                    self.printGDMStyle(f"[AutoGDM2] Could not start Blender worker {k}: {e}")
+                    failed.update(envs[k::workers])
+
+        for k, shard_file, log_file, proc in procs:
+            if proc.wait() != 0:
+                self.printGDMStyle(f"[AutoGDM2] Blender worker {k} exited with code {proc.returncode}, see {log_file}")
+                if os.path.isfile(f"{shard_file}.failed"):
+                    with open(f"{shard_file}.failed", 'r') as f:
+                        failed.update(line.strip() for line in f if line.strip())
+                else: # the worker itself crashed, none of its exports can be trusted
+                    failed.update(envs[k::workers])
+        return failed
+
+
     # isaac usd scene generator, results in usd scenes in environments/isaac_sim
     def isaac_asset_placer(self): 
+        if not self.stale_envs("isaac_asset_placer"):
+            self.printGDMStyle("[AutoGDM2] All .usd scenes are up-to-date, skipping.")
+            return
+
         self.printGDMStyle("[AutoGDM2] Creating .usd scenes...")
         isaac_exe = os.path.join(self.isaac_dir, 'python.sh')
         wh_gen_exe= os.path.join(self.wh_gen_dir, 'isaac_asset_placer.py')
-        command = f"{isaac_exe} {wh_gen_exe} -- {self.settings['recipe_dir']} {self.settings['usd_scene_dir']}"
+        command = f"{isaac_exe} {wh_gen_exe} -- {self.settings['recipe_dir']} {self.settings['usd_scene_dir']} {AutoGDM2_dir}" # AutoGDM2_dir to import recipe_io
         os.system(command)
+        self.record_envs("isaac_asset_placer")
         self.printGDMStyle("[AutoGDM2] Completed .usd scene creation.")  
 
 
@@ -128,432 +364,508 @@ class AutoGDM2:
         self.printGDMStyle("[AutoGDM2] Creating CFD meshes...")
 
         for scenedir in self.env_lst:
-            currentdir = f"{self.settings['geometry_dir']}{scenedir}/mesh/"
-            self.printGDMStyle(f"[AutoGDM2] Meshing environment {scenedir}...")
-
-            # remove comined.stl if it already exists
-            if os.path.isfile(f"{currentdir}combined.stl"): os.remove(f"{currentdir}combined.stl")
-
-            stls = glob.glob(f"{currentdir}*.stl")            # gather all stls
-            stls_str = ' '.join([str(item) for item in stls]) # put them in one string separated by spaces
-
-            # edit the solid name at the start and end of each .stl file
-            # (bad method for large files but it works for now)
-            for stl_path in stls:
-                with open(f"{stl_path}", "r") as f:
-                    stl_name = stl_path.rsplit('/', 1)[-1][:-4]
-                    data = f.readlines()
-                    data[0]  = f"solid {stl_name}\n" # don't forget to add a newline!
-                    data[-1] = f"endsolid {stl_name}\n"
-
-                with open(f"{stl_path}", "w") as f: 
-                    f.writelines(data)
-                    f.close()
-
-            # combine .stls with cat command and change to a .fms file
-            catcommand = f"cat {stls_str} >> combined.stl"
-            fmscommand = "surfaceFeatureEdges combined.stl combined.fms"
-            os.system(f"cd {currentdir} && {catcommand} && {fmscommand}")
-
-            # change boundary conditions at the start of combined.fms
-            with open(f"{currentdir}combined.fms", "r") as f:
-                data = f.readlines()
-                for i,line in enumerate(data[0:20]): # check only the first 20 lines
-                    if "outlet" in line: data[i] = "outlet patch\n"
-                    elif "interior" in line: data[i] = "interior wall\n"
-                    elif "inlet" in line: data[i] = "inlet patch\n"
-                    elif "sides" in line: data[i] = "sides wall\n"
-
-            with open(f"{currentdir}combined.fms", "w") as f:
-                f.writelines(data)
-                f.close()
-
-            # create cfd case directory if it does not exist already from defualt_cfd_case
-            cfd_case_dir = f"{self.settings['cfd_dir']}{scenedir}/"
-            if not os.path.isdir(cfd_case_dir):
-                os.system(f"cp -r {self.settings['cfd_dir']}default_cfd_case {cfd_case_dir}")
-
-            # move .fms to separate cfd dir in environments/cfd
-            os.system(f"cp {currentdir}combined.fms {cfd_case_dir}")
-
-            # set mesh settings
-            with open(f"{cfd_case_dir}system/meshDict", "r") as f:
-                data = f.readlines()
-                data[20] = f"minCellSize {self.settings['cfd_mesh_settings']['minCellSize']};\n"
-                data[22] = f"maxCellSize {self.settings['cfd_mesh_settings']['maxCellSize']};\n"
-                data[24] = f"boundaryCellSize {self.settings['cfd_mesh_settings']['boundaryCellSize']};\n"
-                if self.settings['cfd_mesh_settings']["localRefinement"] != 0:
-                    data[26] = "localRefinement\n" # uncomment localRefinement setting
-                    data[30] = f"        cellSize {self.settings['cfd_mesh_settings']['localRefinement']};\n"
-                    data[32] = "}\n"
-
-            with open(f"{cfd_case_dir}/system/meshDict", "w") as f:
-                f.writelines(data)
-                f.close()
-
-            # run the meshing process
-            os.system(f"cd {cfd_case_dir} && cartesianMesh")
+            self.cached_stage("cfd_mesh", self.cfd_mesh_env, scenedir)
 
         self.printGDMStyle("[AutoGDM2] Completed CFD mesh creation.")
 
 
+    def cfd_mesh_env(self, scenedir:str) -> bool:
+        currentdir = f"{self.settings['geometry_dir']}{scenedir}/mesh/"
+        self.printGDMStyle(f"[AutoGDM2] Meshing environment {scenedir}...")
+
+        # combine the ascii/binary .stls into one multi-solid ascii .stl, every solid named after its file (patch name)
+        stls = sorted(stl for stl in glob.glob(f"{currentdir}*.stl") if not stl.endswith("combined.stl"))
+        combine_stls(f"{currentdir}combined.stl", [(os.path.basename(stl)[:-4], stl) for stl in stls])
+
+        # change to a .fms file (feature edges) and set the boundary conditions at the start of combined.fms
+        if os.system(f"cd {currentdir} && surfaceFeatureEdges combined.stl combined.fms") != 0:
+            return False
+        set_fms_patch_types(f"{currentdir}combined.fms", {"outlet": "patch", "interior": "wall", "inlet": "patch", "sides": "wall"})
+
+        # (re)create the cfd case from the rendered template and move the .fms to it
+        cfd_case_dir = f"{self.settings['cfd_dir']}{scenedir}/"
+        clone_case(self.case_template(), cfd_case_dir)
+        shutil.copyfile(f"{currentdir}combined.fms", f"{cfd_case_dir}combined.fms")
+
+        # run the meshing process
+        return os.system(f"cd {cfd_case_dir} && cartesianMesh") == 0
+
+
     def cfd_set_params(self):
         self.printGDMStyle("[AutoGDM2] Setting CFD parameters...")
 
-        for cfd_case in self.env_lst:
-            cfd_case_dir = f"{self.settings['cfd_dir']}{cfd_case}/"
-
-            #### 0 folder ####
-            # set U
-            with open(f"{cfd_case_dir}0/U", "r") as f:
-                data = f.readlines()
-                data[25] = f"        value           uniform ({self.settings['inlet_vel'][0]} {self.settings['inlet_vel'][1]} {self.settings['inlet_vel'][2]});\n"
-
-            with open(f"{cfd_case_dir}0/U", "w") as f:
-                f.writelines(data)
-                f.close()
-
-            # set k (turbelent kinetic energy)
-            with open(f"{cfd_case_dir}0/k", "r") as f:
-                data = f.readlines()
-                data[21] = f"internalField   uniform {self.settings['cfd_settings']['k']};\n"
-                for i in [28, 39, 45]:
-                    data[i] = f"        value           uniform {self.settings['cfd_settings']['k']};\n"
-
-            with open(f"{cfd_case_dir}0/k", "w") as f:
-                f.writelines(data)
-                f.close()
-
-            # set epsilon (dissipation rate)
-            with open(f"{cfd_case_dir}0/epsilon", "r") as f:
-                data = f.readlines()
-                data[21] = f"internalField   uniform {self.settings['cfd_settings']['epsilon']};\n"
-                for i in [28, 39, 45]:
-                    data[i] = f"        value           uniform {self.settings['cfd_settings']['epsilon']};\n"
-
-            with open(f"{cfd_case_dir}0/epsilon", "w") as f:
-                f.writelines(data)
-                f.close
-
-            #### sytem folder ####
-            # decomposeParDict (set the division of the mesh to the amount of threads)
-            with open(f"{cfd_case_dir}system/decomposeParDict", "r") as f:
-                data = f.readlines()
-                data[17] = f"numberOfSubdomains  {self.settings['cfd_settings']['threads']};\n"
-
-            with open(f"{cfd_case_dir}system/decomposeParDict", "w") as f:
-                f.writelines(data)
-                f.close()
-
-            # controlDict
-            with open(f"{cfd_case_dir}system/controlDict", "r") as f:
-                data = f.readlines()
-                data[24] = f"endTime         {self.settings['cfd_settings']['endTime']};\n"
-                data[30] = f"writeInterval   {self.settings['cfd_settings']['writeInterval']};\n"
-                data[48] = f"maxCo           {self.settings['cfd_settings']['maxCo']};\n"
-                if self.settings['cfd_settings']['maxDeltaT'] != 0.0:
-                    data[50] = f"maxDeltaT 	{self.settings['cfd_settings']['maxDeltaT']};\n"
-
-            with open(f"{cfd_case_dir}system/controlDict", "w") as f:
-                f.writelines(data)
-                f.close()
-
-            # fvSolution
-            with open(f"{cfd_case_dir}system/fvSolution", "r") as f:
-                data = f.readlines()
-                data[51] = f"    nOuterCorrectors		{self.settings['cfd_settings']['nOuterCorrectors']};\n"
-
-            with open(f"{cfd_case_dir}system/fvSolution", "w") as f:
-                f.writelines(data)
-                f.close()
+        self.case_template() # rendered once, before the cases are provisioned in parallel
+        provision_all(partial(self.cached_stage, "cfd_set_params", self.cfd_set_params_env), self.env_lst, self.settings['pipeline_settings']['provision_workers'])
 
         self.printGDMStyle("[AutoGDM2] CFD parameters set.")
 
 
+    # the case files are rendered once per batch (case_template), every case links the files of the template
+    def cfd_set_params_env(self, cfd_case:str) -> bool:
+        clone_case(self.case_template(), f"{self.settings['cfd_dir']}{cfd_case}/")
+        return True
+
+
+    # entries set in the default case, {file: {key path: value}}
+    def cfd_case_edits(self) -> dict:
+        mesh = self.settings['cfd_mesh_settings']
+        cfd = self.settings['cfd_settings']
+        boundary_values = lambda value: {f"boundaryField/{patch}/value": f"uniform {value}" for patch in ["inlet", "interior", "sides"]}
+
+        mesh_dict = {"minCellSize": mesh['minCellSize'], "maxCellSize": mesh['maxCellSize'], "boundaryCellSize": mesh['boundaryCellSize']}
+        if mesh["localRefinement"] != 0:
+            mesh_dict['localRefinement/"interior"/cellSize'] = mesh['localRefinement']
+
+        control_dict = {"endTime": cfd['endTime'], "writeInterval": cfd['writeInterval'], "maxCo": cfd['maxCo']}
+        if cfd['maxDeltaT'] != 0.0:
+            control_dict["maxDeltaT"] = cfd['maxDeltaT']
+        if self.cfd_monitored():
+            control_dict.update(probes_entries(self.cfd_probe_locations(), cfd['probeInterval']))
+
+        return {
+            "system/meshDict":          mesh_dict,
+            "0/U":                      {"boundaryField/inlet/value": f"uniform {foam_value(self.settings['inlet_vel'])}"},
+            "0/k":                      {"internalField": f"uniform {cfd['k']}", **boundary_values(cfd['k'])},               # turbulent kinetic energy
+            "0/epsilon":                {"internalField": f"uniform {cfd['epsilon']}", **boundary_values(cfd['epsilon'])},   # dissipation rate
+            "system/decomposeParDict":  {"numberOfSubdomains": cfd['threads']}, # division of the mesh over the threads
+            "system/controlDict":       control_dict,
+            "system/fvSolution":        {"PIMPLE/nOuterCorrectors": cfd['nOuterCorrectors']},
+        }
+
+
+    # the CFD stops early once the flow is steady, only when the latest time is used as the steady state
+    def cfd_monitored(self) -> bool:
+        return self.settings['cfd_settings']['latestTime'] and self.settings['cfd_settings']['convergenceWindow'] > 0.0
+
+
+    # velocity probes on a grid over the environment, probes inside the interior (no cells) are skipped by OpenFOAM
+    def cfd_probe_locations(self) -> list:
+        fractions = [0.25, 0.5, 0.75]
+        x, y, z = self.settings['env_size']
+        return [(round(fx*x, 6), round(fy*y, 6), round(fz*z, 6)) for fx in fractions for fy in fractions for fz in [0.25, 0.75]]
+
+
+    # default_cfd_case rendered with the current settings, shared by all cases with these settings
+    def case_template(self) -> str:
+        edits = self.cfd_case_edits()
+        key = json.dumps(edits, sort_keys=True, default=str)
+        if key not in self.case_templates:
+            self.case_templates[key] = case_template(f"{self.settings['cfd_dir']}default_cfd_case", f"{self.settings['cfd_dir']}templates/", edits)
+        return self.case_templates[key]
+
+
+    # the cases run concurrently, every case on its own CPUs (cfd_ranks), cases wait until enough CPUs are free
+    # at most one case per CPU can hold CPUs at once, so no more threads than CPUs are needed
     def cfd_run(self):
         self.printGDMStyle("[AutoGDM2] Running CFD...")
 
-        for cfd_case in self.env_lst:
-            cfd_case_dir = f"{self.settings['cfd_dir']}{cfd_case}/"
-            self.printGDMStyle(f"[AutoGDM2] Running CFD for case {cfd_case}...")
-            runcmd = f"mpirun --use-hwthread-cpus -np {self.settings['cfd_settings']['threads']} pimpleFoam -parallel"
-
-            if self.settings['cfd_settings']['latestTime']:
-                processcmd = f"postProcess -func 'components(U)' -latestTime && postProcess -func 'writeCellCentres' -latestTime"
-            else:
-                processcmd = f"postProcess -func 'components(U)' -time {self.settings['cfd_settings']['timeRange']} && postProcess -func 'writeCellCentres' -time {self.settings['cfd_settings']['timeRange']}"            
-            
-            # decompose -> run CFD -> reconstruct -> postprocess
-            os.system(f"cd {cfd_case_dir} && decomposePar && {runcmd} && reconstructPar && {processcmd}")
+        with ThreadPoolExecutor(max_workers=max(1, min(len(self.env_lst), len(self.cpu_set.cpus)))) as pool:
+            list(pool.map(partial(self.cached_stage, "cfd_run", self.cfd_run_env), self.env_lst))
 
         self.printGDMStyle("[AutoGDM2] Completed CFD.")
         return
 
 
+    # MPI ranks of a meshed case, following from its amount of cells
+    def cfd_ranks(self, cfd_case:str) -> int:
+        cfd_settings = self.settings['cfd_settings']
+        return case_ranks(mesh_cells(f"{self.settings['cfd_dir']}{cfd_case}/"), cfd_settings['cells_per_rank'], min(cfd_settings['threads'], len(self.cpu_set.cpus)))
+
+
+    def cfd_run_env(self, cfd_case:str) -> bool:
+        cfd_case_dir = f"{self.settings['cfd_dir']}{cfd_case}/"
+        try:
+            ranks = self.cfd_ranks(cfd_case)
+        except (OSError, ValueError) as e:
+            self.printGDMStyle(f"[AutoGDM2] Could not read the mesh of case {cfd_case}: {e}")
+            return False
+
+        # without reconstruction prep_ros reads U from the processor directories and computes the cell centres from the mesh
+        post_processing = []
+        if self.settings['cfd_settings']['reconstruct']:
+            if self.settings['cfd_settings']['latestTime']:
+                time_arg = ["-latestTime"]
+            else:
+                time_arg = ["-time", self.settings['cfd_settings']['timeRange']]
+            post_processing = [("postProcess.components", ["postProcess", "-func", "components(U)"] + time_arg),
+                               ("postProcess.writeCellCentres", ["postProcess", "-func", "writeCellCentres"] + time_arg)]
+
+        monitor = None
+        if self.cfd_monitored():
+            cfd_settings = self.settings['cfd_settings']
+            monitor = ConvergenceMonitor(cfd_case_dir, "pimpleFoam", cfd_settings['residualTol'],
+                                         cfd_settings['velocityTol'] * max(np.linalg.norm(self.settings['inlet_vel']), 1e-6),
+                                         cfd_settings['convergenceWindow'])
+
+        # decompose -> run CFD (until steady or endTime) -> reconstruct -> postprocess, every step logged in the case
+        cpus = self.cpu_set.acquire(ranks)
+        self.printGDMStyle(f"[AutoGDM2] Running CFD for case {cfd_case} on {len(cpus)} rank(s)...")
+        try:
+            success, message = run_case(cfd_case_dir, cpus, post_processing, monitor=monitor, reconstruct=self.settings['cfd_settings']['reconstruct'])
+        finally:
+            self.cpu_set.release(cpus)
+        self.printGDMStyle(f"[AutoGDM2] CFD for case {cfd_case} {message}")
+        return success
+
+
     def make_ros_folder(self): # adapted from AUTOGDM TODO: improve
         self.printGDMStyle(f"[AutoGDM2] Creating ROS directories in {self.settings['gaden_env_dir']}...")
-        
-        for env in self.env_lst:
-            self.ros_loc = f"{self.settings['gaden_env_dir']}{env}"
-            if os.path.exists(self.ros_loc):
-                os.system(f"rm -rf {self.ros_loc}") # TODO move to cleanup?
 
-            os.system(f"mkdir -p {self.ros_loc}") # create env dir in gaden_env_dir
-            os.system(f"cp -r {self.settings['empty_ros_dir']}* {self.ros_loc}") # copy the empty ROS dir to it        
-        
+        provision_all(partial(self.cached_stage, "make_ros_folder", self.make_ros_folder_env), self.env_lst, self.settings['pipeline_settings']['provision_workers'])
+
         self.printGDMStyle(f"[AutoGDM2] Created ROS directories in {self.settings['gaden_env_dir']}.")
 
 
+    # fresh clone of the empty ROS dir, the launch files edited by prep_ros are copied, all other files are hardlinked
+    def make_ros_folder_env(self, env:str) -> bool:
+        try:
+            clone_tree(self.settings['empty_ros_dir'], f"{self.settings['gaden_env_dir']}{env}", modified=lambda rel_path: rel_path in ROS_MODIFIED_FILES, clean=True)
+        except OSError as e:
+            self.printGDMStyle(f"[AutoGDM2] Could not create the ROS directory of {env}: {e}")
+            return False
+        return True
+
+
     # prepare ROS directory with environment-specific configurations (adapted from AutoGDM)
     def prep_ros(self):
         self.printGDMStyle(f"[AutoGDM2] Preparing ROS...")
-        sim_arg = f"{int(sum(self.settings['inlet_vel']))}ms" # simulation argument (required in GADEN.launch, gives possibility to use multiple wind simulations)
         invalid_idx = []
 
-        for env_idx,env in enumerate(self.env_lst):
-
-            self.cfd_folder = f"{self.settings['cfd_dir']}{env}"
-            self.ros_loc = f"{self.settings['gaden_env_dir']}{env}"
-            os.system(f"mkdir -p {self.ros_loc}/wind_simulations/{sim_arg}/") # create dir for specific wind simulation
-            
-            time_dirs = [i for i in os.listdir(self.cfd_folder) if is_float(i)]
-            time_dirs_float = [float(i) for i in time_dirs] # necessary for np.argmax
-            
-            if self.settings['cfd_settings']['latestTime']:
-                steps = [time_dirs[np.argmax(time_dirs_float)]]
-            else:
-                # get start and stop value from settings
-                start_stop = [float(i) for i in re.findall(r"[-+]?\d*\.?\d+",self.settings['cfd_settings']['timeRange'])]
-                # get all timesteps that are within the range
-                steps = np.sort([i for i in time_dirs_float if i >= start_stop[0] and i <= start_stop[1]])
-                steps = [str(i) for i in steps]
-                # change float values to integer if possible
-                for i,step in enumerate(steps):
-                    if float(steps[i]).is_integer():
-                        steps[i] = str(int(float(step))) # ugly but it works!
-            
-            for step_idx,step in enumerate(steps):
-                try:
-                    f = open(f"{self.cfd_folder}/{step}/C")
-                except FileNotFoundError:
-                    print(f"CFD failed for this environment, skipping...")
+        with ProcessPoolExecutor(max_workers=self.prep_workers()) as pool: # shared by all environments
+            for env_idx,env in enumerate(self.env_lst):
+                if not self.cached_stage("prep_ros", self.prep_ros_env, env, pool):
                     invalid_idx.append(env_idx) # save invalid env idx to remove later
-                    continue
-                
-                print(f"Preparing windfield {step_idx + 1}/{len(steps)}")
-                
-                self.points_file = f.readlines() 
-                self.points_x = []
-                self.points_y = []
-                self.points_z = []
-
-                for i,line in enumerate(self.points_file):
-                    if i >=23:
-                        if line.find(")") == 0:
-                            break
-                        
-                        line = line.replace("("," ").replace(")"," ").split()
-                        self.points_x.append(float(line[0]))
-                        self.points_y.append(float(line[1]))
-                        self.points_z.append(float(line[2]))
-                
-                    
-                timestep = flow_field(step)
-                f = open(self.cfd_folder+"/"+str(step)+'/U')
-                flow_data = f.readlines()    
-                Ux = []
-                Uy = []
-                Uz = []
-
-                for i,line in enumerate(flow_data):
-                    if i >=23:
-                        if line.find(")") == 0:
-                            break
-                        
-                        line = line.replace("("," ").replace(")"," ").split()
-                        Ux.append(float(line[0]))
-                        Uy.append(float(line[1]))
-                        Uz.append(float(line[2]))
-                
-                timestep.Ux, timestep.Uy, timestep.Uz = Ux, Uy, Uz
-
-                data = {'U:0': timestep.Ux, 'U:1':timestep.Uy,'U:2':  timestep.Uz,'Points:0':self.points_x,'Points:1':self.points_y,'Points:2':self.points_z}
-                df = pd.DataFrame(data, columns= ['U:0','U:1','U:2','Points:0','Points:1','Points:2'])
-                df.to_csv(f"{self.ros_loc}/wind_simulations/{sim_arg}/wind_at_cell_centers_{step_idx}.csv",index=False,header=True)
-            
-            # gather .stls in ./environments/geometry and copy them to the gaden/envs/envname folder
-            self.ros_cad_loc = f"{self.ros_loc}/cad_models/"
-            stls = glob.glob(f"{self.settings['geometry_dir']}{env}/gaden/*.stl") # gather all stls
-            stls_str = ' '.join([str(item) for item in stls])    # put them in one string separated by spaces
-            os.system(f"cp {stls_str} {self.ros_cad_loc}")
-
-            # get new empty point for source
-            # self.place_source() # TODO move out
-
-            # edit launch files
-            self.ros_launch_folder = self.ros_loc + '/launch/'
-
-            # GADEN_preprocessing.launch
-            # TODO make specification for outlet CAD models flexible by inserting more lines (multiple outlets possible)
-            with open(f"{self.ros_launch_folder}GADEN_preprocessing.launch", "r") as f:
-                data = f.readlines()
-            data[5] = f'    <arg name="scenario" default="{env}"/>\n'
-            data[10] =f'        <param name="cell_size" value="{self.settings["cfd_mesh_settings"]["minCellSize"]}"/>\n' # set gas sim cell size to the cfd mesh size
-            data[33] =f'        <param name="empty_point_x" value="{round(self.settings["src_placement"][0],2)}"/>      ### (m)\n'
-            data[34] =f'        <param name="empty_point_y" value="{round(self.settings["src_placement"][1],2)}"/>      ### (m)\n'
-            data[35] =f'        <param name="empty_point_z" value="{round(self.settings["src_placement"][2],2)}"/>      ### (m)\n'
-            data[40] =f'        <param name="wind_files" value="$(find envs)/$(arg scenario)/wind_simulations/{sim_arg}/wind_at_cell_centers"/>\n'
-
-            if self.settings["env_type"] == 'wh_empty': # delete interior cad model from launchfile
-                data[13] = '        <param name="number_of_models" value="1"/>'
-                data[15] = ''
-
-            with open(f"{self.ros_launch_folder}GADEN_preprocessing.launch", "w") as f:
-                f.writelines(data)
-                f.close()
-
-            # GADEN.launch # TODO add filament simulator settings and looping options
-            with open(f"{self.ros_launch_folder}GADEN.launch", "r") as f:
-                data = f.readlines()
-            data[5] = f'    <arg name="scenario" default="{env}"/>\n'
-            data[6] = f'    <arg name="simulation" default="{sim_arg}" />\n'
-            data[7] = f'    <arg name="source_location_x" value="{"%.2f" % self.settings["src_placement"][0]}"/>      ### (m)\n'
-            data[8] = f'    <arg name="source_location_y" value="{"%.2f" % self.settings["src_placement"][1]}"/>      ### (m)\n'
-            data[9] = f'    <arg name="source_location_z" value="{"%.2f" % self.settings["src_placement"][2]}"/>      ### (m)\n'
-            data[50] = f'	    <param name="sim_time" value="{self.settings["sim_time"]}" />                    ### [sec] Total time of the gas dispersion simulation\n'
-            data[51] = f'	    <param name="time_step" value="{self.settings["time_step"]}" />                   ### [sec] Time increment between snapshots. Set aprox = cell_size/max_wind_speed.\n'
-            data[58] = f'	    <param name="gas_type" value="{self.settings["gas_type"]}" />                      ### 0=Ethanol, 1=Methane, 2=Hydrogen, 6=Acetone\n'
-            data[68] = f'	    <param name="wind_time_step" value="{self.settings["cfd_settings"]["writeInterval"]}" />                ### (sec) time increment between Wind snapshots\n'
-            data[70] = f'        <param name="/allow_looping" value="{self.settings["wind_looping"]}" />\n'
-            data[71] = f'        <param name="/loop_from_step" value="{self.settings["wind_start_step"]}" />\n'
-            data[72] = f'        <param name="/loop_to_step" value="{self.settings["wind_stop_step"]}" />\n'
-
-            with open(f"{self.ros_launch_folder}GADEN.launch", "w") as f:
-                f.writelines(data)
-                f.close()
-
-            # GADEN_player.launch # TODO check for relevant CAD models and add/delete automatically
-            with open(f"{self.ros_launch_folder}GADEN_player.launch", "r") as f:
-                data = f.readlines()
-            data[4] = f'    <arg name="scenario" default="{env}"/>\n'
-            data[5] = f'    <arg name="simulation" default="{sim_arg}" />\n'
-            data[6] = f'    <arg name="source_location_x" value="{"%.2f" % self.settings["src_placement"][0]}"/>      ### (m)\n'
-            data[7] = f'    <arg name="source_location_y" value="{"%.2f" % self.settings["src_placement"][1]}"/>      ### (m)\n'
-            data[8] = f'    <arg name="source_location_z" value="{"%.2f" % self.settings["src_placement"][2]}"/>      ### (m)\n'
-
-            with open(f"{self.ros_launch_folder}GADEN_player.launch", "w") as f:
-                f.writelines(data)
-                f.close()
-        
+
         self.remove_envs(invalid_idx) # remove the failed environments from the environment list
 
         self.printGDMStyle(f"[AutoGDM2] Prepared ROS.")
 
 
+    # worker processes used to convert the CFD timesteps to wind files
+    def prep_workers(self) -> int:
+        workers = self.settings['pipeline_settings']['prep_workers']
+        return workers if workers > 0 else len(os.sched_getaffinity(0))
+
+
+    # pool: process pool to convert the timesteps with, a new one is created when None
+    def prep_ros_env(self, env:str, pool:ProcessPoolExecutor=None) -> bool:
+        sim_arg = f"{int(sum(self.settings['inlet_vel']))}ms" # simulation argument (required in GADEN.launch, gives possibility to use multiple wind simulations)
+        cfd_folder = f"{self.settings['cfd_dir']}{env}"
+        ros_loc = f"{self.settings['gaden_env_dir']}{env}"
+        os.system(f"mkdir -p {ros_loc}/wind_simulations/{sim_arg}/") # create dir for specific wind simulation
+
+        time_dirs = [i for i in case_times(cfd_folder) if float(i) > 0.0] # reconstructed or in the processor directories, 0 holds the initial conditions
+
+        if self.settings['cfd_settings']['latestTime']:
+            steps = time_dirs[-1:]
+        else:
+            # get start and stop value from settings
+            start_stop = [float(i) for i in re.findall(r"[-+]?\d*\.?\d+",self.settings['cfd_settings']['timeRange'])]
+            # get all timesteps that are within the range
+            steps = [i for i in time_dirs if float(i) >= start_stop[0] and float(i) <= start_stop[1]]
+
+        wind_files = f"{ros_loc}/wind_simulations/{sim_arg}/wind_at_cell_centers"
+        binary = self.settings["wind_file_format"] == 'binary'
+        if not binary and os.path.isfile(f"{wind_files}_points.bin"):
+            os.remove(f"{wind_files}_points.bin") # GADEN preprocessing uses the binary files when this one exists
+
+        # cell centres are identical for every timestep, parse them once per environment
+        try:
+            points = read_cell_centres(cfd_folder, steps[0]) # (N,3)
+        except (OSError, ValueError, IndexError) as e:
+            print(f"CFD failed for this environment, skipping... ({type(e).__name__}: {e})")
+            return False
+
+        if binary:
+            write_gaden_wind(f"{wind_files}_points.bin", points)
+            points_file = None
+        else: # shared with the worker processes through a memory-mapped .npy
+            points_file = f"{wind_files}_points.npy"
+            np.save(points_file, points)
+        del points
+
+        # convert the timesteps in parallel
+        ext = 'bin' if binary else 'csv'
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=min(self.prep_workers(), len(steps)))
+            own_pool = True
+        else:
+            own_pool = False
+
+        futures = [pool.submit(prep_windfield, cfd_folder, step, f"{wind_files}_{step_idx}.{ext}", points_file) for step_idx, step in enumerate(steps)]
+        success = True
+        for done, future in enumerate(as_completed(futures)):
+            try:
+                future.result()
+                print(f"[AutoGDM2] Prepared windfield {done + 1}/{len(steps)} for {env}")
+            except (OSError, ValueError) as e: # missing or malformed (e.g. unconverged) CFD output only fails this environment
+                print(f"CFD failed for this environment, skipping... ({type(e).__name__}: {e})")
+                success = False
+
+        if own_pool:
+            pool.shutdown()
+        if points_file is not None:
+            os.remove(points_file)
+        if not success:
+            return False
+
+        # gather .stls in ./environments/geometry and copy them to the gaden/envs/envname folder
+        ros_cad_loc = f"{ros_loc}/cad_models/"
+        os.makedirs(ros_cad_loc, exist_ok=True)
+        for stl in glob.glob(f"{self.settings['geometry_dir']}{env}/gaden/*.stl"): # gather all stls
+            place_file(stl, f"{ros_cad_loc}{os.path.basename(stl)}", link=False) # own (copy-on-write) copy, the geometry is rewritten in place
+
+        # get new empty point for source
+        # self.place_source() # TODO move out
+
+        # edit launch files
+        ros_launch_folder = ros_loc + '/launch/'
+
+        # GADEN_preprocessing.launch
+        # TODO make specification for outlet CAD models flexible by inserting more lines (multiple outlets possible)
+        with open(f"{ros_launch_folder}GADEN_preprocessing.launch", "r") as f:
+            data = f.readlines()
+        data[5] = f'    <arg name="scenario" default="{env}"/>\n'
+        data[10] =f'        <param name="cell_size" value="{self.settings["cfd_mesh_settings"]["minCellSize"]}"/>\n' # set gas sim cell size to the cfd mesh size
+        data[33] =f'        <param name="empty_point_x" value="{round(self.settings["src_placement"][0],2)}"/>      ### (m)\n'
+        data[34] =f'        <param name="empty_point_y" value="{round(self.settings["src_placement"][1],2)}"/>      ### (m)\n'
+        data[35] =f'        <param name="empty_point_z" value="{round(self.settings["src_placement"][2],2)}"/>      ### (m)\n'
+        data[40] =f'        <param name="wind_files" value="$(find envs)/$(arg scenario)/wind_simulations/{sim_arg}/wind_at_cell_centers"/>\n'
+
+        if self.settings["env_type"] == 'wh_empty': # delete interior cad model from launchfile
+            data[13] = '        <param name="number_of_models" value="1"/>'
+            data[15] = ''
+
+        with open(f"{ros_launch_folder}GADEN_preprocessing.launch", "w") as f:
+            f.writelines(data)
+            f.close()
+
+        # GADEN.launch # TODO add filament simulator settings and looping options
+        with open(f"{ros_launch_folder}GADEN.launch", "r") as f:
+            data = f.readlines()
+        data[5] = f'    <arg name="scenario" default="{env}"/>\n'
+        data[6] = f'    <arg name="simulation" default="{sim_arg}" />\n'
+        data[7] = f'    <arg name="source_location_x" value="{"%.2f" % self.settings["src_placement"][0]}"/>      ### (m)\n'
+        data[8] = f'    <arg name="source_location_y" value="{"%.2f" % self.settings["src_placement"][1]}"/>      ### (m)\n'
+        data[9] = f'    <arg name="source_location_z" value="{"%.2f" % self.settings["src_placement"][2]}"/>      ### (m)\n'
+        data[50] = f'	    <param name="sim_time" value="{self.settings["sim_time"]}" />                    ### [sec] Total time of the gas dispersion simulation\n'
+        data[51] = f'	    <param name="time_step" value="{self.settings["time_step"]}" />                   ### [sec] Time increment between snapshots. Set aprox = cell_size/max_wind_speed.\n'
+        data[58] = f'	    <param name="gas_type" value="{self.settings["gas_type"]}" />                      ### 0=Ethanol, 1=Methane, 2=Hydrogen, 6=Acetone\n'
+        data[68] = f'	    <param name="wind_time_step" value="{self.settings["cfd_settings"]["writeInterval"]}" />                ### (sec) time increment between Wind snapshots\n'
+        data[70] = f'        <param name="/allow_looping" value="{self.settings["wind_looping"]}" />\n'
+        data[71] = f'        <param name="/loop_from_step" value="{self.settings["wind_start_step"]}" />\n'
+        data[72] = f'        <param name="/loop_to_step" value="{self.settings["wind_stop_step"]}" />\n'
+
+        with open(f"{ros_launch_folder}GADEN.launch", "w") as f:
+            f.writelines(data)
+            f.close()
+
+        # GADEN_player.launch # TODO check for relevant CAD models and add/delete automatically
+        with open(f"{ros_launch_folder}GADEN_player.launch", "r") as f:
+            data = f.readlines()
+        data[4] = f'    <arg name="scenario" default="{env}"/>\n'
+        data[5] = f'    <arg name="simulation" default="{sim_arg}" />\n'
+        data[6] = f'    <arg name="source_location_x" value="{"%.2f" % self.settings["src_placement"][0]}"/>      ### (m)\n'
+        data[7] = f'    <arg name="source_location_y" value="{"%.2f" % self.settings["src_placement"][1]}"/>      ### (m)\n'
+        data[8] = f'    <arg name="source_location_z" value="{"%.2f" % self.settings["src_placement"][2]}"/>      ### (m)\n'
+
+        with open(f"{ros_launch_folder}GADEN_player.launch", "w") as f:
+            f.writelines(data)
+            f.close()
+
+        return True
+
+
+    # roslaunch command, concurrent environments each get their own ROS master port
+    def roslaunch_cmd(self, env:str, launchfile:str) -> str:
+        if not self.settings['pipeline_settings']['parallel']:
+            return f"roslaunch {launchfile}"
+        port = 11312 + int(env.rsplit('_', 1)[-1]) # 11311 is left for the default ROS master
+        return f"ROS_MASTER_URI=http://localhost:{port} roslaunch -p {port} {launchfile}"
+
+
     # roslaunch GADEN preprocessing (adapted from AutoGDM)
     def run_preprocessing(self):
         self.printGDMStyle(f"[AutoGDM2] Preprocessing with GADEN...")
         for env in self.env_lst:
-            self.printGDMStyle(f"[AutoGDM2] Preprocessing {env} with GADEN...")
-            self.ros_loc = f"{self.settings['gaden_env_dir']}{env}"
-            self.ros_launch_folder = self.ros_loc + '/launch/'
-            os.system(f"cd {self.ros_launch_folder} && roslaunch GADEN_preprocessing.launch")
-        
+            self.cached_stage("run_preprocessing", self.run_preprocessing_env, env)
+
         self.printGDMStyle(f"[AutoGDM2] GADEN Preprocessing finished.")
 
 
+    def run_preprocessing_env(self, env:str) -> bool:
+        self.printGDMStyle(f"[AutoGDM2] Preprocessing {env} with GADEN...")
+        ros_launch_folder = f"{self.settings['gaden_env_dir']}{env}/launch/"
+        return os.system(f"cd {ros_launch_folder} && {self.roslaunch_cmd(env, 'GADEN_preprocessing.launch')}") == 0
+
+
     # roslaunch GADEN gas_simulator (adapted from AutoGDM)
     def run_ros(self):
         self.printGDMStyle(f"[AutoGDM2] Simulating gas dispersal with GADEN...")
         for env in self.env_lst:
-            self.printGDMStyle(f"[AutoGDM2] Simulating gas dispersal for {env} with GADEN...")
-            self.ros_loc = f"{self.settings['gaden_env_dir']}{env}"
-            self.ros_launch_folder = self.ros_loc + '/launch/'
-            os.system(f"cd {self.ros_launch_folder} && roslaunch GADEN.launch")
+            self.cached_stage("run_ros", self.run_ros_env, env)
 
         self.printGDMStyle(f"[AutoGDM2] Finished gas dispersal simulation with GADEN...")
 
-    # TODO - generate one array containing all gas iterations
+
+    def run_ros_env(self, env:str) -> bool:
+        self.printGDMStyle(f"[AutoGDM2] Simulating gas dispersal for {env} with GADEN...")
+        ros_launch_folder = f"{self.settings['gaden_env_dir']}{env}/launch/"
+        return os.system(f"cd {ros_launch_folder} && {self.roslaunch_cmd(env, 'GADEN.launch')}") == 0
+
     # compressed binary to numpy files for easy python use
     def gasdata_binary2npy(self, savetxt=False):
         for env_dir in self.env_lst:
-            # create folder for the gas data output
-            output_dir = f"{self.settings['gas_data_dir']}{env_dir}"
-            if os.path.exists(output_dir): # if directory does already exist, delete
-                os.system(f"rm -rf {output_dir}") # move to cleanup?
-            os.mkdir(output_dir)
-
-            gas_sim_dir = f"{self.settings['gaden_env_dir']}{env_dir}/gas_simulations/"
-            current_dir = glob.glob(f"{gas_sim_dir}*/*/") # ! assuming there is only one sim case and one scenario
-
-            files = os.listdir(current_dir[0])
-            iterations = [str(item) for item in [x for x in files if 'wind' not in x]] # exclude 'wind' directory
-
-            for iteration in iterations:
-                filename = f"{current_dir[0]}{iteration}"
-                header, filaments = read_gas_data(filename)
-                output_file = f"{output_dir}/{iteration}"
-                np.save(f"{output_file}_head.npy", header)
-                np.save(f"{output_file}_fil.npy", filaments)
-                
-                if savetxt:
-                    np.savetxt(f"{output_file}_head.txt", header, delimiter='\n')
-                    np.savetxt(f"{output_file}_fil.txt", filaments)
-        
+            self.cached_stage("gasdata_binary2npy", self.gasdata_binary2npy_env, env_dir, savetxt)
+
         self.printGDMStyle(f"[AutoGDM2] Converdted gas dispersal data to numpy...")
 
 
+    def gasdata_binary2npy_env(self, env_dir:str, savetxt=False) -> bool:
+        # create folder for the gas data output
+        output_dir = f"{self.settings['gas_data_dir']}{env_dir}"
+        if os.path.exists(output_dir): # if directory does already exist, delete
+            os.system(f"rm -rf {output_dir}") # move to cleanup?
+        os.mkdir(output_dir)
+
+        gas_sim_dir = f"{self.settings['gaden_env_dir']}{env_dir}/gas_simulations/"
+        current_dir = glob.glob(f"{gas_sim_dir}*/*/") # ! assuming there is only one sim case and one scenario
+
+        files = os.listdir(current_dir[0])
+        iterations = sort_numeric([str(item) for item in [x for x in files if 'wind' not in x]]) # exclude 'wind' directory
+
+        file_paths = [f"{current_dir[0]}{iteration}" for iteration in iterations]
+        workers = self.settings['pipeline_settings']['gas_workers']
+        stream = self.settings['pipeline_settings']['gas_stream']
+
+        if self.settings["gas_data_format"] == 'dataset': # one memory-mappable dataset for all iterations
+            write_gas_dataset(file_paths, output_dir, workers, stream)
+            return True
+
+        for iteration, (header, filaments) in zip(iterations, read_gas_iterations(file_paths, workers, stream)):
+            output_file = f"{output_dir}/{iteration}"
+            np.save(f"{output_file}_head.npy", header)
+            np.save(f"{output_file}_fil.npy", filaments)
+
+            if savetxt:
+                np.savetxt(f"{output_file}_head.txt", header, delimiter='\n')
+                np.savetxt(f"{output_file}_fil.txt", filaments)
+
+        return True
+
+
     def windfields_binary2npy(self):
         for env_dir in self.env_lst:
-            wind_sim_dir = f"{self.settings['gaden_env_dir']}{env_dir}/gas_simulations/"
-            files = glob.glob(f"{wind_sim_dir}*/*/wind/*") # ! assuming there is only one sim case and one scenario
+            self.cached_stage("windfields_binary2npy", self.windfields_binary2npy_env, env_dir)
 
-            windfields = read_wind_data(files)
-            output_file = f"{self.settings['wind_data_dir']}/{env_dir}.npy"
-            np.save(output_file, windfields)
-            
         self.printGDMStyle(f"[AutoGDM2] Converted wind data data to numpy...")
 
 
+    def windfields_binary2npy_env(self, env_dir:str) -> bool:
+        wind_sim_dir = f"{self.settings['gaden_env_dir']}{env_dir}/gas_simulations/"
+        files = glob.glob(f"{wind_sim_dir}*/*/wind/*") # ! assuming there is only one sim case and one scenario
+
+        if not files:
+            self.printGDMStyle(f"[AutoGDM2] No wind data found for {env_dir}.")
+            return False
+
+        # write straight into the .npy file, large transient runs never have to fit in memory
+        num_cells = os.path.getsize(files[0]) // (3 * np.dtype(np.float64).itemsize)
+        output_file = f"{self.settings['wind_data_dir']}/{env_dir}.npy"
+        windfields = np.lib.format.open_memmap(output_file, mode='w+', dtype=self.settings["wind_data_dtype"],
+                                               shape=(len(files), num_cells, 3))
+        read_wind_data(files, out=windfields)
+        windfields.flush()
+        del windfields
+        return True
+
+
     def occupancy_csv2npy(self):
         for env_dir in self.env_lst:
-            file = f"{self.settings['gaden_env_dir']}{env_dir}/OccupancyGrid3D.csv"
-
-            header, occ_grid = read_occ_csv(file)
-            output_file = f"{self.settings['occ_data_dir']}/{env_dir}_grid.npy"
-            np.save(output_file, occ_grid)
+            self.cached_stage("occupancy_csv2npy", self.occupancy_csv2npy_env, env_dir)
 
-            with open(f"{self.settings['occ_data_dir']}/{env_dir}_head.txt", 'w') as convert_file:
-                convert_file.write(json.dumps(header))
-        
         self.printGDMStyle(f"[AutoGDM2] Converting occupancy data data to numpy...")
 
 
+    def occupancy_csv2npy_env(self, env_dir:str) -> bool:
+        file = f"{self.settings['gaden_env_dir']}{env_dir}/OccupancyGrid3D.csv"
+
+        header, occ_grid = read_occ_csv(file)
+        output_file = f"{self.settings['occ_data_dir']}/{env_dir}_grid.npy"
+        np.save(output_file, occ_grid)
+
+        with open(f"{self.settings['occ_data_dir']}/{env_dir}_head.txt", 'w') as convert_file:
+            convert_file.write(json.dumps(header))
+        return True
+
+
+    # per-environment stages as a DAG: (stage, func, dependencies, cores, memory [GB])
+    def pipeline_stages(self) -> list:
+        cfd_cores = self.settings['cfd_settings']['threads']
+        cfd_mem   = self.settings['pipeline_settings']['cfd_memory']
+        gaden_mem = self.settings['pipeline_settings']['gaden_memory']
+        prep_cores= self.prep_workers()
+
+        return [("cfd_mesh",              self.cfd_mesh_env,              [],                              cfd_cores, cfd_mem),
+                ("cfd_set_params",        self.cfd_set_params_env,        ["cfd_mesh"],                    1,         0.0),
+                ("cfd_run",               self.cfd_run_env,               ["cfd_set_params"],              self.cfd_ranks, cfd_mem), # sized from the mesh
+                ("make_ros_folder",       self.make_ros_folder_env,       [],                              1,         0.0),
+                ("prep_ros",              self.prep_ros_env,              ["cfd_run", "make_ros_folder"],  prep_cores, 0.0),
+                ("run_preprocessing",     self.run_preprocessing_env,     ["prep_ros"],                    1,         gaden_mem),
+                ("run_ros",               self.run_ros_env,               ["run_preprocessing"],           1,         gaden_mem),
+                ("gasdata_binary2npy",    self.gasdata_binary2npy_env,    ["run_ros"],                     1,         0.0),
+                ("windfields_binary2npy", self.windfields_binary2npy_env, ["run_ros"],                     1,         0.0),
+                ("occupancy_csv2npy",     self.occupancy_csv2npy_env,     ["run_preprocessing"],           1,         0.0)]
+
+
+    # run all per-environment stages (cfd_mesh up to the npy conversion) concurrently
+    def run_pipeline(self) -> None:
+        pipeline_settings = self.settings['pipeline_settings']
+        scheduler = Scheduler(max_cores=pipeline_settings['max_cores'],
+                              max_memory=pipeline_settings['max_memory'],
+                              log=self.printGDMStyle)
+        stages = [(stage, partial(self.cached_stage, stage, func), deps, cores, memory) for stage, func, deps, cores, memory in self.pipeline_stages()]
+        scheduler.add_pipeline(self.env_lst, stages)
+
+        self.printGDMStyle(f"[AutoGDM2] Running pipeline for {len(self.env_lst)} environments on {scheduler.max_cores} cores...")
+        failed = scheduler.run()
+        self.remove_envs([self.env_lst.index(env) for env in failed])
+        self.printGDMStyle(f"[AutoGDM2] Completed pipeline.")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AutoGDM2 environment and gas dispersal generation")
+    parser.add_argument("--resume", action="store_true", help="keep previous results and skip stages that are up-to-date instead of cleaning up")
+    args = parser.parse_args()
+
     start_time = datetime.now()
     conf = GDMConfig()
     settings = conf.current_gdm_settings()
     
-    gdm = AutoGDM2(conf.current_gdm_settings())
+    gdm = AutoGDM2(settings, resume=args.resume) # the same settings, a random master seed is drawn once
     gdm.printGDMStyle(f"[AutoGDM2] --- CONFIG --- \n {conf.pretty(settings)}")
     
-    gdm.cleanup()                 # clean AutoGDM directories and files
+    if not args.resume:
+        gdm.cleanup()             # clean AutoGDM directories and files
     gdm.layout_gen()              # create recipes for the desired environments
     gdm.blender_asset_placer()    # create .stl files of the mockup scenes used for cfd and GADEN
     gdm.isaac_asset_placer()      # create .usd scenes for use in Isaac Sim
     
-    gdm.cfd_mesh()                # mesh the generated .stl files
-    gdm.cfd_set_params()          # set the necessary cfd parameters
-    gdm.cfd_run()                 # run the cfd simulation
-
-    gdm.make_ros_folder()         # make ROS directories to run GADEN
-    gdm.prep_ros()                # prepare ROS directory with environment-specific configurations
-    gdm.run_preprocessing()       # roslaunch GADEN preprocessing
-    gdm.run_ros()                 # roslaunch GADEN gas simulator
-
-    gdm.gasdata_binary2npy()      # convert the generated gasdata to .npy and save in ./environemnts/gas_data/
-    gdm.windfields_binary2npy()   # convert the generated windata to .npy and save in ./environments/wind_data/
-    gdm.occupancy_csv2npy()       # convert the generated occupancy grid .csv to .npy and a header, save in ./environments/occupancy/
+    if settings['pipeline_settings']['parallel']:
+        gdm.run_pipeline()        # run all stages below with environments running concurrently
+    else:
+        gdm.cfd_mesh()                # mesh the generated .stl files
+        gdm.cfd_set_params()          # set the necessary cfd parameters
+        gdm.cfd_run()                 # run the cfd simulation
+
+        gdm.make_ros_folder()         # make ROS directories to run GADEN
+        gdm.prep_ros()                # prepare ROS directory with environment-specific configurations
+        gdm.run_preprocessing()       # roslaunch GADEN preprocessing
+        gdm.run_ros()                 # roslaunch GADEN gas simulator
+
+        gdm.gasdata_binary2npy()      # convert the generated gasdata to .npy and save in ./environemnts/gas_data/
+        gdm.windfields_binary2npy()   # convert the generated windata to .npy and save in ./environments/wind_data/
+        gdm.occupancy_csv2npy()       # convert the generated occupancy grid .csv to .npy and a header, save in ./environments/occupancy/
     
     gdm.printGDMStyle(f"[AutoGDM2] FINISEHD: Generated {settings['env_amount']} {settings['env_type']} environments in: \n {datetime.now() - start_time}")
     if gdm.env_lst_failed:
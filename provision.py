@@ -0,0 +1,64 @@
+# in-process provisioning of case directories (CFD cases, ROS folders) from a template directory
+# files that are never modified in the clone are hardlinked, files that are modified get their own copy,
+# made copy-on-write (reflink) where the filesystem supports it
+import os
+import fcntl
+import shutil
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+FICLONE = 0x40049409 # linux ioctl cloning a whole file (btrfs, XFS, ...)
+
+
+# copy-on-write clone of src, a regular copy when the filesystem does not support reflinks
+def reflink_or_copy(src:str, dst:str) -> None:
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        shutil.copyfile(src, dst)
+    shutil.copymode(src, dst)
+
+
+# hardlink to src, a copy when linking is not possible (e.g. across filesystems)
+def link_or_copy(src:str, dst:str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        reflink_or_copy(src, dst)
+
+
+# places src at dst, an existing dst is replaced by a rename so files hardlinked to it are never modified
+def place_file(src:str, dst:str, link:bool=True) -> None:
+    tmp_path = f"{dst}.tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    if link:
+        link_or_copy(src, tmp_path)
+    else:
+        reflink_or_copy(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+# clones template_dir into clone_dir, modified(relative path) -> True for files that are written in the clone
+# clean: remove clone_dir first, otherwise other files in clone_dir (e.g. results) are kept
+def clone_tree(template_dir:str, clone_dir:str, modified:Callable=lambda rel_path: False, clean:bool=False) -> None:
+    if clean and os.path.lexists(clone_dir):
+        shutil.rmtree(clone_dir)
+    for root, dirs, files in os.walk(template_dir):
+        rel_dir = os.path.relpath(root, template_dir)
+        os.makedirs(os.path.join(clone_dir, rel_dir), exist_ok=True)
+        for name in files:
+            rel_path = os.path.normpath(os.path.join(rel_dir, name))
+            place_file(os.path.join(root, name), os.path.join(clone_dir, rel_path), link=not modified(rel_path))
+
+
+# threads provisioning the directories of all environments at once (file system bound, not CPU bound)
+def provision_workers(workers:int) -> int:
+    return workers if workers > 0 else len(os.sched_getaffinity(0))
+
+
+# runs func(env) for every environment in parallel, returns {env: result}
+def provision_all(func:Callable, envs:list, workers:int=0) -> dict:
+    with ThreadPoolExecutor(max_workers=provision_workers(workers)) as pool:
+        return dict(zip(envs, pool.map(func, envs)))
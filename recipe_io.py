@@ -0,0 +1,226 @@
+# compact binary recipes, shared by layout_gen.py, blender_asset_placer.py and isaac_asset_placer.py
+# only depends on numpy, json and struct so it can be imported by the Blender and Isaac Sim interpreters
+#
+# recipe (.rec):  magic | uint32 version | uint64 header length | json header | padding to 8 bytes | asset records
+#   the header holds the scalar entries, a string table (asset ids and filenames) and the amount of records per group
+#   every placed asset is one ASSET_DTYPE record, strings are indices into the string table
+# bundle (.bundle): magic | uint32 version | uint64 index offset | recipes back to back | json index
+#   the index lists the name, offset and length of every recipe, it is written last so bundles are streamed to disk
+import os
+import glob
+import json
+import struct
+import hashlib
+from functools import lru_cache
+import numpy as np
+
+RECIPE_VERSION = 1
+RECIPE_MAGIC = b"AGDMREC\0"
+BUNDLE_MAGIC = b"AGDMBND\0"
+NO_STRING = 0xFFFFFFFF # index used for None (e.g. assets without an Isaac Sim asset or mockup)
+
+# asset lists of a recipe, in the order they are stored
+ASSET_GROUPS = ["sides", "inlets", "outlets", "interior", "gaden_geom", "isaac_floor", "isaac_walls", "isaac_lights"]
+
+ASSET_DTYPE = np.dtype([
+    ("asset_id",    "<u4"),
+    ("filename",    "<u4"),
+    ("mockup_file", "<u4"),
+    ("dimensions",  "<f4", 3),
+    ("location",    "<f4", 3),
+    ("orientation", "<f4", 3),
+    ("scale",       "<f4", 3),
+])
+
+RECIPE_EXTENSIONS = {"json": "txt", "binary": "rec", "bundle": "bundle"}
+
+
+def recipe_name(recipe:dict) -> str:
+    return f"{recipe['env_type']}_{recipe['env_id']}"
+
+
+# recipe file of one environment for the 'json'/'binary' formats, the shared bundle for the 'bundle' format
+def recipe_path(recipe_dir:str, env_type:str, env:str, recipe_format:str) -> str:
+    if recipe_format == "bundle":
+        return f"{recipe_dir}{env_type}.bundle"
+    return f"{recipe_dir}{env}.{RECIPE_EXTENSIONS[recipe_format]}"
+
+
+def pad8(length:int) -> int:
+    return (8 - length % 8) % 8
+
+
+def encode_recipe(recipe:dict) -> bytes:
+    strings, string_ids = [], {}
+
+    def string_index(string) -> int:
+        if string is None:
+            return NO_STRING
+        if string not in string_ids:
+            string_ids[string] = len(strings)
+            strings.append(string)
+        return string_ids[string]
+
+    groups = {}
+    records = []
+    for group in ASSET_GROUPS:
+        assets = recipe.get(group) or []
+        group_records = np.zeros(len(assets), dtype=ASSET_DTYPE)
+        if assets:
+            for k in ["asset_id", "filename", "mockup_file"]:
+                group_records[k] = [string_index(asset[k]) for asset in assets]
+            for k in ["dimensions", "location", "orientation", "scale"]:
+                group_records[k] = [asset[k] for asset in assets]
+        groups[group] = len(assets)
+        records.append(group_records)
+
+    header = {k: v for k, v in recipe.items() if k not in ASSET_GROUPS and k != "gaden_bools"}
+    header["groups"] = groups
+    header["strings"] = strings
+    # boolean operations reference the gaden_geom assets by id
+    header["gaden_bools"] = [[a["asset_id"], b["asset_id"], op] for a, b, op in recipe.get("gaden_bools", [])]
+
+    header_bytes = json.dumps(header).encode()
+    return b"".join([RECIPE_MAGIC, struct.pack("<IQ", RECIPE_VERSION, len(header_bytes)), header_bytes,
+                     b"\0" * pad8(len(RECIPE_MAGIC) + 12 + len(header_bytes)), np.concatenate(records).tobytes()])
+
+
+def decode_recipe(data:bytes) -> dict:
+    if data[:len(RECIPE_MAGIC)] != RECIPE_MAGIC:
+        raise ValueError("Not an AutoGDM2 binary recipe")
+    version, header_length = struct.unpack_from("<IQ", data, len(RECIPE_MAGIC))
+    if version > RECIPE_VERSION:
+        raise ValueError(f"Recipe version {version} is newer than the supported version {RECIPE_VERSION}")
+
+    start = len(RECIPE_MAGIC) + 12
+    header = json.loads(data[start:start+header_length])
+    offset = start + header_length + pad8(start + header_length)
+    strings = header.pop("strings")
+    groups = header.pop("groups")
+    bools = header.pop("gaden_bools")
+
+    records = np.frombuffer(data, dtype=ASSET_DTYPE, count=sum(groups.values()), offset=offset)
+    asset_id, filename, mockup_file = [[None if i == NO_STRING else strings[i] for i in records[k].tolist()]
+                                       for k in ["asset_id", "filename", "mockup_file"]]
+    dims, loc, ori, scale = [records[k].astype(np.float64).tolist() for k in ["dimensions", "location", "orientation", "scale"]]
+
+    recipe = dict(header)
+    start = 0
+    for group in ASSET_GROUPS:
+        end = start + groups.get(group, 0)
+        recipe[group] = [{"asset_id": asset_id[i],
+                          "filename": filename[i],
+                          "mockup_file": mockup_file[i],
+                          "dimensions": dims[i],
+                          "location": loc[i],
+                          "orientation": ori[i],
+                          "scale": scale[i]} for i in range(start, end)]
+        start = end
+
+    gaden_geom = {asset["asset_id"]: asset for asset in recipe["gaden_geom"]}
+    recipe["gaden_bools"] = [[gaden_geom[a], gaden_geom[b], op] for a, b, op in bools]
+    return recipe
+
+
+def write_recipe_file(file_path:str, recipe:dict) -> None:
+    with open(file_path, 'wb') as f:
+        f.write(encode_recipe(recipe))
+
+
+# reads a .rec or a json .txt recipe
+def read_recipe_file(file_path:str) -> dict:
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if data[:len(RECIPE_MAGIC)] == RECIPE_MAGIC:
+        return decode_recipe(data)
+    return json.loads(data)
+
+
+# recipes: iterable of (name, encoded recipe), written one by one
+def write_bundle(file_path:str, recipes) -> None:
+    index = []
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(BUNDLE_MAGIC)
+        f.write(struct.pack("<IQ", RECIPE_VERSION, 0)) # index offset is filled in at the end
+        for name, data in recipes:
+            index.append({"name": name, "offset": f.tell(), "length": len(data)})
+            f.write(data)
+            f.write(b"\0" * pad8(len(data)))
+
+        index_offset = f.tell()
+        f.write(json.dumps({"recipes": index}).encode())
+        f.seek(len(BUNDLE_MAGIC))
+        f.write(struct.pack("<IQ", RECIPE_VERSION, index_offset))
+    os.replace(tmp_path, file_path) # placers never see a half-written bundle
+
+
+# list of {"name", "offset", "length"} entries, offsets are from the start of the file
+def read_bundle_index(file_path:str) -> list:
+    with open(file_path, 'rb') as f:
+        if f.read(len(BUNDLE_MAGIC)) != BUNDLE_MAGIC:
+            raise ValueError(f"Not an AutoGDM2 recipe bundle: '{file_path}'")
+        version, index_offset = struct.unpack("<IQ", f.read(12))
+        if version > RECIPE_VERSION:
+            raise ValueError(f"Bundle version {version} is newer than the supported version {RECIPE_VERSION}")
+        f.seek(index_offset)
+        return json.loads(f.read())["recipes"]
+
+
+# yields (name, encoded recipe) for every recipe in a bundle, only one recipe is held in memory
+# names: only these recipes are read, all when None
+def iter_bundle(file_path:str, names:set=None):
+    index = read_bundle_index(file_path)
+    with open(file_path, 'rb') as f:
+        for entry in index:
+            if names is not None and entry["name"] not in names:
+                continue
+            f.seek(entry["offset"])
+            yield entry["name"], f.read(entry["length"])
+
+
+# {name: sha256 of the encoded recipe} of a bundle, computed once per version (mtime, size) of the bundle
+@lru_cache(maxsize=4)
+def bundle_digests(file_path:str, mtime_ns:int, size:int) -> dict:
+    return {name: hashlib.sha256(data).hexdigest() for name, data in iter_bundle(file_path)}
+
+
+# hash of the recipe of one environment, only its own recipe: regenerating other recipes in a shared bundle does not change it
+def recipe_digest(recipe_dir:str, env_type:str, env:str, recipe_format:str) -> str:
+    file_path = recipe_path(recipe_dir, env_type, env, recipe_format)
+    if not os.path.isfile(file_path):
+        return "<missing>"
+    if recipe_format == "bundle":
+        stat = os.stat(file_path)
+        return bundle_digests(file_path, stat.st_mtime_ns, stat.st_size).get(env, "<missing>")
+    with open(file_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# yields the decoded recipes of a bundle one by one
+def read_bundle(file_path:str, names:set=None):
+    for _, data in iter_bundle(file_path, names):
+        yield decode_recipe(data)
+
+
+# yields every recipe in the recipe folder: bundles first, then binary and json recipes of other environments
+# names: only the recipes of these environments (e.g. the share of one worker), all when None
+def load_recipes(recipe_dir:str, names:set=None):
+    found = set()
+    for bundle_path in sorted(glob.glob(f"{recipe_dir}*.bundle")):
+        for name, data in iter_bundle(bundle_path, names):
+            found.add(name)
+            yield decode_recipe(data)
+    for rec_path in sorted(glob.glob(f"{recipe_dir}*.rec")) + sorted(glob.glob(f"{recipe_dir}*.txt")):
+        name = os.path.basename(rec_path).rsplit('.', 1)[0]
+        if name not in found and (names is None or name in names):
+            found.add(name)
+            yield read_recipe_file(rec_path)
+
+
+# environment names listed in a shard file (one per line), None when no file is given
+def read_shard(file_path:str=None) -> set:
+    if file_path is None:
+        return None
+    with open(file_path, 'r') as f:
+        return {line.strip() for line in f if line.strip()}
@@ -0,0 +1,161 @@
+# DAG-based scheduler for running the per-environment AutoGDM2 stages concurrently
+import os
+import threading
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Task:
+    def __init__(self,
+                 env:str,
+                 stage:str,
+                 func:Callable,
+                 deps:list   = [],
+                 cores       = 1,
+                 memory:float= 0.0,
+                 priority:tuple = (0, 0)
+                 ) -> None:
+        self.env = env
+        self.stage = stage
+        self.func = func          # called as func(env), returns False on failure
+        self.deps = list(deps)    # names of the stages (same env) this task waits for
+        self.cores = cores if callable(cores) else max(1, int(cores)) # int, or func(env) evaluated when the task is ready
+        self.memory = memory      # [GB]
+        self.priority = priority  # (env index, stage index), lower runs first
+        self.state = 'pending'    # pending -> running -> done/failed/skipped
+
+    def name(self) -> str:
+        return f"{self.env}:{self.stage}"
+
+
+class Scheduler:
+    # every task is an (environment, stage) pair, stages of one environment form a DAG,
+    # environments are independent of each other and are streamed through the pipeline
+    def __init__(self, max_cores:int=0, max_memory:float=0.0, log:Callable=print) -> None:
+        self.max_cores = max_cores if max_cores > 0 else len(os.sched_getaffinity(0))
+        self.max_memory = max_memory # [GB], 0.0 = unlimited
+        self.log = log
+        self.tasks = {}  # {(env, stage): Task}
+        self.failed_envs = []
+        self._lock = threading.Lock()
+
+
+    def add(self, task:Task) -> None:
+        # a single task can never ask for more than the total budget, otherwise it would never run
+        if not callable(task.cores):
+            task.cores = min(task.cores, self.max_cores)
+        if self.max_memory > 0.0:
+            task.memory = min(task.memory, self.max_memory)
+        self.tasks[(task.env, task.stage)] = task
+
+
+    # add the same stage DAG for every environment
+    # stages: list of (stage, func, deps, cores, memory)
+    def add_pipeline(self, env_lst:list, stages:list) -> None:
+        for env_idx, env in enumerate(env_lst):
+            for stage_idx, (stage, func, deps, cores, memory) in enumerate(stages):
+                self.add(Task(env, stage, func, deps, cores, memory, priority=(env_idx, stage_idx)))
+
+
+    def _ready(self, task:Task) -> bool:
+        return task.state == 'pending' and all(self.tasks[(task.env, dep)].state == 'done' for dep in task.deps)
+
+
+    # cores of a task whose size is only known once its dependencies are done (e.g. MPI ranks from the mesh size)
+    def _resolve_cores(self, task:Task) -> None:
+        if callable(task.cores):
+            try:
+                task.cores = task.cores(task.env)
+            except Exception as e:
+                self.log(f"[AutoGDM2] Could not size task {task.name()} ({type(e).__name__}: {e}), using all cores.")
+                task.cores = self.max_cores
+            task.cores = min(max(1, int(task.cores)), self.max_cores)
+
+
+    def _fits(self, task:Task, cores_used:int, memory_used:float) -> bool:
+        if cores_used + task.cores > self.max_cores:
+            return False
+        if self.max_memory > 0.0 and memory_used + task.memory > self.max_memory:
+            return False
+        return True
+
+
+    # skip every task of a failed environment that has not started yet
+    def _fail_env(self, env:str) -> None:
+        if env not in self.failed_envs:
+            self.failed_envs.append(env)
+        for task in self.tasks.values():
+            if task.env == env and task.state == 'pending':
+                task.state = 'skipped'
+
+
+    def _execute(self, task:Task) -> bool:
+        try:
+            return task.func(task.env) is not False
+        except Exception as e:
+            self.log(f"[AutoGDM2] Task {task.name()} raised {type(e).__name__}: {e}")
+            return False
+
+
+    # run all tasks, returns the list of environments that failed
+    def run(self) -> list:
+        running = {} # {future: task}
+        cores_used, memory_used = 0, 0.0
+
+        with ThreadPoolExecutor(max_workers=self.max_cores) as pool:
+            while True:
+                # lowest (env, stage) first so early environments reach GADEN while later ones are still in CFD,
+                # smaller tasks further down the list backfill the remaining budget
+                ready = sorted([t for t in self.tasks.values() if self._ready(t)], key=lambda t: t.priority)
+                for task in ready:
+                    self._resolve_cores(task)
+                    if self._fits(task, cores_used, memory_used):
+                        task.state = 'running'
+                        cores_used += task.cores
+                        memory_used += task.memory
+                        running[pool.submit(self._execute, task)] = task
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    cores_used -= task.cores
+                    memory_used -= task.memory
+                    with self._lock:
+                        if future.result():
+                            task.state = 'done'
+                        else:
+                            task.state = 'failed'
+                            self.log(f"[AutoGDM2] Task {task.name()} failed, skipping the remaining stages of {task.env}.")
+                            self._fail_env(task.env)
+
+        # anything left pending has an unsatisfiable dependency
+        for task in self.tasks.values():
+            if task.state == 'pending':
+                task.state = 'skipped'
+                self._fail_env(task.env)
+
+        return self.failed_envs
+
+
+class CPUSet:
+    # hands out disjoint sets of CPUs (e.g. to bind the MPI ranks of concurrent CFD cases),
+    # acquire blocks until enough CPUs are free
+    def __init__(self, cpus:list=None) -> None:
+        self.cpus = sorted(os.sched_getaffinity(0)) if cpus is None else list(cpus)
+        self.free = list(self.cpus)
+        self._cond = threading.Condition()
+
+    def acquire(self, n:int) -> list:
+        n = min(max(1, n), len(self.cpus))
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.free) >= n)
+            cpus, self.free = self.free[:n], self.free[n:]
+            return cpus
+
+    def release(self, cpus:list) -> None:
+        with self._cond:
+            self.free = sorted(self.free + list(cpus))
+            self._cond.notify_all()
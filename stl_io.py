@@ -0,0 +1,152 @@
+# reading/writing triangle meshes as ascii/binary .stl files with numpy, no Blender required
+# triangles are (n,3,3) arrays [triangle, vertex, xyz], counter-clockwise seen from the side the normal points to
+import os
+import numpy as np
+
+STL_RECORD_DTYPE = np.dtype([
+    ("normal",    "<f4", 3),
+    ("vertices",  "<f4", (3,3)),
+    ("attribute", "<u2"),
+])
+
+STL_FACET = ("facet normal %e %e %e\n"
+             " outer loop\n"
+             "  vertex %e %e %e\n"
+             "  vertex %e %e %e\n"
+             "  vertex %e %e %e\n"
+             " endloop\n"
+             "endfacet\n")
+
+STL_CHUNK = 1 << 16 # facets formatted/read at once
+COPY_CHUNK = 1 << 24 # [bytes] copied at once when combining ascii files
+
+
+# unit normals of the triangles, zero for degenerate triangles
+def facet_normals(triangles:np.ndarray) -> np.ndarray:
+    normals = np.cross(triangles[:,1] - triangles[:,0], triangles[:,2] - triangles[:,0])
+    length = np.linalg.norm(normals, axis=-1, keepdims=True)
+    return np.divide(normals, length, out=np.zeros_like(normals), where=length > 0) + 0.0 # + 0.0: no negative zeros
+
+
+# ascii facets of the triangles, formatted in chunks of STL_CHUNK facets
+def ascii_facets(triangles:np.ndarray, normals:np.ndarray=None):
+    normals = facet_normals(triangles) if normals is None else normals
+    facets = np.concatenate([normals, triangles.reshape(-1, 9)], axis=1)
+    for start in range(0, len(facets), STL_CHUNK):
+        chunk = facets[start:start+STL_CHUNK]
+        yield (STL_FACET * len(chunk)) % tuple(chunk.ravel().tolist())
+
+
+class STLWriter:
+    # writes the same triangles to any number of ascii and binary .stl files in one pass
+    # triangles are written in chunks as they are generated, the binary facet count is filled in when closing
+    # name: solid name in the ascii files/header of the binary files (e.g. the patch name used by cfMesh)
+    def __init__(self, name:str="", ascii_paths:list=[], binary_paths:list=[]) -> None:
+        self.name = name
+        self.count = 0
+        self.ascii_files = [open(path, 'w') for path in ascii_paths]
+        self.binary_files = [open(path, 'wb') for path in binary_paths]
+        for f in self.ascii_files:
+            f.write(f"solid {name}\n")
+        for f in self.binary_files:
+            f.write(name.encode()[:80].ljust(80, b"\0"))
+            f.write(np.uint32(0).tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def write(self, triangles:np.ndarray) -> None:
+        triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 3)
+        normals = facet_normals(triangles)
+        self.count += len(triangles)
+
+        if self.ascii_files:
+            for text in ascii_facets(triangles, normals): # formatted once for all ascii files
+                for f in self.ascii_files:
+                    f.write(text)
+
+        if self.binary_files:
+            records = np.zeros(len(triangles), dtype=STL_RECORD_DTYPE)
+            records["normal"] = normals
+            records["vertices"] = triangles
+            data = records.tobytes()
+            for f in self.binary_files:
+                f.write(data)
+
+    def close(self) -> None:
+        for f in self.ascii_files:
+            f.write(f"endsolid {self.name}\n")
+            f.close()
+        for f in self.binary_files:
+            f.seek(80)
+            f.write(np.uint32(self.count).tobytes())
+            f.close()
+        self.ascii_files, self.binary_files = [], []
+
+
+def write_stl(file_path:str, triangles:np.ndarray, name:str="", text:bool=True) -> None:
+    with STLWriter(name, [file_path] if text else [], [] if text else [file_path]) as writer:
+        writer.write(triangles)
+
+
+# binary files have exactly 84 bytes + 50 bytes per facet (ascii files may also start with 'solid' in the header)
+def is_binary_stl(file_path:str) -> bool:
+    size = os.path.getsize(file_path)
+    if size < 84:
+        return False
+    with open(file_path, 'rb') as f:
+        f.seek(80)
+        count = int(np.frombuffer(f.read(4), dtype="<u4")[0])
+    return size == 84 + 50 * count
+
+
+# yields the triangles of a binary .stl in chunks of STL_CHUNK facets
+def iter_binary_stl(file_path:str):
+    with open(file_path, 'rb') as f:
+        f.seek(80)
+        count = int(np.frombuffer(f.read(4), dtype="<u4")[0])
+        for start in range(0, count, STL_CHUNK):
+            records = np.fromfile(f, dtype=STL_RECORD_DTYPE, count=min(STL_CHUNK, count - start))
+            yield records["vertices"].astype(np.float64)
+
+
+# copies the facets of an ascii .stl (everything between the 'solid' and the last 'endsolid' line) to out
+def copy_ascii_facets(file_path:str, out) -> None:
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        if not f.readline().lstrip().startswith(b"solid"):
+            raise ValueError(f"Not an ascii .stl file: '{file_path}'")
+        start = f.tell()
+        tail_start = max(start, size - 4096)
+        f.seek(tail_start)
+        end = f.read().rfind(b"endsolid")
+        end = size if end < 0 else tail_start + end
+
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(COPY_CHUNK, remaining))
+            out.write(chunk)
+            remaining -= len(chunk)
+        if end > start and not chunk.endswith(b"\n"):
+            out.write(b"\n")
+
+
+# writes a multi-solid ascii .stl (e.g. combined.stl for cfMesh) from ascii and binary .stl files in one pass
+# stls: list of (solid name, file path), every solid is renamed, nothing is loaded into memory as a whole
+def combine_stls(file_path:str, stls:list) -> None:
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'wb') as out:
+        for name, stl_path in stls:
+            out.write(f"solid {name}\n".encode())
+            if is_binary_stl(stl_path):
+                for triangles in iter_binary_stl(stl_path):
+                    for text in ascii_facets(triangles):
+                        out.write(text.encode())
+            else:
+                copy_ascii_facets(stl_path, out)
+            out.write(f"endsolid {name}\n".encode())
+    os.replace(tmp_path, file_path)
@@ -1,10 +1,13 @@
 import yaml
 import json
 import os
+import re
 import math
-import csv
 import zlib
 from typing import Tuple
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from datetime import datetime
 from pathlib import Path
@@ -47,6 +50,7 @@ class GDMConfig:
         self.gdm_settings["occ_data_dir"]       = yamldict["directories"]["occ_data_dir"].format(AutoGDM2_dir=self.AutoGDM2_dir)
         self.gdm_settings["empty_ros_dir"]      = yamldict["directories"]["empty_ros_dir"].format(AutoGDM2_dir=self.AutoGDM2_dir)
         self.gdm_settings["gaden_env_dir"]      = yamldict["directories"]["gaden_env_dir"].format(AutoGDM2_dir=self.AutoGDM2_dir)
+        self.gdm_settings["manifest_dir"]       = yamldict["directories"]["manifest_dir"].format(AutoGDM2_dir=self.AutoGDM2_dir)
 
 
     def set_application_params(self, yamldict:dict) -> None:
@@ -67,6 +71,11 @@ class GDMConfig:
         self.gdm_settings["env_amount"] = yamldict["environment"]["env_amount"]
         self.gdm_settings["env_size"]   = yamldict["environment"]["env_size"]
         self.gdm_settings["env_list"]   = [f"{self.gdm_settings['env_type']}_{str(i).zfill(4)}" for i in range(self.gdm_settings['env_amount'])]
+        self.gdm_settings["recipe_format"] = yamldict["environment"]["recipe_format"]
+        # master seed of the layouts, a random one is drawn (and stored in the settings) when left empty
+        seed = yamldict["environment"]["seed"]
+        self.gdm_settings["seed"]       = int(np.random.SeedSequence().entropy) if seed is None else seed
+        self.gdm_settings["random_seed"] = seed is None # a resumed run reuses the recorded seed instead
 
         # if self.gdm_settings["env_type"] == 'wh_empty' or self.gdm_settings["env_type"] == 'wh_simple':
         self.gdm_settings["inlet_size"]         = yamldict["env_wh"]["inlet_size"]
@@ -74,6 +83,13 @@ class GDMConfig:
         self.gdm_settings["outlet_size"]        = yamldict["env_wh"]["outlet_size"]
         self.gdm_settings["emptyfullrackdiv"]   = yamldict["env_wh"]["emptyfullrackdiv"]
         self.gdm_settings["white_walls"]        = yamldict["env_wh"]["white_walls"]
+        self.gdm_settings["prop_clearance"]     = yamldict["env_wh"]["prop_clearance"]
+        self.gdm_settings["aisle_width"]        = yamldict["env_wh"]["aisle_width"]
+        self.gdm_settings["perimeter_width"]    = yamldict["env_wh"]["perimeter_width"]
+        self.gdm_settings["rack_density"]       = yamldict["env_wh"]["rack_density"]
+        self.gdm_settings["prop_spacing"]       = yamldict["env_wh"]["prop_spacing"]
+        self.gdm_settings["prop_density"]       = yamldict["env_wh"]["prop_density"]
+        self.gdm_settings["forklifts"]          = yamldict["env_wh"]["forklifts"]
 
 
     def set_cfd_params(self,yamldict:dict) -> None:
@@ -97,6 +113,7 @@ class GDMConfig:
 
         self.gdm_settings["cfd_settings"] = {
             "threads":          threads,
+            "cells_per_rank":   yamldict["cfd"]["solving"]["cells_per_rank"],
             "endTime":          yamldict["cfd"]["solving"]["endTime"], 
             "writeInterval":    yamldict["cfd"]["solving"]["writeInterval"],
             "maxCo":            yamldict["cfd"]["solving"]["maxCo"],
@@ -105,7 +122,12 @@ class GDMConfig:
             "k":                cfd_k,
             "epsilon":          cfd_epsilon,
             "latestTime":       yamldict["cfd"]["solving"]["latestTime"],
-            "timeRange":        yamldict["cfd"]["solving"]["timeRange"]
+            "timeRange":        yamldict["cfd"]["solving"]["timeRange"],
+            "reconstruct":      yamldict["cfd"]["solving"]["reconstruct"],
+            "convergenceWindow":yamldict["cfd"]["solving"]["convergenceWindow"],
+            "residualTol":      yamldict["cfd"]["solving"]["residualTol"],
+            "velocityTol":      yamldict["cfd"]["solving"]["velocityTol"],
+            "probeInterval":    yamldict["cfd"]["solving"]["probeInterval"],
         }
 
     def set_gas_dispersal_params(self, yamldict:dict) -> None:
@@ -119,6 +141,25 @@ class GDMConfig:
         self.gdm_settings["wind_looping"]        = yamldict["gas_dispersal"]["wind_looping"]
         self.gdm_settings["wind_start_step"]     = yamldict["gas_dispersal"]["wind_start_step"]
         self.gdm_settings["wind_stop_step"]      = yamldict["gas_dispersal"]["wind_stop_step"]
+        self.gdm_settings["wind_file_format"]    = yamldict["gas_dispersal"]["wind_file_format"]
+        self.gdm_settings["gas_data_format"]     = yamldict["gas_dispersal"]["gas_data_format"]
+        self.gdm_settings["wind_data_dtype"]     = yamldict["gas_dispersal"]["wind_data_dtype"]
+
+    def set_pipeline_params(self, yamldict:dict) -> None:
+        # scheduling of the per-environment stages
+        self.gdm_settings["pipeline_settings"] = {
+            "parallel":     yamldict["pipeline"]["parallel"],
+            "max_cores":    yamldict["pipeline"]["max_cores"],
+            "max_memory":   yamldict["pipeline"]["max_memory"],
+            "cfd_memory":   yamldict["pipeline"]["cfd_memory"],
+            "gaden_memory": yamldict["pipeline"]["gaden_memory"],
+            "layout_workers": yamldict["pipeline"]["layout_workers"],
+            "stl_workers":  yamldict["pipeline"]["stl_workers"],
+            "prep_workers": yamldict["pipeline"]["prep_workers"],
+            "provision_workers": yamldict["pipeline"]["provision_workers"],
+            "gas_workers":  yamldict["pipeline"]["gas_workers"],
+            "gas_stream":   yamldict["pipeline"]["gas_stream"],
+        }
 
     def set_asset_params(self, yamldict: dict) -> None:
         # assets
@@ -190,6 +231,7 @@ class GDMConfig:
         self.set_environment_params(yamldict)
         self.set_cfd_params(yamldict)
         self.set_gas_dispersal_params(yamldict)
+        self.set_pipeline_params(yamldict)
         self.set_asset_params(yamldict)
 
 
@@ -209,13 +251,6 @@ class GDMConfig:
         return self.gdm_settings
 
 
-# TODO improve this implementation
-# simple ( probably unnecessary ) class to store a timestep ()
-class flow_field:
-    def __init__(self,id):
-        self.id = id
-
-
 def is_float(element:any) -> bool:
     #If you expect None to be passed:
     if element is None: 
@@ -227,103 +262,248 @@ def is_float(element:any) -> bool:
         return False
 
 
-# reads compressed gas data
-def read_gas_data(file_path) -> Tuple[np.ndarray,np.ndarray]:
-    with open(file_path, 'rb') as file:
-        compressed_data = file.read()
-
-    # first decompress the file
-    decompressed_data = zlib.decompress(compressed_data)
-
-    # header datatype
-    header_dtype = np.dtype([('h', np.uint32),
-                            ('env_min_x', np.float64),
-                            ('env_min_y', np.float64),
-                            ('env_min_z', np.float64),
-                            ('env_max_x', np.float64),
-                            ('env_max_y', np.float64),
-                            ('env_max_z', np.float64),
-                            ('env_cells_x', np.uint32),
-                            ('env_cells_y', np.uint32),
-                            ('env_cells_z', np.uint32),
-                            ('cell_size_x', np.float64),
-                            ('cell_size_y', np.float64),
-                            ('cell_size_z', np.float64),
-                            ('gas_source_pos_x', np.float64),
-                            ('gas_source_pos_y', np.float64),
-                            ('gas_source_pos_z', np.float64),
-                            ('gas_type', np.uint32),
-                            ('filament_num_moles_of_gas', np.float64),
-                            ('num_moles_all_gases_in_cm3', np.float64),
-                            ('binary_bool', np.uint32)])
-
-    # filament datatype
-    filament_dtype = np.dtype([('id', np.uint32),
-                            ('pose_x', np.float64),
-                            ('pose_y', np.float64),
-                            ('pose_z', np.float64),
-                            ('sigma', np.float64)])
-
-    # TODO - combine all gas iterations into one array for a potential speed increase
-    # read data from buffer
-    filament_header = np.frombuffer(decompressed_data, dtype=header_dtype, count=1)
-    filament_data = np.frombuffer(decompressed_data, dtype=filament_dtype, 
-                                offset=header_dtype.itemsize)
+# binary wind files for GADEN preprocessing: int32 count followed by count*3 float32 values (x,y,z interleaved)
+def write_gaden_wind(file_path, vectors:np.ndarray) -> None:
+    with open(file_path, 'wb') as file:
+        file.write(np.int32(vectors.shape[0]).tobytes())
+        file.write(np.ascontiguousarray(vectors, dtype='<f4').tobytes())
 
-    # return the extracted data
-    return filament_header, filament_data
+
+def read_gaden_wind(file_path) -> np.ndarray:
+    with open(file_path, 'rb') as file:
+        count = int(np.frombuffer(file.read(4), dtype='<i4')[0])
+        return np.fromfile(file, dtype='<f4', count=3*count).reshape(count, 3)
+
+
+# header datatype of the compressed GADEN gas data
+GAS_HEADER_DTYPE = np.dtype([('h', np.uint32),
+                             ('env_min_x', np.float64),
+                             ('env_min_y', np.float64),
+                             ('env_min_z', np.float64),
+                             ('env_max_x', np.float64),
+                             ('env_max_y', np.float64),
+                             ('env_max_z', np.float64),
+                             ('env_cells_x', np.uint32),
+                             ('env_cells_y', np.uint32),
+                             ('env_cells_z', np.uint32),
+                             ('cell_size_x', np.float64),
+                             ('cell_size_y', np.float64),
+                             ('cell_size_z', np.float64),
+                             ('gas_source_pos_x', np.float64),
+                             ('gas_source_pos_y', np.float64),
+                             ('gas_source_pos_z', np.float64),
+                             ('gas_type', np.uint32),
+                             ('filament_num_moles_of_gas', np.float64),
+                             ('num_moles_all_gases_in_cm3', np.float64),
+                             ('binary_bool', np.uint32)])
+
+# filament datatype
+FILAMENT_DTYPE = np.dtype([('id', np.uint32),
+                           ('pose_x', np.float64),
+                           ('pose_y', np.float64),
+                           ('pose_z', np.float64),
+                           ('sigma', np.float64)])
+
+
+# decompresses a file chunk by chunk, only one compressed chunk is held in memory at a time
+def decompress_stream(file_path, chunk_size:int=1 << 20) -> bytearray:
+    decompressor = zlib.decompressobj()
+    decompressed_data = bytearray()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            decompressed_data += decompressor.decompress(chunk)
+    decompressed_data += decompressor.flush()
+    return decompressed_data
 
 
-def read_wind_data(file_paths) -> np.ndarray:
-    windfields_lst = []
-    
-    # read files and put into list
-    for file_path in file_paths:
+# reads compressed gas data
+# stream: decompress chunk by chunk instead of reading the whole compressed file first
+def read_gas_data(file_path, stream:bool=False) -> Tuple[np.ndarray,np.ndarray]:
+    if stream:
+        decompressed_data = decompress_stream(file_path)
+    else:
         with open(file_path, 'rb') as file:
-            data = file.read()
+            compressed_data = file.read()
 
-        UVW = np.split(np.frombuffer(data, dtype=np.float64), 3)
+        # first decompress the file
+        decompressed_data = zlib.decompress(compressed_data)
 
-        wind_vectors = np.zeros((np.shape(UVW)[1],3))
-        wind_vectors[:,0] = UVW[0]
-        wind_vectors[:,1] = UVW[1]
-        wind_vectors[:,2] = UVW[2]
+    # read data from buffer
+    filament_header = np.frombuffer(decompressed_data, dtype=GAS_HEADER_DTYPE, count=1)
+    filament_data = np.frombuffer(decompressed_data, dtype=FILAMENT_DTYPE, 
+                                offset=GAS_HEADER_DTYPE.itemsize)
 
-        windfields_lst.append(wind_vectors)
+    # return the extracted data
+    return filament_header, filament_data
+
+
+# number at the end of a file name, e.g. 'iteration_12' -> 12 (-1 when there is none)
+def file_number(file_path:str) -> int:
+    digits = re.findall(r"\d+", os.path.basename(file_path))
+    return int(digits[-1]) if digits else -1
+
+
+# reads many gas iterations with a thread pool (zlib releases the GIL), yields (header, filaments) in order
+# at most 2*workers iterations are in flight, so memory stays bounded for thousands of files
+def read_gas_iterations(file_paths:list, workers:int=0, stream:bool=False):
+    workers = workers if workers > 0 else len(os.sched_getaffinity(0))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for file_path in file_paths:
+            pending.append(pool.submit(read_gas_data, file_path, stream))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# GADEN iteration files sorted by their number instead of os.listdir order
+def sort_numeric(file_paths:list) -> list:
+    return sorted(file_paths, key=lambda file_path: (file_number(file_path), file_path))
+
+
+# writes all gas iterations of an environment into one dataset directory:
+#   filaments.bin  - all filaments (FILAMENT_DTYPE) back to back, np.memmap-able
+#   offsets.npy    - (T+1,) filament offsets, iteration k is filaments[offsets[k]:offsets[k+1]]
+#   headers.npy    - (T,) headers (GAS_HEADER_DTYPE)
+#   iterations.npy - (T,) GADEN iteration numbers
+def write_gas_dataset(file_paths:list, output_dir:str, workers:int=0, stream:bool=False) -> None:
+    file_paths = sort_numeric(file_paths)
+    headers = np.zeros(len(file_paths), dtype=GAS_HEADER_DTYPE)
+    offsets = np.zeros(len(file_paths) + 1, dtype=np.int64)
+    iterations = np.array([file_number(file_path) for file_path in file_paths], dtype=np.int64)
+
+    with open(f"{output_dir}/filaments.bin", 'wb') as fil_file:
+        for i, (header, filaments) in enumerate(read_gas_iterations(file_paths, workers, stream)):
+            headers[i] = header[0]
+            offsets[i+1] = offsets[i] + filaments.shape[0]
+            fil_file.write(filaments.tobytes())
+
+    np.save(f"{output_dir}/headers.npy", headers)
+    np.save(f"{output_dir}/offsets.npy", offsets)
+    np.save(f"{output_dir}/iterations.npy", iterations)
+
+
+# random access to a dataset written by write_gas_dataset without loading it into memory
+class GasDataset:
+    def __init__(self, dataset_dir:str):
+        self.headers = np.load(f"{dataset_dir}/headers.npy")
+        self.offsets = np.load(f"{dataset_dir}/offsets.npy")
+        self.iterations = np.load(f"{dataset_dir}/iterations.npy")
+        if self.offsets[-1] > 0:
+            self.filaments = np.memmap(f"{dataset_dir}/filaments.bin", dtype=FILAMENT_DTYPE, mode='r', shape=(int(self.offsets[-1]),))
+        else: # np.memmap cannot map an empty file
+            self.filaments = np.zeros(0, dtype=FILAMENT_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.headers)
+
+    # header and filaments of the k-th iteration (in numeric order)
+    def __getitem__(self, k:int) -> Tuple[np.ndarray,np.ndarray]:
+        return self.headers[k:k+1], self.filaments[self.offsets[k]:self.offsets[k+1]]
+
+
+# gas concentration [ppm] on the grid of the gas data header, same Gaussian filament model as the GADEN player:
+#   ppm = n_moles / (sqrt(8 pi^3) sigma^3) * exp(-d^2 / (2 sigma^2)) / num_moles_all_gases_in_cm3 * 1e6  (sigma, d in cm)
+# evaluated at the cell centres, kernels are truncated at 'cutoff' sigma (the player uses 5)
+# returns a (z, x, y) array like read_occ_csv, occupied/outlet cells are zeroed when an occupancy grid is given
+# (the player's line-of-sight check between filament and cell is not applied)
+def filaments_to_concentration(header:np.ndarray, filaments:np.ndarray, occupancy:np.ndarray=None,
+                               cutoff:float=5.0, dtype=np.float32, batch_size:int=1 << 22) -> np.ndarray:
+    h = header[0] if header.ndim else header
+    cells = np.array([h['env_cells_x'], h['env_cells_y'], h['env_cells_z']], dtype=np.int64)
+    cell_size = np.array([h['cell_size_x'], h['cell_size_y'], h['cell_size_z']])
+    env_min = np.array([h['env_min_x'], h['env_min_y'], h['env_min_z']])
+    concentration = np.zeros(int(np.prod(cells)), dtype=np.float64)
+
+    if filaments.shape[0] > 0:
+        pos = np.stack([filaments['pose_x'], filaments['pose_y'], filaments['pose_z']], axis=1)
+        sigma = np.asarray(filaments['sigma'], dtype=np.float64) # [cm]
+        peak = h['filament_num_moles_of_gas'] / (np.sqrt(8 * np.pi**3) * sigma**3) / h['num_moles_all_gases_in_cm3'] * 1e6
+        centre_idx = np.floor((pos - env_min) / cell_size).astype(np.int64)
+
+        # filaments are grouped by the size of their kernel window (in cells) so each group is one vectorized pass
+        radius = np.ceil(cutoff * sigma[:, None] / 100 / cell_size).astype(np.int64) # (n,3)
+        radius_keys, group = np.unique(radius, axis=0, return_inverse=True)
+        for key_idx, r in enumerate(radius_keys):
+            members = np.flatnonzero(group.ravel() == key_idx)
+            offsets = np.stack(np.meshgrid(*[np.arange(-ri, ri + 1) for ri in r], indexing='ij'), axis=-1).reshape(-1, 3)
+            chunk = max(1, batch_size // len(offsets)) # bounds the (filaments x window) temporaries
+
+            for start in range(0, len(members), chunk):
+                m = members[start:start + chunk]
+                idx = centre_idx[m, None, :] + offsets[None, :, :]                  # (n, K, 3) cell indices
+                dist_cm = 100 * np.linalg.norm(env_min + (idx + 0.5) * cell_size - pos[m, None, :], axis=-1)
+                s = sigma[m, None]
+                valid = np.all((idx >= 0) & (idx < cells), axis=-1) & (dist_cm < cutoff * s)
+                values = peak[m, None] * np.exp(-dist_cm**2 / (2 * s**2))
+
+                idx, values = idx[valid], values[valid]
+                flat = (idx[:, 2] * cells[0] + idx[:, 0]) * cells[1] + idx[:, 1] # (z, x, y) ordering
+                concentration += np.bincount(flat, weights=values, minlength=concentration.size)
+
+    concentration = concentration.reshape(cells[2], cells[0], cells[1]).astype(dtype)
+    if occupancy is not None:
+        concentration[occupancy != 0] = 0
+    return concentration
+
+
+# filaments_to_concentration for every iteration, iterations: GasDataset or list of (header, filaments)
+# out: optional preallocated (T, z, x, y) array, e.g. np.lib.format.open_memmap, to avoid holding everything in memory
+def filaments_to_concentration_batch(iterations, occupancy:np.ndarray=None, cutoff:float=5.0,
+                                     dtype=np.float32, out:np.ndarray=None) -> np.ndarray:
+    for k in range(len(iterations)):
+        header, filaments = iterations[k]
+        concentration = filaments_to_concentration(header, filaments, occupancy, cutoff, dtype)
+        if out is None:
+            out = np.zeros((len(iterations),) + concentration.shape, dtype=dtype)
+        out[k] = concentration
+    return out
+
+
+# reads GADEN wind files (U, V and W float64 blocks back to back) into one (T, N, 3) array
+# files are sorted by their timestep suffix, the result is allocated once (or passed in as out, e.g. an open_memmap)
+def read_wind_data(file_paths:list, dtype=np.float64, out:np.ndarray=None) -> np.ndarray:
+    file_paths = sort_numeric(file_paths)
+    num_cells = os.path.getsize(file_paths[0]) // (3 * np.dtype(np.float64).itemsize)
+
+    windfields_arr = np.empty((len(file_paths), num_cells, 3), dtype=dtype) if out is None else out
+
+    for i, file_path in enumerate(file_paths):
+        UVW = np.memmap(file_path, dtype=np.float64, mode='r', shape=(3, num_cells))
+        windfields_arr[i] = UVW.T # strided view of the file, converted in a single copy
+        del UVW
 
-    windfields_arr = np.zeros((len(file_paths), np.shape(windfields_lst[0])[0], 3))
-    
-    # puts lists into one array
-    for i, windfield in enumerate(windfields_lst):
-        windfields_arr[i] = windfield
-        
     # return the extracted data
     return windfields_arr
 
 
-def read_occ_csv(filepath) -> Tuple[dict,np.ndarray]:
+# streams OccupancyGrid3D.csv slab by slab (0=free, 1=occupied, 2=outlet) into a (z, x, y) uint8 array
+# packbits: return the occupied mask (value != 0) bit-packed along y instead, shape (z, x, ceil(y/8))
+def read_occ_csv(filepath, packbits:bool=False) -> Tuple[dict,np.ndarray]:
     header = {}
     
     with open(filepath, 'r') as csv_file:
-        csv_lst = list(csv.reader(csv_file))
-
         # extract header info
-        header['env_min'] = [float(j) for j in csv_lst[0][0].split(" ")[1:]]
-        header['env_max'] = [float(j) for j in csv_lst[1][0].split(" ")[1:]]
-        header['num_cells'] = [int(j) for j in csv_lst[2][0].split(" ")[1:]]
-        header['cell_size'] = float(csv_lst[3][0].split(" ")[1:][0])
-
-        occ_arr = np.zeros((header['num_cells'][2],
-                            header['num_cells'][0],
-                            header['num_cells'][1]), dtype=int)
-
-        for z_it in range(header['num_cells'][2]):
-            x_it = 0
-            while True:    
-                row = csv_lst[(4 + z_it*(header['num_cells'][0]+1)) + x_it][0]
-                if row == ';':
-                    break
-                occ_arr[z_it,x_it,:] = [int(j) for j in row.split(" ")[:-1]]
-                x_it += 1
+        header['env_min'] = [float(j) for j in csv_file.readline().split()[1:]]
+        header['env_max'] = [float(j) for j in csv_file.readline().split()[1:]]
+        header['num_cells'] = [int(j) for j in csv_file.readline().split()[1:]]
+        header['cell_size'] = float(csv_file.readline().split()[1])
+
+        nx, ny, nz = header['num_cells']
+        if packbits:
+            occ_arr = np.zeros((nz, nx, (ny + 7) // 8), dtype=np.uint8)
+        else:
+            occ_arr = np.zeros((nz, nx, ny), dtype=np.uint8)
+
+        # every z-slab is nx lines of ny values followed by a ';' line, parsed in one go
+        for z_it in range(nz):
+            slab = ''.join(islice(csv_file, nx))
+            separator = csv_file.readline().strip()
+            if separator != ';':
+                raise ValueError(f"Expected ';' after z-slab {z_it} in {filepath}, found '{separator}'")
+
+            values = np.fromstring(slab, dtype=np.uint8, sep=' ').reshape(nx, ny)
+            occ_arr[z_it] = np.packbits(values != 0, axis=-1) if packbits else values
 
     return header, occ_arr
@@ -7,6 +7,8 @@ argv = sys.argv
 argv = argv[argv.index("--") + 1:] # get all the args after " -- "
 recipe_dir = argv[0]    # recipe folder
 usd_dir = argv[1]  # isaac sim export folder
+if len(argv) > 2:
+    sys.path.insert(0, argv[2]) # AutoGDM2 folder, contains recipe_io
 
 # Launch Isaac Sim before any other imports
 # Default first two lines in any standalone application
@@ -14,8 +16,6 @@ from omni.isaac.kit import SimulationApp
 simulation_app = SimulationApp({"headless": True})
 
 import os, platform
-import glob
-import json
 import random
 import numpy as np
 import carb
@@ -23,6 +23,7 @@ import omni.ext
 import omni.ui as ui
 from omni.ui.workspace_utils import RIGHT
 from pxr import Usd, UsdGeom, UsdLux, Gf
+from recipe_io import load_recipes
 # from wh_recipes import warehouse_recipe_custom as wh_rec
 # from wh_recipes import warehouse_recipe_simple as wh_simp
 
@@ -141,13 +142,8 @@ class wh_helpers():
 ##################################################################
 if __name__ == "__main__":
     _wh_helpers = wh_helpers()
-    recipes = glob.glob(f"{recipe_dir}*.txt") # gather all recipes
 
-    for rec_loc in recipes:
-        with open(rec_loc) as f: # reading the recipe from the file
-            data = f.read()
-        recipe = json.loads(data) # reconstructing the data as a dictionary
-        
+    for recipe in load_recipes(recipe_dir): # bundles, binary and json recipes
         _wh_helpers.clear_stage()
         
         # place lighting